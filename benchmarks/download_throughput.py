@@ -0,0 +1,111 @@
+"""
+Measures the download throughput of `DownloadEngine` against a local HTTP server,
+compared with the thread pool strategy used by `earthaccess.download()`.
+
+Run from the repository root:
+
+    python benchmarks/download_throughput.py --files 32 --size-mb 8 --bandwidth-mb 20
+
+Use `--files 1 --size-mb 512` to measure byte-range downloads of a single large file.
+"""
+
+import argparse
+import asyncio
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from http_server import random_files, serve  # noqa: E402
+
+from prefect_earthdata.downloads import DownloadEngine  # noqa: E402
+from prefect_earthdata.limits import BandwidthLimiter  # noqa: E402
+
+
+def thread_pool_download(urls, local_path, threads):
+    """Downloads the URLs the same way `earthaccess.download()` does."""
+
+    def download_file(url):
+        """Downloads a URL in a streamed request."""
+        path = Path(local_path, url.split("/")[-1])
+        with requests.Session().get(url, stream=True) as response:
+            response.raise_for_status()
+            with open(path, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=1024 * 1024)
+        return str(path)
+
+    with ThreadPoolExecutor(threads) as executor:
+        return list(executor.map(download_file, urls))
+
+
+def report(name, elapsed, total_bytes):
+    """Prints the throughput of a run."""
+    print(f"{name:<40} {elapsed:8.2f} s {total_bytes / elapsed / 2**20:10.1f} MiB/s")
+
+
+def main():
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=32)
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument(
+        "--bandwidth-mb",
+        type=float,
+        default=20,
+        help="Per-connection bandwidth cap in MiB/s, 0 to disable",
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--chunk-mb", type=float, default=16)
+    parser.add_argument("--max-chunks-per-file", type=int, default=4)
+    parser.add_argument(
+        "--max-bandwidth-mb",
+        type=float,
+        default=0,
+        help="Bandwidth cap of DownloadEngine in MiB/s, 0 to disable",
+    )
+    args = parser.parse_args()
+
+    files = random_files(args.files, int(args.size_mb * 2**20))
+    total_bytes = sum(map(len, files.values()))
+    bandwidth = args.bandwidth_mb * 2**20 or None
+    limiter = None
+    if args.max_bandwidth_mb:
+        limiter = BandwidthLimiter(args.max_bandwidth_mb * 2**20)
+
+    with serve(files, latency=args.latency, bandwidth=bandwidth) as server:
+        urls = [server.url(name) for name in files]
+        for concurrency in args.concurrency:
+            with tempfile.TemporaryDirectory() as local_path:
+                start = time.perf_counter()
+                thread_pool_download(urls, local_path, concurrency)
+                report(
+                    f"thread pool, {concurrency} threads",
+                    time.perf_counter() - start,
+                    total_bytes,
+                )
+
+            with tempfile.TemporaryDirectory() as local_path:
+                engine = DownloadEngine(
+                    max_concurrency=concurrency,
+                    chunk_size=int(args.chunk_mb * 2**20),
+                    max_chunks_per_file=args.max_chunks_per_file,
+                    bandwidth=limiter,
+                )
+                start = time.perf_counter()
+                asyncio.run(engine.download(urls, local_path))
+                report(
+                    f"DownloadEngine, concurrency {concurrency}",
+                    time.perf_counter() - start,
+                    total_bytes,
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Local HTTP server standing in for a DAAC in the benchmarks.
+
+Files are generated in memory and served with support for single byte-range
+requests. An optional per-request latency and per-connection bandwidth cap
+mimic the behavior of remote servers, which a loopback interface lacks.
+"""
+
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional
+
+WRITE_SIZE = 256 * 1024
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the in-memory files of a `BenchmarkServer`.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Silences the default per-request logging."""
+
+    def do_GET(self):
+        """Serves a whole file or a byte range of it."""
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        content = server.files.get(self.path.lstrip("/"))
+        if content is None:
+            self.send_error(404)
+            return
+
+        start, end = 0, len(content) - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match and server.accept_ranges:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes" if server.accept_ranges else "none")
+        self.end_headers()
+
+        view = memoryview(content)[start : end + 1]
+        for offset in range(0, len(view), WRITE_SIZE):
+            piece = view[offset : offset + WRITE_SIZE]
+            self.wfile.write(piece)
+            if server.bandwidth:
+                time.sleep(len(piece) / server.bandwidth)
+
+
+class BenchmarkServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the benchmark files in memory.
+
+    Args:
+        files: Mapping of file names to their content.
+        latency: Seconds waited before answering each request.
+        bandwidth: Maximum bytes per second sent over a single connection.
+        accept_ranges: Whether byte-range requests are honored.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        files: Dict[str, bytes],
+        latency: float = 0.0,
+        bandwidth: Optional[float] = None,
+        accept_ranges: bool = True,
+    ):
+        super().__init__(("127.0.0.1", 0), RangeRequestHandler)
+        self.files = files
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.accept_ranges = accept_ranges
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def url(self, name: str) -> str:
+        """Returns the URL of a served file."""
+        return f"http://127.0.0.1:{self.server_port}/{name}"
+
+
+def random_files(count: int, size: int) -> Dict[str, bytes]:
+    """Generates `count` files of `size` random bytes."""
+    return {f"granule_{i:04d}.h5": os.urandom(size) for i in range(count)}
+
+
+@contextmanager
+def serve(files: Dict[str, bytes], **kwargs) -> Iterator[BenchmarkServer]:
+    """Runs a `BenchmarkServer` in a background thread."""
+    server = BenchmarkServer(files, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,112 @@
+"""
+Measures the number of requests and the latency of batches of small reads
+of a remote file, as HDF5 readers issue them, through `read_ranges()`
+compared with one request per read.
+
+The reads come in runs of nearby chunks separated by larger jumps, like the
+chunks of the variables of a granule. Run from the repository root:
+
+    python benchmarks/range_reads.py --reads 400 --latency 0.02 --max-gap-kb 0 64 1024
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from http_server import random_files, serve  # noqa: E402
+
+from prefect_earthdata.dmrpp import ByteRange, coalesce_ranges  # noqa: E402
+from prefect_earthdata.granules import GranuleFile  # noqa: E402
+from prefect_earthdata.remote import (  # noqa: E402
+    DEFAULT_MAX_REQUEST_SIZE,
+    open_files,
+    read_ranges,
+)
+
+
+def read_pattern(reads, size, run_length, seed=0):
+    """
+    Generates `reads` ranges of a file of `size` bytes, in runs of
+    `run_length` chunks of 4 to 64 KiB a few KiB apart.
+    """
+    rng = random.Random(seed)
+    ranges = []
+    while len(ranges) < reads:
+        offset = rng.randrange(0, size - 2**22)
+        for _ in range(min(run_length, reads - len(ranges))):
+            length = rng.randrange(2**12, 2**16)
+            ranges.append((offset, length))
+            offset += length + rng.randrange(0, 2**13)
+    return ranges
+
+
+def report(name, elapsed, requests, nbytes):
+    """Prints the cost of a run."""
+    print(f"{name:<28} {requests:>9} {elapsed:>9.2f} s {nbytes / 2**20:>10.1f} MiB")
+
+
+def main():
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=256)
+    parser.add_argument("--reads", type=int, default=400)
+    parser.add_argument("--run-length", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--max-requests", type=int, default=16)
+    parser.add_argument("--max-gap-kb", type=int, nargs="+", default=[0, 64, 1024])
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 2**20)
+    files = random_files(1, size)
+    name, content = next(iter(files.items()))
+    ranges = read_pattern(args.reads, size, args.run_length)
+    requested = sum(length for _, length in ranges)
+
+    with serve(files, latency=args.latency) as server:
+        (f,) = asyncio.run(
+            open_files([GranuleFile(server.url(name), size=size)], cache_type="none")
+        )
+        print(f"{'strategy':<28} {'requests':>9} {'latency':>11} {'fetched':>14}")
+
+        start, count = time.perf_counter(), server.request_count
+        for offset, length in ranges:
+            f.seek(offset)
+            assert f.read(length) == content[offset : offset + length]
+        report(
+            "one request per read",
+            time.perf_counter() - start,
+            server.request_count - count,
+            requested,
+        )
+
+        for max_gap_kb in args.max_gap_kb:
+            start, count = time.perf_counter(), server.request_count
+            data = read_ranges(
+                f, ranges, max_gap=max_gap_kb * 1024, max_requests=args.max_requests
+            )
+            elapsed = time.perf_counter() - start
+            assert data == [content[offset : offset + n] for offset, n in ranges]
+            fetched = sum(
+                byte_range.size
+                for byte_range in coalesce_ranges(
+                    (ByteRange(name, *byte_range) for byte_range in ranges),
+                    max_gap_kb * 1024,
+                    DEFAULT_MAX_REQUEST_SIZE,
+                )
+            )
+            report(
+                f"read_ranges, gap {max_gap_kb} KiB",
+                elapsed,
+                server.request_count - count,
+                fetched,
+            )
+        f.close()
+
+
+if __name__ == "__main__":
+    main()
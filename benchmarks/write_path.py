@@ -0,0 +1,80 @@
+"""
+Measures the CPU cost per byte of the `DownloadEngine` write path against a fast
+local HTTP server, without any latency or bandwidth cap.
+
+The server runs in a separate process, so that the reported CPU time is the one
+of the downloading process only. Run from the repository root, e.g. on two
+revisions to compare their write paths:
+
+    python benchmarks/write_path.py --files 8 --size-mb 256 --buffer-kb 256 1024
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from http_server import random_files, serve  # noqa: E402
+
+from prefect_earthdata.downloads import DownloadEngine  # noqa: E402
+
+
+def run_server(count, size, ports, stop):
+    """Serves `count` random files of `size` bytes until `stop` is set."""
+    files = random_files(count, size)
+    with serve(files) as server:
+        ports.put([server.url(name) for name in files])
+        stop.wait()
+
+
+def main():
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--size-mb", type=float, default=256)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-chunks-per-file", type=int, default=4)
+    parser.add_argument("--buffer-kb", type=int, nargs="+", default=[256, 1024, 4096])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 2**20)
+    total_bytes = args.files * size
+    urls_queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=run_server, args=(args.files, size, urls_queue, stop), daemon=True
+    )
+    server.start()
+    try:
+        urls = urls_queue.get()
+        print(f"{'buffer':>10} {'wall':>10} {'throughput':>14} {'CPU per GiB':>14}")
+        for buffer_kb in args.buffer_kb:
+            for _ in range(args.repeat):
+                with tempfile.TemporaryDirectory() as local_path:
+                    engine = DownloadEngine(
+                        max_concurrency=args.concurrency,
+                        max_chunks_per_file=args.max_chunks_per_file,
+                        buffer_size=buffer_kb * 1024,
+                    )
+                    start, cpu_start = time.perf_counter(), time.process_time()
+                    asyncio.run(engine.download(urls, local_path))
+                    elapsed = time.perf_counter() - start
+                    cpu = time.process_time() - cpu_start
+                print(
+                    f"{buffer_kb:>7} KiB {elapsed:>8.2f} s "
+                    f"{total_bytes / elapsed / 2**20:>8.1f} MiB/s "
+                    f"{cpu / (total_bytes / 2**30):>10.3f} s"
+                )
+    finally:
+        stop.set()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
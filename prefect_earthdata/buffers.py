@@ -0,0 +1,508 @@
+"""Module holding downloaded granules in memory within a budget"""
+
+import io
+import mmap
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+from typing import BinaryIO, Optional, Union
+
+from prefect_earthdata.granules import local_filename
+
+DEFAULT_MEMORY_BUDGET = 1024**3
+
+
+def _attach_segment(
+    name: str, owner_pid: Optional[int] = None
+) -> shared_memory.SharedMemory:
+    """
+    Attaches an existing shared memory segment, without leaving it to the
+    resource tracker of the process, which would remove it when the process
+    exits although another process owns it. The owner and the processes it
+    started share its tracker, where the segment stays registered.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    segment = shared_memory.SharedMemory(name)
+    parent = multiprocessing.parent_process()
+    if os.name == "posix" and owner_pid not in (os.getpid(), parent and parent.pid):
+        resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def _remove_segment(segment: shared_memory.SharedMemory) -> None:
+    """Closes and removes a shared memory segment, even if views remain."""
+    try:
+        segment.close()
+    except BufferError:
+        # Views still exported, unmapped once garbage collected
+        pass
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class MemoryBudget:
+    """
+    Number of bytes of memory granted to downloaded granules held in memory,
+    shared by all the downloads using it, from any thread.
+
+    Args:
+        max_bytes: The maximum number of bytes held in memory at the same time.
+
+    Example:
+        Shares a budget of 4 GiB between two downloads.
+
+        ```python
+        import asyncio
+
+        from prefect_earthdata.buffers import MemoryBudget
+        from prefect_earthdata.downloads import DownloadEngine
+
+        budget = MemoryBudget(4 * 1024**3)
+        engine = DownloadEngine()
+
+        async def main():
+            return await asyncio.gather(
+                engine.download_buffers(urls[:10], budget),
+                engine.download_buffers(urls[10:], budget),
+            )
+
+        first, second = asyncio.run(main())
+        ```
+    """
+
+    def __init__(self, max_bytes: int):
+        if max_bytes < 0:
+            raise ValueError("max_bytes must not be negative")
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> int:
+        """The number of bytes left in the budget."""
+        with self._lock:
+            return self.max_bytes - self.used
+
+    def try_reserve(self, nbytes: int) -> bool:
+        """
+        Reserves `nbytes` bytes of the budget, if available.
+
+        Returns:
+            Whether the bytes were reserved.
+        """
+        with self._lock:
+            if self.used + nbytes > self.max_bytes:
+                return False
+            self.used += nbytes
+            return True
+
+    def release(self, nbytes: int) -> None:
+        """Gives `nbytes` reserved bytes back to the budget."""
+        with self._lock:
+            self.used = max(self.used - nbytes, 0)
+
+
+class _MemoryReader(io.RawIOBase):
+    """Read-only, seekable file over a memoryview, without copying it."""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._position = 0
+
+    def readable(self) -> bool:
+        """Tells that the file is readable."""
+        return True
+
+    def seekable(self) -> bool:
+        """Tells that the file is seekable."""
+        return True
+
+    def readinto(self, buffer: Union[bytearray, memoryview]) -> int:
+        """Reads into `buffer` from the position, returning the bytes read."""
+        data = self._view[self._position : self._position + len(buffer)]
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Moves to `offset` relative to `whence`, returning the position."""
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        """Returns the position."""
+        return self._position
+
+
+class GranuleBuffer:
+    """
+    Contents of a downloaded file, held in memory within a `MemoryBudget`,
+    or spilled to a temporary file when it did not fit.
+
+    Either way, the contents are available as a memoryview, memory-mapped
+    for spilled files, or as a file-like object accepted by readers such as
+    `h5py.File`. Releasing the buffer, explicitly or by leaving it as a
+    context manager, frees its memory or removes its temporary file.
+
+    Args:
+        url: The URL of the file.
+        data: The contents held in memory, or `None` if spilled.
+        path: The path of the temporary file, or `None` if held in memory.
+        budget: The budget the memory of `data` was reserved from.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        data: Optional[bytearray] = None,
+        path: Optional[str] = None,
+        budget: Optional[MemoryBudget] = None,
+    ):
+        self.url = url
+        self.path = path
+        self._data = data
+        self._budget = budget
+        self._mmap: Optional[mmap.mmap] = None
+        self.size = len(data) if data is not None else os.path.getsize(path)
+
+    @property
+    def in_memory(self) -> bool:
+        """Whether the contents are held in memory rather than spilled."""
+        return self.path is None
+
+    def getbuffer(self) -> memoryview:
+        """
+        Returns a read-only view of the contents, without copying them.
+        """
+        if self._data is not None:
+            return memoryview(self._data).toreadonly()
+        if self.path is None:
+            raise ValueError(f"Buffer of {self.url} was released")
+        if self.size == 0:
+            return memoryview(b"")
+        if self._mmap is None:
+            with open(self.path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def open(self) -> BinaryIO:
+        """Opens the contents as a read-only binary file."""
+        if self.path is not None:
+            return open(self.path, "rb")
+        return io.BufferedReader(_MemoryReader(self.getbuffer()))
+
+    def release(self) -> None:
+        """Frees the memory or removes the temporary file of the contents."""
+        if self._data is not None:
+            data, self._data = self._data, None
+            if self._budget is not None:
+                self._budget.release(len(data))
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views still exported, closed once garbage collected
+                pass
+            self._mmap = None
+        if self.path is not None:
+            path, self.path = self.path, None
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __len__(self) -> int:
+        """Returns the size of the contents in bytes."""
+        return self.size
+
+    def __enter__(self) -> "GranuleBuffer":
+        """Returns the buffer, released on exit."""
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Releases the buffer."""
+        self.release()
+
+    def __repr__(self) -> str:
+        """Describes the buffer and where its contents are."""
+        where = "in memory" if self.in_memory else f"spilled to {self.path}"
+        return f"GranuleBuffer({self.url!r}, {self.size} bytes {where})"
+
+
+class SharedGranuleBuffer(GranuleBuffer):
+    """
+    Contents of a downloaded file in a shared memory segment, or spilled
+    to a temporary file when they did not fit in the `MemoryBudget`,
+    which other processes, e.g. the workers of a process pool, read without
+    copying them.
+
+    The buffer pickles into a handle of a few bytes naming the segment or the
+    file, which attaches to it once unpickled, so that passing it to another
+    process does not send the contents through a pipe. Releasing the buffer
+    in the process that downloaded it removes the segment or the file, while
+    releasing a handle only detaches from it. Segments not released are
+    removed once the buffer is garbage collected or the process exits.
+
+    Args:
+        url: The URL of the file.
+        size: The size of the contents in bytes.
+        name: The name of the shared memory segment, or `None` if spilled
+            or empty.
+        path: The path of the temporary file, or `None` if not spilled.
+        budget: The budget the memory of the segment was reserved from.
+        owner: Whether this buffer removes the segment or file on release.
+        segment: The segment, if already created or attached.
+        owner_pid: The process ID of the owner of the segment, this process
+            if `owner` is set.
+
+    Example:
+        Parses granules downloaded into shared memory in a process pool.
+
+        ```python
+        from concurrent.futures import ProcessPoolExecutor
+
+        import h5py
+
+        def heights(buffer):
+            with buffer, h5py.File(buffer.open()) as f:
+                return f["/gt1l/land_segments/canopy/h_canopy"][:]
+
+        buffers = download(credentials, granules, shared_memory=True)
+        with ProcessPoolExecutor() as executor:
+            results = list(executor.map(heights, buffers))
+        for buffer in buffers:
+            buffer.release()
+        ```
+    """
+
+    def __init__(
+        self,
+        url: str,
+        size: int,
+        name: Optional[str] = None,
+        path: Optional[str] = None,
+        budget: Optional[MemoryBudget] = None,
+        owner: bool = True,
+        segment: Optional[shared_memory.SharedMemory] = None,
+        owner_pid: Optional[int] = None,
+    ):
+        self.url = url
+        self.size = size
+        self.name = name
+        self.path = path
+        self.owner = owner
+        self.owner_pid = os.getpid() if owner else owner_pid
+        self._data = None
+        self._budget = budget
+        self._mmap = None
+        self._segment = segment
+        self._finalizer = None
+        if owner and segment is not None:
+            self._finalizer = weakref.finalize(self, _remove_segment, segment)
+
+    @property
+    def in_memory(self) -> bool:
+        """Whether the contents are held in shared memory rather than spilled."""
+        return self.path is None
+
+    def getbuffer(self) -> memoryview:
+        """
+        Returns a read-only view of the contents, attaching to their
+        shared memory segment if needed, without copying them.
+        """
+        if self.name is None:
+            if self.path is None and self.size == 0:
+                return memoryview(b"")
+            return super().getbuffer()
+        if self._segment is None:
+            self._segment = _attach_segment(self.name, self.owner_pid)
+        return self._segment.buf[: self.size].toreadonly()
+
+    def release(self) -> None:
+        """
+        Removes the segment or temporary file of the contents if this buffer
+        owns them, or detaches from them otherwise.
+        """
+        if self._segment is not None:
+            segment, self._segment = self._segment, None
+            if self.owner:
+                self._finalizer.detach()
+                _remove_segment(segment)
+                if self._budget is not None:
+                    self._budget.release(self.size)
+            else:
+                try:
+                    segment.close()
+                except BufferError:
+                    pass
+        self.name = None
+        if not self.owner:
+            # Leaves the file to its owner
+            self.path = None
+        super().release()
+
+    def __reduce__(self):
+        """Pickles into a handle naming the segment or the file."""
+        return (
+            SharedGranuleBuffer,
+            (
+                self.url,
+                self.size,
+                self.name,
+                self.path,
+                None,
+                False,
+                None,
+                self.owner_pid,
+            ),
+        )
+
+    def __repr__(self) -> str:
+        """Describes the buffer and where its contents are."""
+        where = f"in segment {self.name}" if self.in_memory else f"in {self.path}"
+        return f"SharedGranuleBuffer({self.url!r}, {self.size} bytes {where})"
+
+
+class _SpooledTarget:
+    """
+    Receives the contents of a file in memory, reserving the memory from
+    a budget as it grows, and spills them to a temporary file in `directory`
+    once the budget is exhausted. Writes are sequential.
+
+    With `shared`, contents of a known size are written straight into
+    a shared memory segment, and others moved into one once complete.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        budget: MemoryBudget,
+        directory: Optional[str] = None,
+        size: Optional[int] = None,
+        shared: bool = False,
+    ):
+        self.url = url
+        self.budget = budget
+        self.directory = directory
+        self.shared = shared
+        self.position = 0
+        self._reserved = 0
+        self._data: Optional[bytearray] = bytearray()
+        self._segment: Optional[shared_memory.SharedMemory] = None
+        self._file: Optional[BinaryIO] = None
+        if size:
+            # Known sizes are reserved at once, to avoid spilling midway
+            if budget.try_reserve(size):
+                self._reserved = size
+                if shared:
+                    self._data = None
+                    self._segment = shared_memory.SharedMemory(create=True, size=size)
+                else:
+                    self._data = bytearray(size)
+            else:
+                self._spill()
+
+    def _received(self) -> memoryview:
+        """Returns the contents received so far, held in memory."""
+        if self._segment is not None:
+            return self._segment.buf[: self.position]
+        return memoryview(self._data)[: self.position]
+
+    def _drop_segment(self) -> None:
+        """Removes the segment, once its contents are moved."""
+        segment, self._segment = self._segment, None
+        _remove_segment(segment)
+
+    def _spill(self) -> None:
+        """Moves the contents received so far to a temporary file."""
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=f"{local_filename(self.url)}.", delete=False
+        )
+        with self._received() as received:
+            self._file.write(received)
+        if self._segment is not None:
+            self._drop_segment()
+        self._data = None
+        self.budget.release(self._reserved)
+        self._reserved = 0
+
+    def write(self, data: Union[bytes, memoryview]) -> None:
+        """Appends `data` to the contents."""
+        end = self.position + len(data)
+        if self._file is None and end > self._reserved:
+            if self.budget.try_reserve(end - self._reserved):
+                self._reserved = end
+            else:
+                self._spill()
+        if self._segment is not None and end > self._segment.size:
+            # More than announced, segments cannot grow
+            with self._received() as received:
+                self._data = bytearray(received)
+            self._drop_segment()
+
+        if self._segment is not None:
+            self._segment.buf[self.position : end] = data
+        elif self._data is not None:
+            self._data[self.position : end] = data
+        else:
+            self._file.write(data)
+        self.position = end
+
+    def close(self) -> None:
+        """Ends the contents, giving back the memory reserved beyond them."""
+        if self._file is not None:
+            self._file.close()
+            return
+        if self._data is not None and len(self._data) > self.position:
+            del self._data[self.position :]
+        self.budget.release(self._reserved - self.position)
+        self._reserved = self.position
+        if self.shared and self._data is not None and self.position:
+            self._segment = shared_memory.SharedMemory(create=True, size=self.position)
+            self._segment.buf[: self.position] = self._data
+            self._data = None
+
+    def buffer(self) -> GranuleBuffer:
+        """Hands the complete contents over to a `GranuleBuffer`."""
+        path = self._file.name if self._file is not None else None
+        if self.shared:
+            return SharedGranuleBuffer(
+                self.url,
+                self.position,
+                name=self._segment.name if self._segment is not None else None,
+                path=path,
+                budget=self.budget,
+                segment=self._segment,
+            )
+        if path is not None:
+            return GranuleBuffer(self.url, path=path)
+        return GranuleBuffer(self.url, data=self._data, budget=self.budget)
+
+    def discard(self) -> None:
+        """Drops the contents."""
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.remove(self._file.name)
+            except FileNotFoundError:
+                pass
+        if self._segment is not None:
+            self._drop_segment()
+        self._data = None
+        self.budget.release(self._reserved)
+        self._reserved = 0
@@ -0,0 +1,482 @@
+"""Module implementing node-local caches of granule files and of their blocks"""
+
+import errno
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from uuid import uuid4
+
+from prefect_earthdata.granules import GranuleFile, local_filename
+
+DEFAULT_BLOCK_SIZE = 4 * 2**20
+
+# Seconds between writes of the access times of cache hits to the index
+ACCESS_FLUSH_INTERVAL = 1.0
+
+# From linux/fs.h, clones the extents of a file on copy-on-write filesystems
+FICLONE = 0x40049409
+
+
+def _reflink(source: str, destination: str) -> None:
+    """
+    Creates `destination` as a copy-on-write clone of `source`.
+    Raises `OSError` where reflinks are not supported.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported")
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+
+def link_file(source: str, destination: str) -> None:
+    """
+    Atomically places a copy of `source` at `destination` without transferring
+    its content where possible: as a reflink on copy-on-write filesystems,
+    as a hardlink on the same filesystem, or as a plain copy otherwise.
+
+    Args:
+        source: The path of the existing file.
+        destination: The path of the new file, replaced if it exists.
+    """
+    temp_path = f"{destination}.{uuid4().hex[:6]}.tmp"
+    try:
+        try:
+            _reflink(source, temp_path)
+        except OSError:
+            try:
+                os.link(source, temp_path)
+            except OSError:
+                shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class _IndexedCache:
+    """
+    Files of a node-local cache, indexed in an SQLite database whose locking
+    makes the cache safe to share between processes, and evicted in least
+    recently used order beyond `max_bytes`.
+
+    The index is in write-ahead logging mode, through a connection kept open
+    by each thread. Access times of hits are written to it in batches,
+    at most every `ACCESS_FLUSH_INTERVAL` seconds and before any other
+    change, so that reads do not contend for its write lock.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        if max_bytes < 0:
+            raise ValueError("max_bytes must not be negative")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._accessed: Dict[str, float] = {}
+        self._flushed = time.monotonic()
+        self._access_lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self._connection().execute("PRAGMA journal_mode=WAL")
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL"
+                ")"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_access "
+                "ON entries (last_access)"
+            )
+            # Running total of the sizes, kept up to date by triggers
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS totals ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)"
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO totals "
+                "SELECT 0, COALESCE(SUM(size), 0) FROM entries"
+            )
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries "
+                "BEGIN UPDATE totals SET size = size + NEW.size; END"
+            )
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries "
+                "BEGIN UPDATE totals SET size = size - OLD.size; END"
+            )
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_update "
+                "AFTER UPDATE OF size ON entries "
+                "BEGIN UPDATE totals SET size = size - OLD.size + NEW.size; END"
+            )
+
+    def _object_path(self, key: str) -> str:
+        """Returns the path of the cached file for `key`."""
+        return os.path.join(self.directory, "objects", *key.split("/"))
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Returns the connection of the current thread to the index,
+        opening it on first use in the thread or process.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite"),
+                timeout=60.0,
+                isolation_level=None,
+            )
+            # Commits survive crashes of the process, not necessarily power losses
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens an exclusive transaction on the index, serializing
+        cache operations across threads and processes. Access times
+        not written yet are written first.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._write_accesses(connection)
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _write_accesses(self, connection: sqlite3.Connection) -> None:
+        """Writes the pending access times within an open transaction."""
+        with self._access_lock:
+            accessed, self._accessed = self._accessed, {}
+            self._flushed = time.monotonic()
+        if accessed:
+            connection.executemany(
+                "UPDATE entries SET last_access = ? WHERE key = ?",
+                [(timestamp, key) for key, timestamp in accessed.items()],
+            )
+
+    def _touch(self, key: str) -> None:
+        """
+        Records an access to the file for `key`, written to the index
+        with the next change or once `ACCESS_FLUSH_INTERVAL` has elapsed.
+        """
+        with self._access_lock:
+            self._accessed[key] = time.time()
+            due = time.monotonic() - self._flushed >= ACCESS_FLUSH_INTERVAL
+        if due:
+            with self._transaction():
+                pass
+
+    def _upsert(self, connection: sqlite3.Connection, key: str, size: int) -> None:
+        """Indexes a file as just accessed within an open transaction."""
+        connection.execute(
+            "INSERT INTO entries VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE "
+            "SET size = excluded.size, last_access = excluded.last_access",
+            (key, size, time.time()),
+        )
+
+    def evict(self, nbytes: int) -> int:
+        """
+        Evicts the least recently used files, until at least `nbytes` bytes
+        are freed or the cache is empty.
+
+        Args:
+            nbytes: The number of bytes to free.
+
+        Returns:
+            The number of bytes evicted.
+        """
+        with self._transaction() as connection:
+            return self._evict(connection, nbytes)
+
+    def _evict(self, connection: sqlite3.Connection, nbytes: int) -> int:
+        """Evicts files within an open transaction."""
+        evicted = 0
+        if nbytes <= 0:
+            return evicted
+        # Stops reading the index once enough files are selected
+        victims = []
+        for key, size in connection.execute(
+            "SELECT key, size FROM entries ORDER BY last_access"
+        ):
+            victims.append(key)
+            evicted += size
+            if evicted >= nbytes:
+                break
+        for key in victims:
+            try:
+                os.remove(self._object_path(key))
+            except FileNotFoundError:
+                pass
+        connection.executemany(
+            "DELETE FROM entries WHERE key = ?", [(key,) for key in victims]
+        )
+        return evicted
+
+    @staticmethod
+    def _size(connection: sqlite3.Connection) -> int:
+        """Returns the total size of the cached files within an open transaction."""
+        return connection.execute("SELECT size FROM totals").fetchone()[0]
+
+    @property
+    def size(self) -> int:
+        """Total size in bytes of the cached files."""
+        with self._transaction() as connection:
+            return self._size(connection)
+
+
+class GranuleCache(_IndexedCache):
+    """
+    Node-local cache of granule files, keyed by granule concept-id, revision
+    and file name, so that flows downloading the same granules into different
+    directories transfer them only once.
+
+    Files are served from the cache as reflinks or hardlinks, falling back
+    to copies across filesystems. The least recently used files are evicted
+    once the cache grows beyond `max_bytes`. The cache index is an SQLite
+    database, whose locking makes the cache safe to share between processes.
+
+    Args:
+        directory: The directory holding the cached files and their index.
+            Keep it on the same filesystem as the download directories
+            to avoid copies.
+        max_bytes: Maximum total size in bytes of the cached files.
+
+    Example:
+        Shares a cache between downloads to different directories.
+
+        ```python
+        from prefect_earthdata.cache import GranuleCache
+        from prefect_earthdata.tasks import download
+
+        cache = GranuleCache("/scratch/granule-cache", max_bytes=500 * 1024**3)
+        files = download(credentials, granules, "/scratch/flow-a", cache=cache)
+        ```
+    """
+
+    @staticmethod
+    def key(file: GranuleFile) -> Optional[str]:
+        """
+        Builds the cache key of a granule file.
+
+        Args:
+            file: The granule file.
+
+        Returns:
+            The key, or `None` if the file does not come from a granule
+            with a known concept-id and revision.
+        """
+        if file.concept_id is None or file.revision_id is None:
+            return None
+        return f"{file.concept_id}/{file.revision_id}/{local_filename(file.url)}"
+
+    def contains(self, key: str) -> bool:
+        """
+        Tells whether the file for `key` is cached, without counting
+        it as accessed.
+
+        Args:
+            key: The cache key of the file.
+
+        Returns:
+            Whether the file is in the cache.
+        """
+        return os.path.exists(self._object_path(key))
+
+    def materialize(self, key: str, destination: str) -> bool:
+        """
+        Places the cached file for `key` at `destination`, if cached.
+
+        Args:
+            key: The cache key of the file.
+            destination: The path to place the file at.
+
+        Returns:
+            Whether the file was in the cache.
+        """
+        with self._transaction() as connection:
+            if (
+                connection.execute(
+                    "SELECT 1 FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                is None
+            ):
+                return False
+
+            try:
+                link_file(self._object_path(key), destination)
+            except FileNotFoundError:
+                # Removed behind the cache's back
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return False
+
+            connection.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            return True
+
+    def add(self, key: str, source: str) -> None:
+        """
+        Adds a downloaded file to the cache, evicting the least recently used
+        files if needed. Files larger than the whole cache are not added.
+
+        Args:
+            key: The cache key of the file.
+            source: The path of the downloaded file.
+        """
+        size = os.path.getsize(source)
+        if size > self.max_bytes:
+            return
+
+        path = self._object_path(key)
+        with self._transaction() as connection:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            link_file(source, path)
+            self._upsert(connection, key, size)
+            self._evict(connection, self._size(connection) - self.max_bytes)
+
+
+class BlockCache(_IndexedCache):
+    """
+    Node-local cache of blocks of remote granule files, keyed by URL, revision
+    and offset, under the remote files opened by `open_data`, so that
+    repeated reads of the same granules are served from the local disk.
+
+    Blocks are stored as files of `block_size` bytes, written atomically.
+    The least recently used blocks are evicted once the cache grows beyond
+    `max_bytes`. The cache index is an SQLite database, whose locking makes
+    the cache safe to share between processes. Hits and misses of this
+    process are counted, in blocks and bytes.
+
+    Args:
+        directory: The directory holding the cached blocks and their index.
+        max_bytes: Maximum total size in bytes of the cached blocks.
+        block_size: The size in bytes of the blocks, all processes sharing
+            the cache having to use the same.
+
+    Example:
+        Reads granules through a block cache shared by the flows of a node.
+
+        ```python
+        from prefect_earthdata.cache import BlockCache
+        from prefect_earthdata.tasks import open_data
+
+        cache = BlockCache("/scratch/block-cache", max_bytes=50 * 1024**3)
+        files = open_data(credentials, granules, block_cache=cache)
+        print(f"{cache.hits} hits, {cache.misses} misses")
+        ```
+    """
+
+    def __init__(
+        self, directory: str, max_bytes: int, block_size: int = DEFAULT_BLOCK_SIZE
+    ):
+        if block_size <= 0:
+            raise ValueError("block_size must be positive")
+        super().__init__(directory, max_bytes)
+        self.block_size = block_size
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.miss_bytes = 0
+        self._lock = threading.Lock()
+
+    def key(self, url: str, revision: str, offset: int) -> str:
+        """
+        Builds the cache key of a block.
+
+        Args:
+            url: The URL of the file.
+            revision: The revision of the file, e.g. the revision of its
+                granule or its size, so that blocks of replaced files are
+                not served.
+            offset: The offset of the block in the file.
+
+        Returns:
+            The key.
+        """
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return f"{digest[:2]}/{digest}/{revision}/{self.block_size}-{offset}"
+
+    def _count(self, hit: bool, nbytes: int) -> None:
+        """Counts a hit or a miss."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.hit_bytes += nbytes
+            else:
+                self.misses += 1
+                self.miss_bytes += nbytes
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Reads a cached block.
+
+        Args:
+            key: The cache key of the block.
+
+        Returns:
+            The block, or `None` if not cached.
+        """
+        try:
+            with open(self._object_path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(key)
+        self._count(True, len(data))
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Adds a block fetched after a miss to the cache, evicting the least
+        recently used blocks if needed.
+
+        Args:
+            key: The cache key of the block.
+            data: The block.
+        """
+        self._count(False, len(data))
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid4().hex[:6]}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        try:
+            with self._transaction() as connection:
+                os.replace(temp_path, path)
+                self._upsert(connection, key, len(data))
+                self._evict(connection, self._size(connection) - self.max_bytes)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Hits and misses of this process, in blocks and bytes."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_bytes": self.hit_bytes,
+                "miss_bytes": self.miss_bytes,
+            }
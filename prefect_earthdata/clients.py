@@ -0,0 +1,292 @@
+"""Module building the HTTP clients used to reach NASA Earthdata"""
+
+import urllib.request
+from contextlib import contextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+
+import httpcore
+import httpx
+
+# Host of Earthdata Login, which DAACs redirect to and back from to authenticate
+URS_HOST = "urs.earthdata.nasa.gov"
+
+DEFAULT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+# Host of the previous request of a redirect chain, whose requests share extensions
+_HOST_EXTENSION = "prefect_earthdata.host"
+
+# Errors of httpcore and the httpx errors they stand for
+_HTTPX_ERRORS = {
+    httpcore.TimeoutException: httpx.TimeoutException,
+    httpcore.ConnectTimeout: httpx.ConnectTimeout,
+    httpcore.ReadTimeout: httpx.ReadTimeout,
+    httpcore.WriteTimeout: httpx.WriteTimeout,
+    httpcore.PoolTimeout: httpx.PoolTimeout,
+    httpcore.NetworkError: httpx.NetworkError,
+    httpcore.ConnectError: httpx.ConnectError,
+    httpcore.ReadError: httpx.ReadError,
+    httpcore.WriteError: httpx.WriteError,
+    httpcore.ProxyError: httpx.ProxyError,
+    httpcore.UnsupportedProtocol: httpx.UnsupportedProtocol,
+    httpcore.ProtocolError: httpx.ProtocolError,
+    httpcore.LocalProtocolError: httpx.LocalProtocolError,
+    httpcore.RemoteProtocolError: httpx.RemoteProtocolError,
+}
+
+
+@contextmanager
+def _httpx_errors() -> Iterator[None]:
+    """
+    Raises the httpx counterpart of the httpcore errors raised within,
+    which the callers of an httpx client handle.
+    """
+    try:
+        yield
+    except Exception as error:
+        for error_type in type(error).__mro__:
+            if error_type in _HTTPX_ERRORS:
+                raise _HTTPX_ERRORS[error_type](str(error)) from error
+        raise
+
+
+class _LargeReadStream(httpcore.AsyncNetworkStream):
+    """
+    Network stream reading up to `read_size` bytes at a time, however
+    few the HTTP connection asks for, so that large response bodies
+    are received in a few large chunks rather than many small ones.
+    """
+
+    def __init__(self, stream: httpcore.AsyncNetworkStream, read_size: int):
+        self._stream = stream
+        self._read_size = read_size
+
+    async def read(self, max_bytes: int, timeout: Optional[float] = None) -> bytes:
+        """Reads the bytes available, up to the larger of both sizes."""
+        return await self._stream.read(max(max_bytes, self._read_size), timeout)
+
+    async def write(self, buffer: bytes, timeout: Optional[float] = None) -> None:
+        """Sends `buffer`."""
+        await self._stream.write(buffer, timeout)
+
+    async def aclose(self) -> None:
+        """Closes the stream."""
+        await self._stream.aclose()
+
+    async def start_tls(
+        self,
+        ssl_context: Any,
+        server_hostname: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        """Upgrades the stream to TLS, keeping the read size."""
+        stream = await self._stream.start_tls(ssl_context, server_hostname, timeout)
+        return _LargeReadStream(stream, self._read_size)
+
+    def get_extra_info(self, info: str) -> Any:
+        """Returns information about the underlying socket."""
+        return self._stream.get_extra_info(info)
+
+
+class _LargeReadBackend(httpcore.AsyncNetworkBackend):
+    """
+    Network backend of httpcore opening `_LargeReadStream` connections.
+    """
+
+    def __init__(self, read_size: int):
+        self._backend = httpcore.AnyIOBackend()
+        self._read_size = read_size
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options: Optional[Iterable[Any]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        """Opens a TCP connection."""
+        stream = await self._backend.connect_tcp(
+            host, port, timeout, local_address, socket_options
+        )
+        return _LargeReadStream(stream, self._read_size)
+
+    async def connect_unix_socket(
+        self,
+        path: str,
+        timeout: Optional[float] = None,
+        socket_options: Optional[Iterable[Any]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        """Opens a connection to a Unix socket."""
+        stream = await self._backend.connect_unix_socket(path, timeout, socket_options)
+        return _LargeReadStream(stream, self._read_size)
+
+    async def sleep(self, seconds: float) -> None:
+        """Waits for `seconds`."""
+        await self._backend.sleep(seconds)
+
+
+class _ResponseStream(httpx.AsyncByteStream):
+    """
+    Body of an httpx response read from an httpcore response.
+    """
+
+    def __init__(self, stream: AsyncIterator[bytes]):
+        self._stream = stream
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Yields the chunks of the body as received."""
+        with _httpx_errors():
+            async for chunk in self._stream:
+                yield chunk
+
+    async def aclose(self) -> None:
+        """Releases the connection of the response."""
+        if hasattr(self._stream, "aclose"):
+            await self._stream.aclose()
+
+
+class _LargeReadTransport(httpx.AsyncBaseTransport):
+    """
+    Transport of httpx sending requests through an httpcore connection pool
+    whose connections read up to `read_size` bytes at a time, as httpcore
+    otherwise reads 64 KiB at a time, so that receiving a large body costs
+    more CPU time than writing it.
+
+    Args:
+        read_size: The number of bytes read from the network at once.
+        limits: The limits on the connections of the pool.
+    """
+
+    def __init__(self, read_size: int, limits: httpx.Limits = DEFAULT_LIMITS):
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            network_backend=_LargeReadBackend(read_size),
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Sends `request`, returning the response with its body unread."""
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(
+                scheme=request.url.raw_scheme,
+                host=request.url.raw_host,
+                port=request.url.port,
+                target=request.url.raw_path,
+            ),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        with _httpx_errors():
+            response = await self._pool.handle_async_request(core_request)
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_ResponseStream(response.stream),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        """Closes the connections of the pool."""
+        await self._pool.aclose()
+
+
+def _keep_authorization(
+    headers: Optional[Dict[str, str]],
+) -> Callable[[httpx.Request], Awaitable[None]]:
+    """
+    Returns a request hook sending the Authorization header of `headers`
+    along redirects to and from Earthdata Login, which httpx drops
+    on redirects to another host, in the same way as earthaccess.
+    """
+    authorization = httpx.Headers(headers or {}).get("Authorization")
+
+    async def hook(request: httpx.Request) -> None:
+        """Restores the Authorization header of a redirect to or from URS."""
+        previous = request.extensions.get(_HOST_EXTENSION)
+        host = request.url.host
+        request.extensions[_HOST_EXTENSION] = host
+        if (
+            authorization is not None
+            and previous not in (None, host)
+            and URS_HOST in (previous, host)
+            and "Authorization" not in request.headers
+        ):
+            request.headers["Authorization"] = authorization
+
+    return hook
+
+
+def _env_proxies() -> bool:
+    """
+    Returns whether the environment configures an HTTP(S) proxy.
+    """
+    proxies = urllib.request.getproxies()
+    return any(scheme in proxies for scheme in ("http", "https", "all"))
+
+
+def earthdata_client(
+    headers: Optional[Dict[str, str]] = None,
+    timeout: float = 60.0,
+    limits: httpx.Limits = DEFAULT_LIMITS,
+    read_size: Optional[int] = None,
+    event_hooks: Optional[Dict[str, List[Callable]]] = None,
+) -> httpx.AsyncClient:
+    """
+    Builds an asynchronous HTTP client for NASA Earthdata, following redirects.
+
+    The Authorization header of `headers`, e.g. an Earthdata Login bearer
+    token, is kept on redirects to and from Earthdata Login, as the DAACs
+    redirect there to authenticate. Proxies and CA bundles configured
+    in the environment, e.g. through `HTTPS_PROXY` or `SSL_CERT_FILE`,
+    are honored, while `.netrc` files are not read.
+
+    Args:
+        headers: Headers sent with every request.
+        timeout: Timeout in seconds for connecting and reading from the server.
+        limits: The limits on the connections of the client.
+        read_size: The number of bytes to read from the network at once,
+            for large bodies to be received in fewer chunks. Ignored when
+            going through a proxy.
+        event_hooks: Request and response hooks of the client.
+
+    Returns:
+        The client, to be closed once done.
+
+    Example:
+        Fetches a granule with an Earthdata Login token.
+
+        ```python
+        from prefect_earthdata.clients import earthdata_client
+
+        async with earthdata_client({"Authorization": f"Bearer {token}"}) as client:
+            response = await client.get(url)
+        ```
+    """
+    event_hooks = {key: list(hooks) for key, hooks in (event_hooks or {}).items()}
+    event_hooks.setdefault("request", []).insert(0, _keep_authorization(headers))
+    transport = None
+    # httpx only reads proxies from the environment without a custom transport
+    if read_size is not None and not _env_proxies():
+        transport = _LargeReadTransport(read_size, limits)
+    return httpx.AsyncClient(
+        headers=headers,
+        event_hooks=event_hooks,
+        follow_redirects=True,
+        timeout=httpx.Timeout(timeout),
+        limits=limits,
+        transport=transport,
+    )
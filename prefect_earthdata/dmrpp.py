@@ -0,0 +1,509 @@
+"""Module subsetting remote granules through their DMR++ metadata"""
+
+import asyncio
+import io
+import logging
+import os
+import random
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Union
+from urllib.parse import urlsplit
+
+import httpx
+
+from prefect_earthdata.clients import earthdata_client
+from prefect_earthdata.downloads import (
+    DownloadError,
+    LocalFile,
+    is_retryable,
+    parse_content_range,
+    run_in_thread,
+)
+from prefect_earthdata.granules import local_filename
+
+DAP4_NAMESPACE = "http://xml.opendap.org/ns/DAP/4.0#"
+DMRPP_NAMESPACE = "http://xml.opendap.org/dap/dmrpp/1.0.0#"
+DMRPP_SUFFIX = ".dmrpp"
+SUBSET_SUFFIX = ".subset"
+
+# Schemes of the data URLs named by DMR++ documents which can be fetched,
+# others being placeholders such as `OPeNDAP_DMRpp_DATA_ACCESS_URL` written
+# by Cumulus, or S3 URLs only reachable in region
+DATA_URL_SCHEMES = frozenset({"http", "https"})
+
+# DAP4 elements which are not variables
+NON_VARIABLE_TAGS = frozenset({"Group", "Dimension", "Dim", "Attribute", "Map", "Enum"})
+
+
+class ByteRange(NamedTuple):
+    """
+    A range of bytes of a remote file.
+
+    Args:
+        href: The URL of the file.
+        offset: The offset of the first byte.
+        size: The number of bytes.
+    """
+
+    href: str
+    offset: int
+    size: int
+
+    @property
+    def end(self) -> int:
+        """The offset following the last byte."""
+        return self.offset + self.size
+
+
+def dap_tag(tag: str) -> str:
+    """
+    Qualifies a DAP4 tag with its namespace.
+
+    Args:
+        tag: The tag, e.g. `Group`.
+
+    Returns:
+        The tag as named by `ElementTree`.
+    """
+    return f"{{{DAP4_NAMESPACE}}}{tag}"
+
+
+def dmrpp_tag(tag: str) -> str:
+    """
+    Qualifies a DMR++ tag or attribute with its namespace.
+
+    Args:
+        tag: The tag or attribute, e.g. `chunk`.
+
+    Returns:
+        The tag or attribute as named by `ElementTree`.
+    """
+    return f"{{{DMRPP_NAMESPACE}}}{tag}"
+
+
+def dmrpp_data_url(root: ET.Element, href: str) -> str:
+    """
+    Returns the URL of the data file named by a DMR++ document.
+
+    Args:
+        root: The root element of the document.
+        href: The URL of the data file, returned unless the document
+            names its HTTP(S) URL.
+
+    Returns:
+        The URL of the data file.
+    """
+    data_href = root.get(dmrpp_tag("href"), "")
+    if urlsplit(data_href).scheme.lower() in DATA_URL_SCHEMES:
+        return data_href
+    return href
+
+
+def local_tag(element: ET.Element) -> str:
+    """
+    Returns the tag of an element without its namespace.
+
+    Args:
+        element: The element.
+
+    Returns:
+        The tag, e.g. `Group`.
+    """
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def parse_dmrpp(text: Union[str, bytes]) -> ET.ElementTree:
+    """
+    Parses a DMR++ document, registering its namespace prefixes
+    so that they are kept when writing it back.
+
+    Args:
+        text: The XML document.
+
+    Returns:
+        The parsed document.
+    """
+    if isinstance(text, str):
+        text = text.encode()
+    for _, (prefix, uri) in ET.iterparse(io.BytesIO(text), events=("start-ns",)):
+        ET.register_namespace(prefix, uri)
+    return ET.ElementTree(ET.fromstring(text))
+
+
+def dmrpp_variables(tree: ET.ElementTree) -> Dict[str, ET.Element]:
+    """
+    Lists the variables of a DMR++ document by their full path,
+    e.g. `/gt1l/land_segments/latitude`.
+
+    Args:
+        tree: The parsed DMR++ document.
+
+    Returns:
+        The variable elements, by path.
+    """
+    variables = {}
+
+    def visit(group: ET.Element, prefix: str) -> None:
+        """Collects the variables of a group and of its subgroups."""
+        for child in group:
+            if not child.tag.startswith(f"{{{DAP4_NAMESPACE}}}"):
+                continue
+            tag = local_tag(child)
+            name = child.get("name")
+            if name is None:
+                continue
+            if tag == "Group":
+                visit(child, f"{prefix}{name}/")
+            elif tag not in NON_VARIABLE_TAGS:
+                variables[f"{prefix}{name}"] = child
+
+    visit(tree.getroot(), "/")
+    return variables
+
+
+def _normalize(variable: str) -> str:
+    """Makes a variable path absolute."""
+    return variable if variable.startswith("/") else f"/{variable}"
+
+
+def select_variables(tree: ET.ElementTree, variables: Iterable[str]) -> Set[str]:
+    """
+    Resolves the variables to keep in a subset: the requested ones
+    and the variables of their dimensions, e.g. coordinates.
+
+    Args:
+        tree: The parsed DMR++ document.
+        variables: The paths of the requested variables.
+
+    Returns:
+        The paths of the variables to keep.
+
+    Raises:
+        KeyError: If a requested variable is not in the document.
+    """
+    available = dmrpp_variables(tree)
+    selected = set()
+    for variable in map(_normalize, variables):
+        if variable not in available:
+            raise KeyError(f"Variable {variable} not found")
+        selected.add(variable)
+        for dim in available[variable].iter(dap_tag("Dim")):
+            name = dim.get("name")
+            if name is not None and name in available:
+                selected.add(name)
+    return selected
+
+
+def subset_dmrpp(
+    tree: ET.ElementTree, variables: Iterable[str], href: str
+) -> List[ByteRange]:
+    """
+    Removes all but the given variables from a DMR++ document, in place,
+    and lists the bytes of their chunks. Attributes, groups and dimensions
+    are kept.
+
+    Args:
+        tree: The parsed DMR++ document.
+        variables: The paths of the variables to keep, e.g. from
+            `select_variables()`.
+        href: The URL of the data file, for chunks not naming their own
+            unless the document names its HTTP(S) URL.
+
+    Returns:
+        The byte ranges of the chunks of the kept variables, in the order
+        of the document.
+    """
+    root = tree.getroot()
+    href = dmrpp_data_url(root, href)
+    kept = set(map(_normalize, variables))
+    ranges = []
+
+    def visit(group: ET.Element, prefix: str) -> None:
+        """Removes the variables not kept from a group and its subgroups."""
+        for child in list(group):
+            if not child.tag.startswith(f"{{{DAP4_NAMESPACE}}}"):
+                continue
+            tag = local_tag(child)
+            name = child.get("name")
+            if name is None:
+                continue
+            if tag == "Group":
+                visit(child, f"{prefix}{name}/")
+            elif tag not in NON_VARIABLE_TAGS:
+                if f"{prefix}{name}" not in kept:
+                    group.remove(child)
+                    continue
+                for chunk in child.iter(dmrpp_tag("chunk")):
+                    ranges.append(
+                        ByteRange(
+                            chunk.get("href", href),
+                            int(chunk.get("offset")),
+                            int(chunk.get("nBytes")),
+                        )
+                    )
+
+    visit(root, "/")
+    return ranges
+
+
+def coalesce_ranges(
+    ranges: Iterable[ByteRange], max_gap: int = 0, max_size: Optional[int] = None
+) -> List[ByteRange]:
+    """
+    Merges overlapping or nearby byte ranges of the same file, so that they
+    can be fetched by fewer requests.
+
+    Args:
+        ranges: The byte ranges.
+        max_gap: The maximum number of unrequested bytes between two ranges
+            fetched together, only contiguous ranges are merged by default.
+        max_size: The maximum size of a merged range, unless its ranges overlap.
+
+    Returns:
+        The merged ranges, sorted by file and offset.
+    """
+    merged: List[ByteRange] = []
+    for byte_range in sorted(set(ranges)):
+        if byte_range.size <= 0:
+            continue
+        last = merged[-1] if merged else None
+        end = max(last.end, byte_range.end) if last is not None else 0
+        if (
+            last is not None
+            and last.href == byte_range.href
+            and (
+                byte_range.offset < last.end
+                or byte_range.offset - last.end <= max_gap
+                and (max_size is None or end - last.offset <= max_size)
+            )
+        ):
+            merged[-1] = last._replace(size=end - last.offset)
+        else:
+            merged.append(byte_range)
+    return merged
+
+
+def _relocate(
+    tree: ET.ElementTree, ranges: List[ByteRange], href: str, data_href: str
+) -> None:
+    """
+    Points the chunks of a subset DMR++ document to their offsets
+    in the local data file, where `ranges` are stored one after the other.
+    """
+    starts = []
+    position = 0
+    for byte_range in ranges:
+        starts.append(position)
+        position += byte_range.size
+
+    root = tree.getroot()
+    href = dmrpp_data_url(root, href)
+    for chunk in root.iter(dmrpp_tag("chunk")):
+        chunk_href = chunk.get("href", href)
+        offset = int(chunk.get("offset"))
+        for start, byte_range in zip(starts, ranges):
+            if byte_range.href == chunk_href and (
+                byte_range.offset <= offset < byte_range.end
+            ):
+                chunk.set("offset", str(start + offset - byte_range.offset))
+                break
+        else:
+            # Empty chunk, with no bytes to point to
+            chunk.set("offset", "0")
+        chunk.attrib.pop("href", None)
+    root.set(dmrpp_tag("href"), data_href)
+
+
+async def fetch_dmrpp(
+    client: httpx.AsyncClient, url: str, dmrpp_url: Optional[str] = None
+) -> ET.ElementTree:
+    """
+    Fetches and parses the DMR++ sidecar of a remote file.
+
+    Args:
+        client: The HTTP client, e.g. carrying the Earthdata Login token.
+        url: The URL of the data file.
+        dmrpp_url: The URL of the DMR++ sidecar, `url` followed by `.dmrpp`
+            by default.
+
+    Returns:
+        The parsed document.
+    """
+    response = await client.get(dmrpp_url or url + DMRPP_SUFFIX)
+    response.raise_for_status()
+    return parse_dmrpp(response.content)
+
+
+async def _fetch_range(
+    client: httpx.AsyncClient,
+    byte_range: ByteRange,
+    file: LocalFile,
+    offset: int,
+    semaphore: asyncio.Semaphore,
+    retries: int,
+    retry_delay: float,
+) -> None:
+    """
+    Fetches a byte range into `file` at `offset`, retrying transient failures.
+    """
+    headers = {"Range": f"bytes={byte_range.offset}-{byte_range.end - 1}"}
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                response = await client.get(byte_range.href, headers=headers)
+            response.raise_for_status()
+            if response.status_code != 206 or (
+                parse_content_range(response.headers.get("Content-Range"))[0]
+                != byte_range.offset
+            ):
+                raise DownloadError(
+                    f"Server did not honor range {headers['Range']} "
+                    f"of {byte_range.href}"
+                )
+            if len(response.content) != byte_range.size:
+                raise DownloadError(
+                    f"Received {len(response.content)} bytes instead of "
+                    f"{byte_range.size} from {byte_range.href}"
+                )
+            await file.write_at(offset, response.content)
+            return
+        except Exception as error:
+            if attempt == retries or not is_retryable(error):
+                raise
+            await asyncio.sleep(random.uniform(0, retry_delay * 2**attempt))
+
+
+async def subset_file(
+    client: httpx.AsyncClient,
+    url: str,
+    variables: Iterable[str],
+    local_path: str,
+    dmrpp_url: Optional[str] = None,
+    max_requests: int = 8,
+    retries: int = 3,
+    retry_delay: float = 1.0,
+) -> str:
+    """
+    Fetches only the chunks of some variables of a remote HDF5 or NetCDF-4 file,
+    located through its DMR++ sidecar, into a compact local copy: a data file
+    holding the chunks one after the other, and a DMR++ document describing
+    the requested variables with their chunks at their new offsets, which
+    DMR++-aware readers can open like the original file.
+
+    Args:
+        client: The HTTP client, e.g. carrying the Earthdata Login token.
+        url: The URL of the data file.
+        variables: The paths of the variables to fetch, e.g.
+            `/gt1l/land_segments/latitude`. The variables of their dimensions
+            are fetched too.
+        local_path: The directory to store the subset into.
+        dmrpp_url: The URL of the DMR++ sidecar, `url` followed by `.dmrpp`
+            by default.
+        max_requests: The maximum number of concurrent range requests.
+        retries: The number of times a failed range request is retried.
+        retry_delay: The base delay in seconds of the exponential backoff.
+
+    Returns:
+        The path of the local DMR++ document, next to the data file
+        named after it without the `.dmrpp` suffix.
+    """
+    tree = await fetch_dmrpp(client, url, dmrpp_url)
+    selected = select_variables(tree, variables)
+    ranges = coalesce_ranges(subset_dmrpp(tree, selected, url))
+
+    data_path = os.path.join(local_path, local_filename(url) + SUBSET_SUFFIX)
+    dmrpp_path = data_path + DMRPP_SUFFIX
+    await run_in_thread(lambda: os.makedirs(local_path, exist_ok=True))
+    file = LocalFile(data_path)
+    await file.open(sum(byte_range.size for byte_range in ranges))
+    semaphore = asyncio.Semaphore(max_requests)
+    try:
+        offsets = []
+        position = 0
+        for byte_range in ranges:
+            offsets.append(position)
+            position += byte_range.size
+        await asyncio.gather(
+            *(
+                _fetch_range(
+                    client, byte_range, file, offset, semaphore, retries, retry_delay
+                )
+                for byte_range, offset in zip(ranges, offsets)
+            )
+        )
+        await file.close()
+    except BaseException:
+        await file.discard()
+        raise
+
+    _relocate(tree, ranges, url, Path(os.path.abspath(data_path)).as_uri())
+    await run_in_thread(
+        lambda: tree.write(dmrpp_path, encoding="UTF-8", xml_declaration=True)
+    )
+    logging.getLogger(__name__).debug(
+        f"Fetched {position} bytes of {len(selected)} variables of {url}"
+    )
+    return dmrpp_path
+
+
+async def subset_files(
+    urls: List[str],
+    variables: Iterable[str],
+    local_path: str,
+    headers: Optional[Dict[str, str]] = None,
+    max_concurrency: int = 4,
+    max_requests_per_file: int = 8,
+    timeout: float = 60.0,
+) -> List[str]:
+    """
+    Subsets several remote files concurrently with `subset_file()`.
+
+    Args:
+        urls: The URLs of the data files.
+        variables: The paths of the variables to fetch.
+        local_path: The directory to store the subsets into.
+        headers: HTTP headers sent with every request,
+            e.g. the Earthdata Login bearer token.
+        max_concurrency: The maximum number of files subset at the same time.
+        max_requests_per_file: The maximum number of concurrent range requests
+            for a single file.
+        timeout: Timeout in seconds for connecting and reading from the server.
+
+    Returns:
+        The paths of the local DMR++ documents, in the order of `urls`.
+
+    Example:
+        Fetches the coordinates and canopy height of ATL08 granules.
+
+        ```python
+        import asyncio
+
+        from prefect_earthdata.dmrpp import subset_files
+
+        paths = asyncio.run(
+            subset_files(
+                urls,
+                ["/gt1l/land_segments/canopy/h_canopy"],
+                "/tmp/subsets",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+        )
+        ```
+    """
+    variables = list(variables)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with earthdata_client(headers, timeout=timeout) as client:
+
+        async def subset(url: str) -> str:
+            """Subsets a file, within the limit of concurrent files."""
+            async with semaphore:
+                return await subset_file(
+                    client,
+                    url,
+                    variables,
+                    local_path,
+                    max_requests=max_requests_per_file,
+                )
+
+        return list(await asyncio.gather(*(subset(url) for url in urls)))
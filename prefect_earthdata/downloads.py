@@ -0,0 +1,2169 @@
+"""Module implementing an asynchronous engine to download data from NASA Earthdata"""
+
+import asyncio
+import concurrent.futures
+import datetime
+import email.utils
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+from urllib.parse import urlparse
+from uuid import uuid4
+
+import fsspec
+import httpx
+from fsspec.implementations.local import LocalFileSystem
+
+from prefect_earthdata.buffers import GranuleBuffer, MemoryBudget, _SpooledTarget
+from prefect_earthdata.cache import GranuleCache, link_file
+from prefect_earthdata.clients import earthdata_client
+from prefect_earthdata.granules import GranuleFile, checksum_hasher, local_filename
+from prefect_earthdata.journal import COMPLETED, FAILED, DownloadJournal, JournalEntry
+from prefect_earthdata.limits import AdaptiveConcurrency, BandwidthLimiter
+from prefect_earthdata.locks import (
+    DEFAULT_LEASE_TTL,
+    LOCK_SUFFIX,
+    FileLease,
+    LeaseLostError,
+)
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+# Response chunks of at least this size are written as received, as copying
+# them into buffers to save a write call costs more than the call
+DIRECT_WRITE_SIZE = 64 * 1024
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_PART_SIZE = 32 * 1024 * 1024
+PART_SUFFIX = ".part"
+SPACE_POLL_INTERVAL = 5.0
+CHECKPOINT_SUFFIX = ".json"
+
+SCHEDULING_ORDERS = ("input", "smallest", "largest", "time")
+
+# Responses worth retrying, as the server may well succeed later
+RETRY_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# Transfers in progress in the process, by URL, revision and remote destination,
+# resolving to the path of the file once done, or to `None` on failure
+_IN_FLIGHT: Dict[
+    Tuple[str, Optional[str], Optional[str]], concurrent.futures.Future
+] = {}
+_IN_FLIGHT_LOCK = threading.Lock()
+
+
+class DownloadError(Exception):
+    """
+    Raised when a file cannot be downloaded.
+
+    Args:
+        message: The description of the error.
+        result: When some files of a download failed, the `DownloadResult`
+            of the whole download, listing the files that succeeded.
+    """
+
+    def __init__(self, message: str, result: Optional["DownloadResult"] = None):
+        super().__init__(message)
+        self.result = result
+
+
+class InsufficientSpaceError(DownloadError):
+    """
+    Raised when the destination filesystem cannot hold the files to download
+    while keeping the requested free space.
+    """
+
+
+async def run_in_thread(func: Callable, *args: Any) -> Any:
+    """
+    Runs a blocking function in the default thread pool executor,
+    so that the event loop is free to serve other transfers in the meantime.
+
+    Args:
+        func: The blocking function to run.
+        args: Positional arguments to be passed to `func`.
+
+    Returns:
+        The value returned by `func`.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args))
+
+
+def default_local_path() -> str:
+    """
+    Builds the default download directory used by `earthaccess.download()`.
+
+    Returns:
+        A new directory path under `./data`, named after the current date.
+    """
+    return os.path.join(
+        ".",
+        "data",
+        f"{datetime.datetime.today().strftime('%Y-%m-%d')}-{uuid4().hex[:6]}",
+    )
+
+
+def verify_file(
+    path: str, file: GranuleFile, buffer_size: int = DEFAULT_BUFFER_SIZE
+) -> bool:
+    """
+    Checks a local file against the size and checksum published for it.
+    Files without any published metadata are trusted as they are.
+
+    Args:
+        path: The path of the local file.
+        file: The remote file, with its metadata.
+        buffer_size: Number of bytes read at a time to compute the checksum.
+
+    Returns:
+        Whether the local file matches the metadata.
+    """
+    if file.size is not None and os.path.getsize(path) != file.size:
+        return False
+
+    hasher = _checksum_hasher(file)
+    if hasher is None:
+        return True
+    with open(path, "rb") as f:
+        for data in iter(partial(f.read, buffer_size), b""):
+            hasher.update(data)
+    return hasher.hexdigest().lower() == file.checksum.lower()
+
+
+def free_space(path: str) -> int:
+    """
+    Tells how much space is available on the filesystem of a local path.
+
+    Args:
+        path: The path, or a path to be created, in which case the space
+            of its closest existing parent is reported.
+
+    Returns:
+        The number of bytes available to the current user.
+    """
+    return shutil.disk_usage(_existing_parent(path)).free
+
+
+def _existing_parent(path: str) -> str:
+    """Returns `path` if it exists, or its closest existing parent."""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def _missing_bytes(files: List[GranuleFile], local_path: str) -> int:
+    """
+    Sums the sizes of the files not yet in `local_path`, minus the bytes
+    already stored in their `.part` files.
+    """
+    total = 0
+    for file in files:
+        size = file.size or file.approximate_size
+        if not size:
+            continue
+        path = os.path.join(local_path, local_filename(file.url))
+        if os.path.exists(path):
+            continue
+        total += size
+        if os.path.exists(path + PART_SUFFIX):
+            total -= min(size, os.path.getsize(path + PART_SUFFIX))
+    return total
+
+
+def _checksum_hasher(file: GranuleFile) -> Any:
+    """
+    Returns a hasher computing the published checksum of a file as it
+    streams, or `None` if no checksum is published or its algorithm
+    is not supported.
+    """
+    if not file.checksum:
+        return None
+    return checksum_hasher(file.checksum_algorithm, file.checksum)
+
+
+def _verify_transfer(file: GranuleFile, size: int, hasher: Any) -> None:
+    """
+    Raises a `DownloadError` if a file streamed through `hasher`
+    does not match its published size and checksum.
+    """
+    if file.size is not None and size != file.size:
+        raise DownloadError(
+            f"Downloaded {size} bytes from {file.url}, expected {file.size}"
+        )
+    if hasher is not None and hasher.hexdigest().lower() != file.checksum.lower():
+        raise DownloadError(
+            f"Checksum of {file.url} does not match its published "
+            f"{file.checksum_algorithm} checksum"
+        )
+
+
+def _allocated_bytes(path: str) -> int:
+    """
+    Returns the number of bytes allocated on disk to a file, which is less
+    than its size for sparse files, or 0 if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return 0
+    blocks = getattr(stat, "st_blocks", None)
+    return stat.st_size if blocks is None else min(stat.st_size, blocks * 512)
+
+
+def _verify_existing(
+    path: str, file: GranuleFile, buffer_size: int = DEFAULT_BUFFER_SIZE
+) -> bool:
+    """
+    Checks that a local file exists and matches the metadata published for it.
+    """
+    return os.path.exists(path) and verify_file(path, file, buffer_size)
+
+
+class DownloadResult(list):
+    """
+    List of the paths of the successfully downloaded files, in the requested
+    order, which also reports how the files were obtained and which failed.
+    Downloads into memory list `GranuleBuffer` objects instead of paths.
+
+    Attributes:
+        downloaded: Number of files transferred from the server.
+        cached: Number of files served from a `GranuleCache`.
+        skipped: Number of files already present and matching their metadata.
+        corrupted: Number of files already present but not matching
+            their metadata, which have been downloaded again.
+        shared: Number of files obtained from a concurrent download
+            of the same URL in the process, or of the same file
+            by another process.
+        paths: The local path of each successfully downloaded URL.
+        failed: The reason of the failure of each URL that could not be
+            downloaded, after all the retries.
+        timings: The time in seconds spent on each URL, retries included.
+        concurrency: With adaptive concurrency, samples of the seconds since
+            the start, the concurrency limit and the throughput in bytes per
+            second, taken at each measurement interval.
+    """
+
+    def __init__(self, paths: Iterable[str] = ()):
+        super().__init__(paths)
+        self.downloaded = 0
+        self.cached = 0
+        self.skipped = 0
+        self.corrupted = 0
+        self.shared = 0
+        self.paths: Dict[str, str] = {}
+        self.failed: Dict[str, str] = {}
+        self.timings: Dict[str, float] = {}
+        self.concurrency: List[Tuple[float, int, float]] = []
+
+    @classmethod
+    def merge(
+        cls, results: Iterable["DownloadResult"], urls: Iterable[str]
+    ) -> "DownloadResult":
+        """
+        Combines the results of downloads of disjoint sets of files.
+
+        Args:
+            results: The results to combine.
+            urls: All the downloaded URLs, in the order of the combined paths.
+
+        Returns:
+            The combined result.
+        """
+        merged = cls()
+        for result in results:
+            for counter in ("downloaded", "cached", "skipped", "corrupted", "shared"):
+                setattr(
+                    merged, counter, getattr(merged, counter) + getattr(result, counter)
+                )
+            merged.paths.update(result.paths)
+            merged.failed.update(result.failed)
+            merged.timings.update(result.timings)
+            merged.concurrency.extend(result.concurrency)
+        merged.extend(merged.paths[url] for url in urls if url in merged.paths)
+        return merged
+
+    def raise_for_failures(self) -> None:
+        """
+        Raises a `DownloadError` carrying this result if some files failed.
+        """
+        if not self.failed:
+            return
+        reasons = "\n".join(f"{url}: {reason}" for url, reason in self.failed.items())
+        raise DownloadError(
+            f"Failed to download {len(self.failed)} of "
+            f"{len(self) + len(self.failed)} files:\n{reasons}",
+            self,
+        )
+
+
+def _time_key(value: str) -> Tuple:
+    """
+    Builds a sort key from an ISO 8601 UTC time, whatever its precision.
+    """
+    match = re.match(r"(\d{4}-\d{2}-\d{2})(?:T(\d{2}:\d{2}:\d{2})(\.\d+)?)?", value)
+    if match is None:
+        return (value,)
+    date, time_of_day, fraction = match.groups()
+    return (date, time_of_day or "", float(fraction or 0))
+
+
+def schedule(
+    files: List[GranuleFile],
+    order: Union[str, Callable[[GranuleFile], Any]] = "input",
+) -> List[int]:
+    """
+    Sorts files in the order their downloads are started.
+
+    Args:
+        files: The files to download.
+        order: The scheduling policy: `input` to keep the order of `files`,
+            `smallest` for the smallest files first, delivering the first
+            files sooner, `largest` for the largest files first, so that no
+            large file delays the end of the download, `time` for the
+            temporal order of the granules, or a function returning
+            the sort key of a file, e.g. a priority or a deadline.
+            Files of unknown size or time come last.
+
+    Returns:
+        The indices of the files, in scheduling order.
+    """
+    indices = list(range(len(files)))
+    if callable(order):
+        return sorted(indices, key=lambda i: order(files[i]))
+    if order == "input":
+        return indices
+    if order in ("smallest", "largest"):
+        sign = 1 if order == "smallest" else -1
+        sizes = [file.approximate_size for file in files]
+        return sorted(indices, key=lambda i: (sizes[i] is None, sign * (sizes[i] or 0)))
+    if order == "time":
+        times = [file.start_time for file in files]
+        return sorted(
+            indices, key=lambda i: (times[i] is None, _time_key(times[i] or ""))
+        )
+    raise ValueError(
+        f"Unknown scheduling order {order!r}, expected one of {SCHEDULING_ORDERS}"
+    )
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Tells whether a failed download is worth retrying.
+
+    Args:
+        error: The exception raised by the download.
+
+    Returns:
+        `True` for network errors, interrupted transfers, lost leases
+        and server responses such as `503 Service Unavailable`
+        or `429 Too Many Requests`.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUS_CODES
+    if isinstance(error, InsufficientSpaceError):
+        return False
+    return isinstance(error, (httpx.TransportError, DownloadError, LeaseLostError))
+
+
+def _is_throttling(error: BaseException) -> bool:
+    """
+    Tells whether a download failed because the server is overloaded.
+    """
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code in (
+        429,
+        503,
+    )
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """
+    Returns the delay in seconds requested by the `Retry-After` header
+    of a failed response, if any.
+    """
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    value = error.response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (date - now).total_seconds())
+
+
+def _error_reason(error: BaseException) -> str:
+    """
+    Describes an error in a single line.
+    """
+    message = str(error).strip().split("\n")[0]
+    return f"{type(error).__name__}: {message}" if message else type(error).__name__
+
+
+def _remote_size(fs: fsspec.AbstractFileSystem, path: str) -> Optional[int]:
+    """
+    Returns the size of a remote file, or `None` if it does not exist.
+    """
+    fs.invalidate_cache(path)
+    try:
+        return fs.info(path)["size"]
+    except FileNotFoundError:
+        return None
+
+
+def _discard(target: Any) -> None:
+    """
+    Throws away a remote file opened without autocommit,
+    e.g. aborting its multipart upload.
+    """
+    try:
+        target.close()
+    except Exception:
+        pass
+    target.discard()
+
+
+def parse_content_range(value: Optional[str]) -> Tuple[int, int, Optional[int]]:
+    """
+    Parses the `Content-Range` header of a partial response.
+
+    Args:
+        value: The value of the header, e.g. `bytes 0-99/1000`.
+
+    Returns:
+        The first and last byte positions of the range, and the total size
+        of the file, `None` if unknown.
+    """
+    match = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+|\*)", (value or "").strip())
+    if match is None:
+        raise DownloadError(f"Invalid Content-Range header: {value!r}")
+    start, end, size = match.groups()
+    return int(start), int(end), None if size == "*" else int(size)
+
+
+def split_ranges(start: int, size: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    Splits the bytes of a file from `start` onwards into ranges.
+
+    Args:
+        start: The position of the first byte to split.
+        size: The total size of the file.
+        chunk_size: The maximum length of each range.
+
+    Returns:
+        A list of `(first, last)` byte positions, both inclusive
+        as in HTTP `Range` headers.
+    """
+    return [
+        (offset, min(offset + chunk_size, size) - 1)
+        for offset in range(start, size, chunk_size)
+    ]
+
+
+def _preallocate(file: Any, size: int) -> None:
+    """
+    Reserves `size` bytes on disk for `file`, falling back to a sparse
+    file where the platform or the filesystem cannot allocate extents.
+    """
+    try:
+        os.posix_fallocate(file.fileno(), 0, size)
+    except (AttributeError, OSError):
+        file.truncate(size)
+
+
+class _InlineChecksum:
+    """
+    Checksum of a file computed from the bytes written in order from its
+    start, as they are received. Bytes written ahead of the hashed prefix,
+    e.g. by parallel byte ranges or before resuming, are read back as soon
+    as the prefix reaches them, while still in the page cache, so that
+    the checksum is complete once the file is.
+    """
+
+    def __init__(self, hasher: Any):
+        self.hasher = hasher
+        self.position = 0
+        # Ranges stored past the hashed prefix, as merged [start, end) pairs
+        self._ahead: List[List[int]] = []
+        self._lock = threading.Lock()
+
+    def stored(self, start: int, end: int) -> None:
+        """Records the bytes from `start` to `end` as stored, unhashed."""
+        with self._lock:
+            self._add(start, end)
+
+    def update(
+        self,
+        offset: int,
+        data: Union[bytes, memoryview],
+        read_at: Optional[Callable[[int, int], bytes]] = None,
+    ) -> None:
+        """
+        Hashes the bytes written at `offset` if they come next, or records
+        them as stored otherwise. Stored bytes the hashed prefix reaches
+        are then read back with `read_at`, given an offset and a size.
+        """
+        with self._lock:
+            end = offset + len(data)
+            if offset <= self.position < end:
+                self.hasher.update(memoryview(data)[self.position - offset :])
+                self.position = end
+            elif offset > self.position:
+                self._add(offset, end)
+            if read_at is not None:
+                self._catch_up(read_at)
+
+    def _add(self, start: int, end: int) -> None:
+        """Merges a range stored past the hashed prefix."""
+        merged: List[List[int]] = []
+        for first, last in sorted(self._ahead + [[start, end]]):
+            if merged and first <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        self._ahead = merged
+
+    def _catch_up(
+        self,
+        read_at: Callable[[int, int], bytes],
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+    ) -> None:
+        """Hashes the stored ranges the hashed prefix reaches."""
+        while self._ahead and self._ahead[0][0] <= self.position:
+            _, end = self._ahead.pop(0)
+            while self.position < end:
+                data = read_at(self.position, min(buffer_size, end - self.position))
+                if not data:
+                    return
+                self.hasher.update(data)
+                self.position += len(data)
+
+    def hexdigest(self, path: str, buffer_size: int = DEFAULT_BUFFER_SIZE) -> str:
+        """Hashes the rest of the complete file at `path`, blocking until done."""
+        with self._lock, open(path, "rb") as f:
+            self._ahead = []
+            f.seek(self.position)
+            for data in iter(partial(f.read, buffer_size), b""):
+                self.hasher.update(data)
+                self.position += len(data)
+            return self.hasher.hexdigest().lower()
+
+
+class LocalFile:
+    """
+    A local file written from worker threads at arbitrary offsets,
+    so that several byte ranges can be stored in place concurrently.
+    The written bytes are fed to `checksum` as they are stored.
+
+    Args:
+        path: The path of the file.
+        checksum: The checksum of the file, computed as it is written.
+    """
+
+    def __init__(self, path: str, checksum: Optional[_InlineChecksum] = None):
+        self.path = path
+        self.checksum = checksum
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def opened(self) -> bool:
+        """Whether the file has been created."""
+        return self._file is not None
+
+    async def open(
+        self,
+        size: Optional[int] = None,
+        resume: bool = False,
+        stored: Sequence[Sequence[int]] = (),
+    ) -> None:
+        """
+        Creates the file, preallocating `size` bytes if known,
+        or opens the existing file without truncating it if `resume` is set,
+        where the `stored` ranges of inclusive offsets are already written.
+        """
+
+        def create():
+            """Opens the file, blocking until done."""
+            if resume:
+                return open(self.path, "r+b", buffering=0)
+            file = open(self.path, "w+b", buffering=0)
+            if size:
+                _preallocate(file, size)
+            return file
+
+        self._file = await run_in_thread(create)
+        if resume and self.checksum is not None:
+            for first, last in stored:
+                self.checksum.stored(first, last + 1)
+
+    def _read_at(self, offset: int, size: int) -> bytes:
+        """Reads up to `size` bytes at `offset`, blocking until done."""
+        if not hasattr(os, "pread"):
+            with self._lock:
+                self._file.seek(offset)
+                return self._file.read(size)
+        return os.pread(self._file.fileno(), size, offset)
+
+    def _write_at(self, offset: int, data: Union[bytes, memoryview]) -> None:
+        """Writes `data` at `offset`, blocking until done."""
+        if not hasattr(os, "pwrite"):
+            with self._lock:
+                self._file.seek(offset)
+                self._file.write(data)
+        else:
+            view = memoryview(data)
+            position = offset
+            while view:
+                written = os.pwrite(self._file.fileno(), view, position)
+                view = view[written:]
+                position += written
+
+        if self.checksum is not None:
+            self.checksum.update(offset, data, self._read_at)
+
+    async def write_at(self, offset: int, data: Union[bytes, memoryview]) -> None:
+        """Writes `data` at `offset` from a worker thread."""
+        await run_in_thread(self._write_at, offset, data)
+
+    async def sync(self) -> None:
+        """Makes sure the written bytes are stored on disk."""
+        await run_in_thread(os.fsync, self._file.fileno())
+
+    async def close(self) -> None:
+        """Closes the file."""
+        if self._file is not None:
+            file, self._file = self._file, None
+            await run_in_thread(file.close)
+
+    async def discard(self) -> None:
+        """Closes and removes the file."""
+        await self.close()
+        if os.path.exists(self.path):
+            await run_in_thread(os.remove, self.path)
+
+
+class _Checkpoint:
+    """
+    Progress of a partial download, stored in a JSON sidecar next to the
+    `.part` file so that an interrupted download can be resumed.
+
+    Only byte ranges flushed to disk are recorded, together with the size
+    of the remote file and a validator telling whether it changed since.
+    """
+
+    def __init__(self, path: str, url: str):
+        self.path = path
+        self.url = url
+        self.size: Optional[int] = None
+        self.validator: Optional[str] = None
+        self.ranges: List[List[int]] = []
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> None:
+        """
+        Reads the checkpoint from disk, starting from scratch if it is
+        missing, unreadable or refers to another URL.
+        """
+
+        def read():
+            """Reads the state saved on disk."""
+            with open(self.path) as f:
+                return json.load(f)
+
+        try:
+            state = await run_in_thread(read)
+        except (OSError, ValueError):
+            return
+
+        if state.get("url") == self.url:
+            self.size = state.get("size")
+            self.validator = state.get("validator")
+            self.ranges = state.get("ranges", [])
+
+    @property
+    def completed(self) -> int:
+        """Number of bytes already stored."""
+        return sum(last - first + 1 for first, last in self.ranges)
+
+    @property
+    def prefix(self) -> int:
+        """Number of contiguous bytes stored from the start of the file."""
+        if self.ranges and self.ranges[0][0] == 0:
+            return self.ranges[0][1] + 1
+        return 0
+
+    def reset(self, size: Optional[int], validator: Optional[str]) -> None:
+        """Forgets the stored ranges, for a new version of the remote file."""
+        self.size = size
+        self.validator = validator
+        self.ranges = []
+
+    def add(self, first: int, last: int) -> None:
+        """Records the bytes from `first` to `last` as stored."""
+        merged: List[List[int]] = []
+        for start, end in sorted(self.ranges + [[first, last]]):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.ranges = merged
+
+    def missing(self, chunk_size: int) -> List[Tuple[int, int]]:
+        """Splits the bytes not stored yet into ranges of `chunk_size`."""
+        missing, position = [], 0
+        for first, last in self.ranges + [[self.size, self.size]]:
+            missing.extend(split_ranges(position, first, chunk_size))
+            position = last + 1
+        return missing
+
+    async def save(self) -> None:
+        """Atomically writes the checkpoint to disk."""
+        state = {
+            "url": self.url,
+            "size": self.size,
+            "validator": self.validator,
+            "ranges": self.ranges,
+        }
+
+        def write():
+            """Replaces the state on disk atomically."""
+            temp_path = f"{self.path}.{uuid4().hex[:6]}"
+            with open(temp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.path)
+
+        async with self._lock:
+            await run_in_thread(write)
+
+    async def remove(self) -> None:
+        """Removes the checkpoint from disk."""
+        if os.path.exists(self.path):
+            await run_in_thread(os.remove, self.path)
+
+
+def _validator(response: httpx.Response) -> Optional[str]:
+    """
+    Returns the strong ETag or the Last-Modified date of a response,
+    usable in `If-Range` headers to resume a download of the same file.
+    """
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def _response_size(response: httpx.Response) -> Optional[int]:
+    """
+    Returns the total size of the file served by a full or partial response.
+    """
+    if response.status_code == 206:
+        return parse_content_range(response.headers.get("Content-Range"))[2]
+    length = response.headers.get("Content-Length")
+    return int(length) if length is not None else None
+
+
+def _allocation_size(response: httpx.Response) -> Optional[int]:
+    """
+    Returns the size of the file a full response is stored into, if known
+    up front, which it is not when the body is compressed in transit.
+    """
+    if "Content-Encoding" in response.headers:
+        return None
+    return _response_size(response)
+
+
+class _BufferPool:
+    """
+    Preallocated buffers reused by the transfers of an engine, so that
+    receiving data does not allocate and grow a new buffer every time.
+    """
+
+    def __init__(self, buffer_size: int = DEFAULT_BUFFER_SIZE, max_free: int = 16):
+        self.buffer_size = buffer_size
+        self.max_free = max_free
+        self._free: List[bytearray] = []
+
+    def acquire(self) -> bytearray:
+        """Takes a free buffer, allocating one if there is none."""
+        if self._free:
+            return self._free.pop()
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer: bytearray) -> None:
+        """Returns a buffer nothing refers to anymore."""
+        if len(self._free) < self.max_free:
+            self._free.append(buffer)
+
+
+class _BufferedWriter:
+    """
+    Hands the chunks of a response body to `sink` with their offset,
+    as memoryviews, one write at a time while the next chunks are received.
+    Chunks of at least `DIRECT_WRITE_SIZE` bytes, or a buffer, are handed
+    over as they are, without being copied, and smaller ones gathered into
+    buffers from a `_BufferPool`, handed over once full.
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[int, memoryview], Awaitable[Any]],
+        offset: int,
+        pool: _BufferPool,
+    ):
+        self.sink = sink
+        self.offset = offset
+        self.pool = pool
+        # Bytes the sink is done with, as opposed to handed over
+        self.written = 0
+        self.direct_size = min(DIRECT_WRITE_SIZE, pool.buffer_size)
+        self._submitted = 0
+        self._buffer: Optional[bytearray] = None
+        self._filled = 0
+        self._pending: Optional[asyncio.Future] = None
+        self._pending_buffer: Optional[bytearray] = None
+        self._pending_size = 0
+
+    async def write(self, data: bytes) -> None:
+        """Hands `data` over, or buffers it until the buffer is full."""
+        view = memoryview(data)
+        if len(view) >= self.direct_size:
+            if self._filled:
+                await self._submit_buffer()
+            await self._submit(view)
+            return
+
+        while view:
+            if self._buffer is None:
+                self._buffer = self.pool.acquire()
+            size = min(len(view), len(self._buffer) - self._filled)
+            self._buffer[self._filled : self._filled + size] = view[:size]
+            self._filled += size
+            view = view[size:]
+            if self._filled == len(self._buffer):
+                await self._submit_buffer()
+
+    async def _submit_buffer(self) -> None:
+        """Hands the current buffer over."""
+        buffer, filled = self._buffer, self._filled
+        self._buffer, self._filled = None, 0
+        await self._submit(memoryview(buffer)[:filled], buffer)
+
+    async def _submit(
+        self, data: memoryview, buffer: Optional[bytearray] = None
+    ) -> None:
+        """Hands `data` over once the previous write is done."""
+        await self._wait()
+        self._pending = asyncio.ensure_future(
+            self.sink(self.offset + self._submitted, data)
+        )
+        self._pending_buffer = buffer
+        self._pending_size = len(data)
+        self._submitted += len(data)
+
+    async def _wait(self) -> None:
+        """Waits for the pending write, returning its buffer to the pool."""
+        if self._pending is None:
+            return
+        pending, self._pending = self._pending, None
+        # A buffer a failed or cancelled write may still be reading is dropped
+        await pending
+        if self._pending_buffer is not None:
+            self.pool.release(self._pending_buffer)
+            self._pending_buffer = None
+        self.written += self._pending_size
+
+    async def close(self) -> None:
+        """Hands the buffered bytes over and waits for all writes to be done."""
+        try:
+            if self._filled:
+                await self._submit_buffer()
+            await self._wait()
+        finally:
+            if self._buffer is not None:
+                self.pool.release(self._buffer)
+                self._buffer = None
+
+
+class DownloadEngine:
+    """
+    Asynchronous engine downloading files over HTTP(S).
+
+    Transfers run concurrently on the event loop, bounded by a global limit
+    and an optional per-host limit, while disk writes are offloaded to
+    worker threads. Several engines, e.g. from concurrent `download` task runs,
+    can therefore share the same event loop and actually overlap.
+
+    Files larger than `chunk_size` are split into byte ranges fetched
+    concurrently with HTTP `Range` requests and written in place into a
+    preallocated file, so that a single large granule is not limited by the
+    throughput of one connection. Servers that do not support ranges get the
+    whole file in a single response instead.
+
+    Received chunks are written to disk by worker threads from memoryviews
+    as they are, while the next ones are received, and only small chunks
+    gathered into preallocated buffers of `buffer_size` bytes, reused across
+    transfers, so that the event loop neither copies nor allocates the bytes
+    it receives.
+
+    Files already present in the destination directory are skipped if they
+    match the size and checksum published in CMR, and downloaded again if not.
+    Downloaded files are checked against their published checksum as well,
+    computed on the bytes as they are written instead of reading the files
+    again, and fetched again on mismatch.
+
+    Concurrent downloads of the same URL and revision within the process,
+    from any engine, thread or event loop, share a single transfer: the other
+    downloads wait for it and get the resulting file, linked into their own
+    directory if needed. Across the processes of a node, a `FileLease` on each
+    local file lets one process download it while the others wait and reuse
+    the result, instead of writing the same `.part` file at the same time.
+
+    With a `GranuleCache`, granule files already downloaded by any process on
+    the node are linked into the destination directory without any transfer,
+    and newly downloaded files are added to the cache.
+
+    Files are written as `.part` files, next to a small JSON sidecar recording
+    the byte ranges already stored on disk. If a download is interrupted, e.g.
+    by a preempted worker, the next attempt resumes from there with `Range`
+    requests, as long as the remote file did not change. Complete files are
+    atomically renamed into place.
+
+    Each file is retried independently on network errors, interrupted
+    transfers and transient server errors, after a jittered exponential
+    backoff honoring any `Retry-After` header. Files failing for good do not
+    stop the others: the download raises a `DownloadError` carrying the
+    partial `DownloadResult` once all files are done, or returns it when
+    `allow_failures` is set.
+
+    Before any transfer to a local directory, the published sizes of the
+    missing files are checked against the free space of its filesystem, which
+    must stay above `min_free_space`. New transfers also wait, before taking
+    a transfer slot, while the free space left by the transfers in progress is
+    too low for them, e.g. because of other writers, and fail with an
+    `InsufficientSpaceError` if it does not recover within `space_timeout`.
+    With `evict_cache`, the least recently used files of the `GranuleCache`
+    are evicted to make room first.
+
+    The destination can also be any fsspec URL, e.g. `s3://bucket/prefix`:
+    response bodies are then streamed straight into the remote filesystem,
+    as multipart uploads committed once complete, without local staging.
+    Such files are transferred with a single request, are not resumed nor
+    cached, and are skipped if already present with their published size.
+
+    With a `DownloadJournal`, the state, size and checksum of every file is
+    durably recorded as soon as it is done. Files recorded as completed,
+    consistently with their published metadata, are skipped without even
+    checking the destination, which keeps restarts of huge downloads cheap.
+
+    With `adaptive_concurrency`, the number of files transferred at the same
+    time is tuned by an `AdaptiveConcurrency` controller: it grows while the
+    throughput rises and is cut back on throttling responses and latency
+    spikes, up to `max_concurrency`. A `BandwidthLimiter` caps the bandwidth
+    of the download, and of any other download sharing it.
+
+    Args:
+        headers: HTTP headers sent with every request,
+            e.g. the Earthdata Login bearer token.
+        max_concurrency: Maximum number of files transferred at the same time.
+        adaptive_concurrency: Whether to adjust the number of files transferred
+            at the same time to the observed throughput and throttling.
+        max_per_host: Maximum number of concurrent requests to a single host.
+            Unlimited if `None`.
+        bandwidth: A limiter capping the bandwidth of the download.
+        buffer_size: Number of bytes of small chunks buffered in memory
+            before writing to disk, and the maximum size of network reads.
+        timeout: Timeout in seconds for connecting and reading from the server.
+        chunk_size: Size in bytes of the ranges large files are split into.
+        max_chunks_per_file: Maximum number of ranges of a single file
+            fetched at the same time. Set to 1 to download each file
+            with a single request.
+        resume: Whether to resume interrupted downloads from their `.part` files.
+        skip_existing: Whether to skip files already present and matching
+            their published size and checksum.
+        cache: A node-local `GranuleCache` to serve files from
+            and add downloaded ones to.
+        order: The order downloads are started in, one of the policies
+            of `schedule()` or a function returning the sort key of a file.
+        journal: A `DownloadJournal` recording the state of each file, so that
+            restarted downloads skip the files it records as completed.
+        part_size: Size in bytes of the parts of multipart uploads
+            to remote destinations.
+        min_free_space: Number of bytes to keep free on the filesystem
+            of local destinations. Free space is not checked if `None`.
+        evict_cache: Whether to evict files from the `GranuleCache`
+            when short of space, if on the same filesystem.
+        space_timeout: Maximum number of seconds a transfer waits
+            for free space.
+        lease_ttl: Number of seconds after which the lease of a process on
+            a local file is reclaimed if not refreshed, e.g. after a crash.
+            Transfers of files whose lease was lost are aborted and retried.
+            Files are not leased if `None`.
+        storage_options: Options of the fsspec filesystem of remote
+            destinations, e.g. credentials.
+        retries: Number of times a failed file is retried.
+        retry_delay: Base delay in seconds of the exponential backoff.
+        max_retry_delay: Maximum delay in seconds between two attempts.
+        allow_failures: Whether to return the partial result when some files
+            fail, instead of raising a `DownloadError`.
+        logger: The logger reporting retries, the module logger by default.
+
+    Example:
+        Downloads a list of URLs to a local directory.
+
+        ```python
+        import asyncio
+
+        from prefect_earthdata.downloads import DownloadEngine
+
+        engine = DownloadEngine(max_concurrency=16, max_per_host=4)
+        files = asyncio.run(engine.download(urls, "/tmp/granules"))
+        ```
+    """
+
+    def __init__(
+        self,
+        headers: Optional[Dict[str, str]] = None,
+        max_concurrency: int = 8,
+        adaptive_concurrency: bool = False,
+        max_per_host: Optional[int] = None,
+        bandwidth: Optional[BandwidthLimiter] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        timeout: float = 60.0,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_chunks_per_file: int = 4,
+        resume: bool = True,
+        skip_existing: bool = True,
+        cache: Optional[GranuleCache] = None,
+        order: Union[str, Callable[[GranuleFile], Any]] = "input",
+        journal: Optional[DownloadJournal] = None,
+        part_size: int = DEFAULT_PART_SIZE,
+        min_free_space: Optional[int] = 0,
+        evict_cache: bool = False,
+        space_timeout: float = 300.0,
+        lease_ttl: Optional[float] = DEFAULT_LEASE_TTL,
+        storage_options: Optional[Dict[str, Any]] = None,
+        retries: int = 3,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 60.0,
+        allow_failures: bool = False,
+        logger: Optional[Union[logging.Logger, logging.LoggerAdapter]] = None,
+    ):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        if max_per_host is not None and max_per_host < 1:
+            raise ValueError("max_per_host must be at least 1")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        if max_chunks_per_file < 1:
+            raise ValueError("max_chunks_per_file must be at least 1")
+        if not callable(order) and order not in SCHEDULING_ORDERS:
+            raise ValueError(
+                f"Unknown scheduling order {order!r}, "
+                f"expected one of {SCHEDULING_ORDERS}"
+            )
+        if retries < 0:
+            raise ValueError("retries must not be negative")
+
+        self.headers = headers or {}
+        self.max_concurrency = max_concurrency
+        self.adaptive_concurrency = adaptive_concurrency
+        self.max_per_host = max_per_host
+        self.bandwidth = bandwidth
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.max_chunks_per_file = max_chunks_per_file
+        self.resume = resume
+        self.skip_existing = skip_existing
+        self.cache = cache
+        self.order = order
+        self.journal = journal
+        self.part_size = part_size
+        self.min_free_space = min_free_space
+        self.evict_cache = evict_cache
+        self.space_timeout = space_timeout
+        self.lease_ttl = lease_ttl
+        self.storage_options = storage_options or {}
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.allow_failures = allow_failures
+        self.logger = logger or logging.getLogger(__name__)
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._concurrency: Optional[AdaptiveConcurrency] = None
+        # Bytes reserved by the transfers admitted into local directories
+        self._admitted: Dict[str, int] = {}
+        self._admission: Optional[asyncio.Lock] = None
+        # As many buffers as transfers can be filling and writing at once
+        self._buffers = _BufferPool(
+            buffer_size, max_free=2 * max_concurrency * max_chunks_per_file
+        )
+
+    def _client(self) -> httpx.AsyncClient:
+        """
+        Builds the HTTP client shared by all the transfers of a download.
+        """
+        event_hooks = {}
+        if self.adaptive_concurrency:
+            event_hooks = {
+                "request": [self._on_request],
+                "response": [self._on_response],
+            }
+        # The engine bounds concurrency itself
+        return earthdata_client(
+            self.headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=None),
+            read_size=self.buffer_size,
+            event_hooks=event_hooks,
+        )
+
+    async def _on_request(self, request: httpx.Request) -> None:
+        """Records when a request is sent."""
+        request.extensions["prefect_earthdata.sent"] = time.monotonic()
+
+    async def _on_response(self, response: httpx.Response) -> None:
+        """Reports how long the server took to respond to the controller."""
+        sent = response.request.extensions.get("prefect_earthdata.sent")
+        if sent is not None and self._concurrency is not None:
+            self._concurrency.latency(time.monotonic() - sent)
+
+    @asynccontextmanager
+    async def _host_slot(self, url: str) -> AsyncIterator[None]:
+        """
+        Waits until a request to the host of `url` can be issued.
+        """
+        if self.max_per_host is None:
+            yield
+            return
+
+        host = urlparse(url).netloc
+        semaphore = self._host_semaphores.setdefault(
+            host, asyncio.Semaphore(self.max_per_host)
+        )
+        async with semaphore:
+            yield
+
+    async def download(
+        self, files: List[Union[str, GranuleFile]], local_path: str
+    ) -> DownloadResult:
+        """
+        Downloads a list of files to a local directory or a remote location.
+
+        Args:
+            files: The URLs to download, or `GranuleFile` objects
+                also carrying their published size and checksum.
+            local_path: The directory to store the files into, created
+                if it does not exist, or an fsspec URL such as
+                `s3://bucket/prefix`.
+
+        Returns:
+            The paths of the local files, or the URLs of the remote ones,
+            in the same order as `files`.
+
+        Raises:
+            InsufficientSpaceError: If the files cannot fit in a local
+                destination.
+            DownloadError: If some files could not be downloaded and
+                `allow_failures` is not set, with the partial result.
+        """
+        files = [GranuleFile(file) if isinstance(file, str) else file for file in files]
+        async with self._transfers(local_path, files) as transfer:
+            # Semaphores serve waiters first come, first served
+            order = schedule(files, self.order)
+            scheduled = await asyncio.gather(
+                *(transfer(files[index]) for index in order)
+            )
+        outcomes: List[Any] = [None] * len(files)
+        for index, outcome in zip(order, scheduled):
+            outcomes[index] = outcome
+        return self._result(files, outcomes)
+
+    async def download_stream(
+        self, files: AsyncIterable[Union[str, GranuleFile]], local_path: str
+    ) -> DownloadResult:
+        """
+        Downloads files as they are produced, e.g. by a paged search, so that
+        transfers start before the full list is known. At most
+        `max_concurrency` files are taken from `files` ahead of completing
+        their downloads, which holds back the producer when it is faster.
+
+        Args:
+            files: An asynchronous iterable of URLs or `GranuleFile` objects,
+                downloaded in the order they are produced.
+            local_path: The directory to store the files into, created
+                if it does not exist, or an fsspec URL such as
+                `s3://bucket/prefix`.
+
+        Returns:
+            The paths of the local files, or the URLs of the remote ones,
+            in the order they were produced.
+
+        Raises:
+            DownloadError: If some files could not be downloaded and
+                `allow_failures` is not set, with the partial result.
+        """
+        received: List[GranuleFile] = []
+        tasks: List[asyncio.Future] = []
+        async with self._transfers(local_path) as transfer:
+            pending: Set[asyncio.Future] = set()
+            try:
+                iterator = files.__aiter__()
+                while True:
+                    # Takes no more files than can be downloaded right away
+                    while len(pending) >= self.max_concurrency:
+                        _, pending = await asyncio.wait(
+                            pending, return_when=asyncio.FIRST_COMPLETED
+                        )
+                    try:
+                        file = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    if isinstance(file, str):
+                        file = GranuleFile(file)
+                    task = asyncio.ensure_future(transfer(file))
+                    received.append(file)
+                    tasks.append(task)
+                    pending.add(task)
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        return self._result(received, [task.result() for task in tasks])
+
+    async def download_buffers(
+        self,
+        files: List[Union[str, GranuleFile]],
+        budget: MemoryBudget,
+        spill_path: Optional[str] = None,
+        shared_memory: bool = False,
+    ) -> DownloadResult:
+        """
+        Downloads a list of files into memory, for processing without
+        a round trip through the filesystem. Files are held in memory
+        as long as `budget` allows, and spilled to temporary files
+        in `spill_path` beyond it. Each file is transferred with a single
+        request, and neither skipped, cached nor journaled.
+
+        Args:
+            files: The URLs to download, or `GranuleFile` objects
+                also carrying their published size and checksum.
+            budget: The memory the files may take, possibly shared
+                with other downloads.
+            spill_path: The local directory of the temporary files of the files
+                over the budget, the system temporary directory by default
+                or if an fsspec URL of a remote filesystem.
+            shared_memory: Whether to hold the files in shared memory segments,
+                as `SharedGranuleBuffer` objects other processes attach to.
+
+        Returns:
+            The downloaded files as `GranuleBuffer` objects, in the same order
+            as `files`, to be released once processed.
+
+        Raises:
+            DownloadError: If some files could not be downloaded and
+                `allow_failures` is not set, with the partial result.
+        """
+        files = [GranuleFile(file) if isinstance(file, str) else file for file in files]
+        if spill_path is not None:
+            fs, root = self._filesystem(spill_path)
+            # Temporary files are written locally, not to the destination
+            spill_path = root if fs is None else None
+        slots = self._slots()
+        async with self._client() as client:
+            order = schedule(files, self.order)
+            scheduled = await asyncio.gather(
+                *(
+                    self._download_with_retries(
+                        files[index],
+                        partial(
+                            self._buffer_file,
+                            client,
+                            files[index],
+                            budget,
+                            spill_path,
+                            shared_memory,
+                        ),
+                        slots,
+                    )
+                    for index in order
+                )
+            )
+        outcomes: List[Any] = [None] * len(files)
+        for index, outcome in zip(order, scheduled):
+            outcomes[index] = outcome
+        return self._result(files, outcomes)
+
+    def _slots(self) -> Union[asyncio.Semaphore, AdaptiveConcurrency]:
+        """
+        Builds the transfer slots of a download, bounding the number
+        of files transferred at the same time.
+        """
+        if not self.adaptive_concurrency:
+            return asyncio.Semaphore(self.max_concurrency)
+        if self._concurrency is None:
+            self._concurrency = AdaptiveConcurrency(
+                self.max_concurrency, logger=self.logger
+            )
+        return self._concurrency
+
+    @asynccontextmanager
+    async def _transfers(
+        self, local_path: str, files: Optional[List[GranuleFile]] = None
+    ) -> AsyncIterator[Callable[[GranuleFile], Awaitable[Tuple[str, Any, float]]]]:
+        """
+        Prepares the destination, the journal and the client of a download,
+        yielding the coroutine function downloading a single file. The free
+        space of a local destination is checked for the `files` about to be
+        downloaded, if known, other than those the journal records as completed.
+        """
+        fs, root = self._filesystem(local_path)
+        if fs is None:
+            await run_in_thread(partial(os.makedirs, local_path, exist_ok=True))
+        else:
+            await run_in_thread(partial(fs.makedirs, root, exist_ok=True))
+
+        slots = self._slots()
+        if fs is None:
+            destination = os.path.abspath(root)
+            size_of: Callable[[str], Optional[int]] = os.path.getsize
+        else:
+            destination = fs.unstrip_protocol(root)
+            size_of = partial(_remote_size, fs)
+        journaled: Dict[str, JournalEntry] = {}
+        if self.journal is not None:
+            journaled = await run_in_thread(self.journal.load, destination)
+        if files is not None and fs is None and self.min_free_space is not None:
+            await self._check_space(
+                [
+                    file
+                    for file in files
+                    if file.url not in journaled
+                    or not journaled[file.url].matches(file)
+                ],
+                root,
+            )
+
+        async with self._client() as client:
+
+            def transfer(file: GranuleFile) -> Awaitable[Tuple[str, Any, float]]:
+                """Downloads a file to the destination, through the journal."""
+                file_path = None
+                if fs is None:
+                    file_path = os.path.join(local_path, local_filename(file.url))
+                    download_callable = partial(
+                        self._download_file, client, file, local_path
+                    )
+                else:
+                    download_callable = partial(
+                        self._stream_file, client, file, fs, root
+                    )
+                return self._download_journaled(
+                    file,
+                    download_callable,
+                    slots,
+                    destination,
+                    journaled.get(file.url),
+                    size_of,
+                    file_path,
+                )
+
+            yield transfer
+
+    def _result(
+        self, files: List[GranuleFile], outcomes: List[Tuple[str, Any, float]]
+    ) -> DownloadResult:
+        """
+        Builds the result of a download from the outcome of each file,
+        raising if some failed and failures are not allowed.
+        """
+        result = DownloadResult()
+        for file, (path, outcome, elapsed) in zip(files, outcomes):
+            result.timings[file.url] = elapsed
+            if isinstance(outcome, BaseException):
+                result.failed[file.url] = _error_reason(outcome)
+                continue
+            result.append(path)
+            result.paths[file.url] = path
+            setattr(result, outcome, getattr(result, outcome) + 1)
+        result.downloaded += result.corrupted
+        if self._concurrency is not None:
+            result.concurrency = list(self._concurrency.history)
+
+        if not self.allow_failures:
+            result.raise_for_failures()
+        return result
+
+    def _backoff(self, error: BaseException, attempt: int) -> float:
+        """
+        Computes the delay before retrying after the failed `attempt`,
+        with full jitter so that failed files do not retry in lockstep.
+        """
+        delay = random.uniform(
+            0, min(self.max_retry_delay, self.retry_delay * 2**attempt)
+        )
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_delay))
+        return delay
+
+    def _filesystem(
+        self, local_path: str
+    ) -> Tuple[Optional[fsspec.AbstractFileSystem], str]:
+        """
+        Resolves the destination of a download.
+
+        Returns:
+            The fsspec filesystem and root path of a remote destination,
+            or `None` and `local_path` for a local directory.
+        """
+        if "://" not in local_path and "::" not in local_path:
+            return None, local_path
+        fs, root = fsspec.core.url_to_fs(local_path, **self.storage_options)
+        if isinstance(fs, LocalFileSystem):
+            return None, root
+        return fs, root
+
+    async def _download_journaled(
+        self,
+        granule_file: GranuleFile,
+        download: Callable[[], Awaitable[Tuple[str, str]]],
+        slots: Union[asyncio.Semaphore, AdaptiveConcurrency],
+        destination: str,
+        entry: Optional[JournalEntry],
+        size_of: Callable[[str], Optional[int]],
+        file_path: Optional[str],
+    ) -> Tuple[Optional[str], Union[str, BaseException], float]:
+        """
+        Downloads a single file unless the journal records it as completed,
+        then records its new state in the journal.
+        """
+        if entry is not None and entry.matches(granule_file):
+            return entry.path, "skipped", 0.0
+
+        path, outcome, elapsed = await self._download_shared(
+            granule_file, download, slots, destination, file_path
+        )
+        if self.journal is None:
+            return path, outcome, elapsed
+
+        if isinstance(outcome, BaseException):
+            entry = JournalEntry(
+                granule_file.url, destination, FAILED, reason=_error_reason(outcome)
+            )
+        else:
+            entry = JournalEntry(
+                granule_file.url,
+                destination,
+                COMPLETED,
+                path=path,
+                size=await run_in_thread(size_of, path),
+                checksum=granule_file.checksum,
+                checksum_algorithm=granule_file.checksum_algorithm,
+            )
+        await run_in_thread(self.journal.record, entry)
+        return path, outcome, elapsed
+
+    async def _download_shared(
+        self,
+        granule_file: GranuleFile,
+        download: Callable[[], Awaitable[Tuple[str, str]]],
+        slots: Union[asyncio.Semaphore, AdaptiveConcurrency],
+        destination: str,
+        file_path: Optional[str],
+    ) -> Tuple[Optional[str], Union[str, BaseException], float]:
+        """
+        Downloads a single file, unless a download of the same URL and revision
+        is already in progress in the process, from any thread or event loop.
+        The file is then obtained from that download once done: as the same
+        file in the same destination, or linked to `file_path` when stored
+        in another local directory. If that download fails, the file
+        is downloaded as usual.
+        """
+        # Remote files cannot be linked across destinations
+        key = (
+            granule_file.url,
+            granule_file.revision_id,
+            None if file_path else destination,
+        )
+        with _IN_FLIGHT_LOCK:
+            shared = _IN_FLIGHT.get(key)
+            leader = shared is None
+            if leader:
+                shared = _IN_FLIGHT[key] = concurrent.futures.Future()
+
+        if leader:
+            path = None
+            try:
+                path, outcome, elapsed = await self._download_with_retries(
+                    granule_file, download, slots, file_path
+                )
+                if isinstance(outcome, BaseException):
+                    path = None
+                return path, outcome, elapsed
+            finally:
+                with _IN_FLIGHT_LOCK:
+                    del _IN_FLIGHT[key]
+                shared.set_result(path)
+
+        start = time.monotonic()
+        # Waiting must not cancel the download, others may wait for it too
+        shared_path = await asyncio.shield(asyncio.wrap_future(shared))
+        if shared_path is not None:
+            if file_path is None:
+                return shared_path, "shared", time.monotonic() - start
+            try:
+                if os.path.abspath(shared_path) != os.path.abspath(file_path):
+                    await run_in_thread(link_file, shared_path, file_path)
+                return file_path, "shared", time.monotonic() - start
+            except OSError:
+                # Removed or moved in the meantime
+                pass
+        return await self._download_with_retries(
+            granule_file, download, slots, file_path
+        )
+
+    async def _download_with_retries(
+        self,
+        granule_file: GranuleFile,
+        download: Callable[[], Awaitable[Tuple[str, str]]],
+        slots: Union[asyncio.Semaphore, AdaptiveConcurrency],
+        file_path: Optional[str] = None,
+    ) -> Tuple[Optional[str], Union[str, BaseException], float]:
+        """
+        Downloads a single file with `download`, retrying transient failures.
+        The transfer slot is released while waiting, for other files to use it.
+        Each attempt waits for free space for the local file at `file_path`,
+        if any, before taking a slot.
+
+        Returns:
+            The path of the local file, the outcome of `download`
+            or the exception of the last attempt, and the elapsed time.
+        """
+        start = None
+        attempt = 0
+        while True:
+            try:
+                async with self._space_for(granule_file, file_path), slots:
+                    if start is None:
+                        start = time.monotonic()
+                    path, outcome = await download()
+                return path, outcome, time.monotonic() - start
+            except Exception as error:
+                if self._concurrency is not None and _is_throttling(error):
+                    self._concurrency.throttled(
+                        f"throttled by {urlparse(granule_file.url).netloc}"
+                    )
+                if attempt >= self.retries or not is_retryable(error):
+                    # Failing before any transfer, e.g. short of space
+                    elapsed = 0.0 if start is None else time.monotonic() - start
+                    return None, error, elapsed
+                delay = self._backoff(error, attempt)
+                attempt += 1
+                self.logger.warning(
+                    f"Download of {granule_file.url} failed "
+                    f"({_error_reason(error)}), retry {attempt} of {self.retries} "
+                    f"in {delay:.1f} s"
+                )
+                await asyncio.sleep(delay)
+
+    def _evict(self, directory: str, nbytes: int) -> int:
+        """
+        Evicts files from the cache to free `nbytes` bytes on the filesystem
+        of `directory`, if the cache is on it.
+
+        Returns:
+            The number of bytes actually freed, as evicted files may still
+            be linked from download directories.
+        """
+        if not self.evict_cache or self.cache is None:
+            return 0
+        if (
+            os.stat(self.cache.directory).st_dev
+            != os.stat(_existing_parent(directory)).st_dev
+        ):
+            return 0
+        before = free_space(directory)
+        self.cache.evict(nbytes)
+        return free_space(directory) - before
+
+    async def _check_space(self, files: List[GranuleFile], local_path: str) -> None:
+        """
+        Fails before any transfer if the missing files cannot fit
+        in `local_path`, after evicting cached files if allowed. The files
+        are only looked for in `local_path` and the cache when they might
+        not fit.
+        """
+        free = await run_in_thread(free_space, local_path)
+        upper_bound = sum(file.size or file.approximate_size or 0 for file in files)
+        if upper_bound + self.min_free_space <= free:
+            return
+        needed = await run_in_thread(self._missing_space, files, local_path)
+        shortfall = needed + self.min_free_space - free
+        if shortfall > 0:
+            shortfall -= await run_in_thread(self._evict, local_path, shortfall)
+        if shortfall > 0:
+            raise InsufficientSpaceError(
+                f"Not enough free space to download {needed} bytes to "
+                f"{local_path} and keep {self.min_free_space} bytes free, "
+                f"{shortfall} bytes short"
+            )
+
+    def _needed_space(self, granule_file: GranuleFile, path: str) -> int:
+        """
+        Returns the number of bytes a file still needs in the directory
+        of `path`, none if it is there or can be linked from the cache.
+        """
+        cache_key = self.cache and GranuleCache.key(granule_file)
+        if cache_key and self.cache.contains(cache_key):
+            return 0
+        return _missing_bytes([granule_file], os.path.dirname(path))
+
+    def _missing_space(self, files: List[GranuleFile], local_path: str) -> int:
+        """
+        Returns the number of bytes the files still need in `local_path`.
+        """
+        return sum(
+            self._needed_space(file, os.path.join(local_path, local_filename(file.url)))
+            for file in files
+        )
+
+    def _unallocated_space(self, directory: str) -> int:
+        """
+        Returns the number of bytes admitted to transfers in progress into
+        `directory` but not allocated on disk yet.
+        """
+        total = 0
+        for path, needed in list(self._admitted.items()):
+            if os.path.dirname(path) == directory:
+                total += max(0, needed - _allocated_bytes(path + PART_SUFFIX))
+        return total
+
+    @asynccontextmanager
+    async def _space_for(
+        self, granule_file: GranuleFile, path: Optional[str]
+    ) -> AsyncIterator[None]:
+        """
+        Waits until there is room for a file at `path` above the free space
+        watermark, evicting cached files if allowed, and reserves it until
+        the transfer ends. The bytes reserved by other transfers and not
+        written yet are not counted as free, so that concurrent transfers
+        cannot overrun the watermark together.
+        """
+        if path is None or self.min_free_space is None:
+            yield
+            return
+
+        directory = os.path.dirname(path)
+        needed = await run_in_thread(self._needed_space, granule_file, path)
+        if not needed:
+            yield
+            return
+        if self._admission is None:
+            self._admission = asyncio.Lock()
+        # Transfers are admitted one at a time, each seeing the reservations
+        # of the previous ones
+        async with self._admission:
+            deadline = time.monotonic() + self.space_timeout
+            while True:
+                free = await run_in_thread(free_space, directory)
+                free -= await run_in_thread(self._unallocated_space, directory)
+                shortfall = needed + self.min_free_space - free
+                if shortfall <= 0:
+                    break
+                if await run_in_thread(self._evict, directory, shortfall) >= shortfall:
+                    break
+                if time.monotonic() >= deadline:
+                    raise InsufficientSpaceError(
+                        f"Not enough free space in {directory} to download "
+                        f"{granule_file.url}: {free} bytes free, {needed} needed"
+                    )
+                self.logger.warning(
+                    f"Pausing the download of {granule_file.url}: {free} bytes "
+                    f"free in {directory}, {needed} needed"
+                )
+                await asyncio.sleep(min(SPACE_POLL_INTERVAL, self.space_timeout))
+            self._admitted[path] = self._admitted.get(path, 0) + needed
+        try:
+            yield
+        finally:
+            self._admitted[path] -= needed
+            if not self._admitted[path]:
+                del self._admitted[path]
+
+    async def _download_file(
+        self, client: httpx.AsyncClient, granule_file: GranuleFile, local_path: str
+    ) -> Tuple[str, str]:
+        """
+        Downloads a single file to `local_path`, through a `.part` file,
+        unless a copy matching its metadata is already there.
+
+        Returns:
+            The path of the local file and whether it was `downloaded`,
+            `cached`, `skipped` or `corrupted` and downloaded again.
+        """
+        url = granule_file.url
+        path = os.path.join(local_path, local_filename(url))
+
+        outcome = "downloaded"
+        if self.skip_existing and os.path.exists(path):
+            if await run_in_thread(verify_file, path, granule_file, self.buffer_size):
+                return path, "skipped"
+            outcome = "corrupted"
+
+        cache_key = self.cache and GranuleCache.key(granule_file)
+        if cache_key and await run_in_thread(self.cache.materialize, cache_key, path):
+            return path, "cached"
+
+        if self.lease_ttl is None:
+            await self._fetch_file(client, granule_file, path, cache_key)
+            return path, outcome
+
+        # Other processes of the node may be downloading the same file
+        async with FileLease(path + LOCK_SUFFIX, self.lease_ttl) as lease:
+            if lease.waited and await run_in_thread(
+                _verify_existing, path, granule_file, self.buffer_size
+            ):
+                return path, "shared"
+            await self._fetch_file(client, granule_file, path, cache_key)
+        return path, outcome
+
+    async def _fetch_file(
+        self,
+        client: httpx.AsyncClient,
+        granule_file: GranuleFile,
+        path: str,
+        cache_key: Optional[str],
+    ) -> None:
+        """
+        Downloads a single file to `path` through a `.part` file, checking it
+        against its published size and checksum, and adds it to the cache.
+        """
+        url = granule_file.url
+        hasher = _checksum_hasher(granule_file)
+        checksum = None if hasher is None else _InlineChecksum(hasher)
+        file = LocalFile(path + PART_SUFFIX, checksum)
+        checkpoint = _Checkpoint(file.path + CHECKPOINT_SUFFIX, url)
+        if self.resume and os.path.exists(file.path):
+            await checkpoint.load()
+
+        try:
+            if self.max_chunks_per_file == 1 or not await self._download_ranges(
+                client, url, file, checkpoint
+            ):
+                await self._download_whole(client, url, file, checkpoint)
+            await file.sync()
+            await file.close()
+
+            size = await run_in_thread(os.path.getsize, file.path)
+            if granule_file.size is not None and size != granule_file.size:
+                # The content cannot be trusted, resuming would not help
+                await file.discard()
+                await checkpoint.remove()
+                raise DownloadError(
+                    f"Downloaded {size} bytes from {url}, "
+                    f"expected {granule_file.size}"
+                )
+            if checksum is not None:
+                digest = await run_in_thread(
+                    checksum.hexdigest, file.path, self.buffer_size
+                )
+                if digest != granule_file.checksum.lower():
+                    # Fetched again from scratch by the next attempt
+                    await file.discard()
+                    await checkpoint.remove()
+                    raise DownloadError(
+                        f"Checksum of {url} does not match its published "
+                        f"{granule_file.checksum_algorithm} checksum"
+                    )
+
+            await run_in_thread(os.replace, file.path, path)
+            await checkpoint.remove()
+            if cache_key:
+                await run_in_thread(self.cache.add, cache_key, path)
+        except BaseException:
+            await file.close()
+            if not self.resume or not checkpoint.completed:
+                await file.discard()
+                await checkpoint.remove()
+            raise
+
+    @property
+    def _accounting(self) -> bool:
+        """Whether the bytes received must be accounted for."""
+        return self._concurrency is not None or self.bandwidth is not None
+
+    async def _received(self, host: str, nbytes: int) -> None:
+        """
+        Accounts for bytes received from `host`, for adaptive concurrency
+        and bandwidth limits.
+        """
+        if self._concurrency is not None:
+            self._concurrency.record(nbytes)
+        if self.bandwidth is not None:
+            await self.bandwidth.consume(host, nbytes)
+
+    async def _stream_file(
+        self,
+        client: httpx.AsyncClient,
+        granule_file: GranuleFile,
+        fs: fsspec.AbstractFileSystem,
+        root: str,
+    ) -> Tuple[str, str]:
+        """
+        Streams a single file into a remote filesystem, without staging it
+        on local disk, unless a file of the published size is already there.
+        The file is committed only once complete, as a multipart upload
+        on object stores, so that failed transfers leave nothing behind.
+
+        Returns:
+            The URL of the remote file and whether it was `downloaded`,
+            `skipped` or `corrupted` and downloaded again.
+        """
+        url = granule_file.url
+        path = f"{root.rstrip('/')}/{local_filename(url)}"
+
+        outcome = "downloaded"
+        if self.skip_existing:
+            size = await run_in_thread(_remote_size, fs, path)
+            if size is not None:
+                if granule_file.size is None or size == granule_file.size:
+                    return fs.unstrip_protocol(path), "skipped"
+                outcome = "corrupted"
+
+        async with self._host_slot(url):
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                target = await run_in_thread(
+                    partial(
+                        fs.open, path, "wb", block_size=self.part_size, autocommit=False
+                    )
+                )
+                hasher = _checksum_hasher(granule_file)
+                try:
+                    size = await self._stream_body(response, target, hasher)
+                    await run_in_thread(target.close)
+                    _verify_transfer(granule_file, size, hasher)
+                    await run_in_thread(target.commit)
+                except BaseException:
+                    await run_in_thread(_discard, target)
+                    raise
+
+        return fs.unstrip_protocol(path), outcome
+
+    async def _buffer_file(
+        self,
+        client: httpx.AsyncClient,
+        granule_file: GranuleFile,
+        budget: MemoryBudget,
+        spill_path: Optional[str],
+        shared_memory: bool = False,
+    ) -> Tuple[GranuleBuffer, str]:
+        """
+        Downloads a single file into memory within `budget`,
+        spilling it to a temporary file in `spill_path` beyond it,
+        in a shared memory segment if `shared_memory` is set.
+
+        Returns:
+            The buffer holding the file and the `downloaded` outcome.
+        """
+        url = granule_file.url
+        async with self._host_slot(url):
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                target = await run_in_thread(
+                    _SpooledTarget,
+                    url,
+                    budget,
+                    spill_path,
+                    _allocation_size(response) or granule_file.size,
+                    shared_memory,
+                )
+                hasher = _checksum_hasher(granule_file)
+                try:
+                    size = await self._stream_body(response, target, hasher)
+                    await run_in_thread(target.close)
+                    _verify_transfer(granule_file, size, hasher)
+                except BaseException:
+                    await run_in_thread(target.discard)
+                    raise
+        return target.buffer(), "downloaded"
+
+    async def _stream_body(
+        self, response: httpx.Response, target: Any, hasher: Any = None
+    ) -> int:
+        """
+        Writes the body of `response` into a file-like `target`,
+        uploading each buffer while the next one is received,
+        and feeding it to `hasher` if any.
+
+        Returns:
+            The number of bytes written.
+        """
+        host = response.url.netloc.decode()
+
+        def write(data: memoryview) -> None:
+            """Writes a buffer to the target and hashes it."""
+            target.write(data)
+            if hasher is not None:
+                hasher.update(data)
+
+        # Buffers are written one after the other, the offset is implied
+        def sink(offset: int, data: memoryview) -> Awaitable[Any]:
+            """Writes a buffer off the event loop."""
+            return run_in_thread(write, data)
+
+        writer = _BufferedWriter(sink, 0, self._buffers)
+        try:
+            async for data in response.aiter_bytes():
+                if self._accounting:
+                    await self._received(host, len(data))
+                await writer.write(data)
+        finally:
+            await writer.close()
+        return writer.written
+
+    async def _save_progress(
+        self, file: LocalFile, checkpoint: _Checkpoint, first: int, last: int
+    ) -> None:
+        """
+        Records the bytes from `first` to `last` as stored, once on disk.
+        """
+        await file.sync()
+        checkpoint.add(first, last)
+        await checkpoint.save()
+
+    async def _write_body(
+        self,
+        response: httpx.Response,
+        file: LocalFile,
+        checkpoint: _Checkpoint,
+        offset: int,
+        length: Optional[int] = None,
+    ) -> None:
+        """
+        Streams the body of `response` into `file` from `offset` onwards,
+        checking that exactly `length` bytes are received if known.
+        Progress is checkpointed every `chunk_size` bytes.
+        """
+        writer = _BufferedWriter(file.write_at, offset, self._buffers)
+        host = response.url.netloc.decode()
+        saved = 0
+        # Progress is synced to disk while the body keeps streaming,
+        # one checkpoint at a time
+        saving: Optional[asyncio.Future] = None
+        try:
+            async for data in response.aiter_bytes():
+                if self._accounting:
+                    await self._received(host, len(data))
+                await writer.write(data)
+                if writer.written - saved >= self.chunk_size and (
+                    saving is None or saving.done()
+                ):
+                    if saving is not None:
+                        saving.result()
+                    saved = writer.written
+                    saving = asyncio.ensure_future(
+                        self._save_progress(
+                            file, checkpoint, offset, offset + saved - 1
+                        )
+                    )
+        finally:
+            # Whatever was received is valid, even if the transfer broke
+            await writer.close()
+            if saving is not None:
+                await saving
+            if writer.written > saved:
+                await self._save_progress(
+                    file, checkpoint, offset, offset + writer.written - 1
+                )
+
+        if length is not None and writer.written != length:
+            raise DownloadError(
+                f"Received {writer.written} bytes instead of {length} "
+                f"from {response.url}"
+            )
+
+    async def _download_whole(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        file: LocalFile,
+        checkpoint: _Checkpoint,
+    ) -> None:
+        """
+        Downloads a file with a single request,
+        resuming after the bytes already stored if possible.
+        """
+        offset = checkpoint.prefix
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if checkpoint.validator:
+                headers["If-Range"] = checkpoint.validator
+
+        async with self._host_slot(url):
+            async with client.stream("GET", url, headers=headers) as response:
+                response.raise_for_status()
+                if (
+                    response.status_code == 206
+                    and parse_content_range(response.headers.get("Content-Range"))[0]
+                    == offset
+                ):
+                    await file.open(resume=True, stored=checkpoint.ranges)
+                else:
+                    offset = 0
+                    checkpoint.reset(_response_size(response), _validator(response))
+                    await file.open(_allocation_size(response))
+                await self._write_body(response, file, checkpoint, offset)
+
+    async def _download_ranges(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        file: LocalFile,
+        checkpoint: _Checkpoint,
+    ) -> bool:
+        """
+        Downloads the missing byte ranges of a file. The first request also
+        tells whether the server supports ranges, how large the file is and,
+        when resuming, whether it changed since the checkpoint.
+
+        Returns:
+            `False` if the file must be downloaded with a single request
+            instead, `True` otherwise.
+        """
+        resuming = bool(checkpoint.completed)
+        if resuming:
+            if checkpoint.size is None:
+                return False
+            ranges = checkpoint.missing(self.chunk_size)
+            if not ranges:
+                # Interrupted once complete, only left to be checked and renamed
+                await file.open(resume=True, stored=checkpoint.ranges)
+                return True
+        else:
+            ranges = [(0, self.chunk_size - 1)]
+
+        first, last = ranges[0]
+        headers = {"Range": f"bytes={first}-{last}"}
+        if resuming and checkpoint.validator:
+            headers["If-Range"] = checkpoint.validator
+
+        tasks: List[asyncio.Future] = []
+        try:
+            async with self._host_slot(url):
+                async with client.stream("GET", url, headers=headers) as response:
+                    # Empty files cannot satisfy any range
+                    if response.status_code == 416:
+                        checkpoint.reset(None, None)
+                        return False
+                    response.raise_for_status()
+
+                    if response.status_code != 206:
+                        # Either ranges are not supported or the file changed,
+                        # in both cases this is the whole file
+                        checkpoint.reset(_response_size(response), _validator(response))
+                        await file.open(_allocation_size(response))
+                        await self._write_body(response, file, checkpoint, 0)
+                        return True
+
+                    start, end, size = parse_content_range(
+                        response.headers.get("Content-Range")
+                    )
+                    if start != first or size is None:
+                        checkpoint.reset(None, None)
+                        return False
+
+                    if resuming:
+                        if size != checkpoint.size:
+                            checkpoint.reset(None, None)
+                            return False
+                        await file.open(resume=True, stored=checkpoint.ranges)
+                        ranges = ranges[1:]
+                    else:
+                        checkpoint.reset(size, _validator(response))
+                        await file.open(size)
+                        ranges = split_ranges(end + 1, size, self.chunk_size)
+
+                    semaphore = asyncio.Semaphore(self.max_chunks_per_file - 1)
+                    tasks = [
+                        asyncio.ensure_future(
+                            self._download_range(
+                                client, url, file, checkpoint, first, last, semaphore
+                            )
+                        )
+                        for first, last in ranges
+                    ]
+                    await self._write_body(
+                        response, file, checkpoint, start, end - start + 1
+                    )
+
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        return True
+
+    async def _download_range(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        file: LocalFile,
+        checkpoint: _Checkpoint,
+        first: int,
+        last: int,
+        semaphore: asyncio.Semaphore,
+    ) -> None:
+        """
+        Downloads the bytes from `first` to `last` of a file in place.
+        """
+        async with semaphore, self._host_slot(url):
+            headers = {"Range": f"bytes={first}-{last}"}
+            async with client.stream("GET", url, headers=headers) as response:
+                response.raise_for_status()
+                if response.status_code != 206 or (
+                    parse_content_range(response.headers.get("Content-Range"))[0]
+                    != first
+                ):
+                    raise DownloadError(
+                        f"Server did not honor range {first}-{last} of {url}"
+                    )
+                await self._write_body(
+                    response, file, checkpoint, first, last - first + 1
+                )
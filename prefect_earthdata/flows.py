@@ -0,0 +1,120 @@
+"""Module handling Prefect flows downloading data from NASA Earthdata"""
+
+from typing import Any, Dict, List, Optional, Union
+
+from earthaccess.results import DataGranule
+from prefect import flow, get_run_logger, unmapped
+
+from prefect_earthdata.credentials import EarthdataCredentials
+from prefect_earthdata.downloads import DownloadResult, default_local_path
+from prefect_earthdata.granules import granule_files, partition_granules
+from prefect_earthdata.tasks import download
+
+_FLOW_ARGUMENTS = ("credentials", "granules", "local_path", "allow_failures")
+
+
+@flow(validate_parameters=False)
+def download_batches(
+    credentials: EarthdataCredentials,
+    granules: Union[DataGranule, List[DataGranule], List[str]],
+    local_path: Optional[str] = None,
+    batches: Optional[int] = 4,
+    batch_bytes: Optional[int] = None,
+    allow_failures: bool = False,
+    download_options: Optional[Dict[str, Any]] = None,
+) -> List[str]:
+    """
+    Downloads data from NASA Earthdata as mapped `download` task runs, one per
+    batch of granules of about the same total size, so that the task runner
+    of the flow spreads the transfers across threads, processes or machines.
+
+    Args:
+        credentials: An `EarthdataCredentials` object used
+            to authenticate with NASA Earthdata.
+        granules: A granule, a list of granules or a list of granule URLs.
+        local_path: Local directory or fsspec URL to store the downloaded files
+            into, shared by all batches. Defaults to a new directory
+            under `./data`.
+        batches: The number of batches, ignored if `batch_bytes` is given.
+        batch_bytes: The approximate total size in bytes of each batch.
+        allow_failures: Whether to return the files that could be downloaded
+            when some fail, instead of failing the flow.
+        download_options: Additional keyword arguments of the `download` task,
+            e.g. `threads` or `journal`, other than the arguments of the flow.
+
+    Returns:
+        List of downloaded files, in the order of the granules, as a
+            `DownloadResult` combining the results of all batches.
+
+    Example:
+        Downloads granules on a Dask cluster, in batches of about 10 GB.
+
+        ```python
+        from prefect import flow
+        from prefect_dask import DaskTaskRunner
+        from prefect_earthdata.credentials import EarthdataCredentials
+        from prefect_earthdata.flows import download_batches
+        from prefect_earthdata.tasks import search_data
+
+        @flow
+        def example_earthdata_batches_flow():
+
+            earthdata_credentials = EarthdataCredentials(
+                earthdata_userame = "username",
+                earthdata_password = "password"
+            )
+
+            granules = search_data(
+                earthdata_credentials,
+                short_name="ATL08",
+                bounding_box=(-92.86, 16.26, -91.58, 16.97),
+            )
+
+            return download_batches.with_options(task_runner=DaskTaskRunner())(
+                earthdata_credentials,
+                granules,
+                "/shared/granules",
+                batch_bytes=10 * 1024**3,
+            )
+
+        example_earthdata_batches_flow()
+        ```
+    """
+    logger = get_run_logger()
+
+    # Arguments the flow passes to every task run itself
+    reserved = sorted(set(download_options or {}) & set(_FLOW_ARGUMENTS))
+    if reserved:
+        raise ValueError(
+            f"Pass {', '.join(reserved)} to download_batches "
+            "instead of in download_options"
+        )
+    if isinstance(granules, (DataGranule, str)):
+        granules = [granules]
+    if local_path is None:
+        local_path = default_local_path()
+    parts = partition_granules(granules, batches, batch_bytes)
+    logger.info(f"Downloading {len(granules)} granules in {len(parts)} batches")
+
+    options = {
+        name: unmapped(value) for name, value in (download_options or {}).items()
+    }
+    futures = download.map(
+        unmapped(credentials),
+        parts,
+        local_path=unmapped(local_path),
+        allow_failures=unmapped(True),
+        **options,
+    )
+    result = DownloadResult.merge(
+        [future.result() for future in futures],
+        [file.url for file in granule_files(granules)],
+    )
+
+    logger.info(
+        f"Downloaded {result.downloaded} files, served {result.cached} from "
+        f"the cache, skipped {result.skipped} already present"
+    )
+    if not allow_failures:
+        result.raise_for_failures()
+    return result
@@ -0,0 +1,350 @@
+"""Module extracting download metadata from NASA Earthdata granules"""
+
+import hashlib
+import heapq
+import math
+import os
+import zlib
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+from cmr import CMR_OPS
+from earthaccess import Auth
+from earthaccess.results import DataGranule
+from earthaccess.search import DataGranules
+
+CMR_GRANULES_URL = f"{CMR_OPS}granules.umm_json"
+# Type of the links of granules readable in place from their cloud region
+DIRECT_ACCESS_TYPE = "GET DATA VIA DIRECT ACCESS"
+
+SIZE_UNITS = {
+    "KB": 1024,
+    "MB": 1024**2,
+    "GB": 1024**3,
+    "TB": 1024**4,
+    "PB": 1024**5,
+    # earthaccess interprets sizes without a unit as megabytes
+    "NA": 1024**2,
+}
+
+HASHLIB_ALGORITHMS = {
+    "MD5": "md5",
+    "SHA-1": "sha1",
+    "SHA-256": "sha256",
+    "SHA-384": "sha384",
+    "SHA-512": "sha512",
+}
+
+
+class GranuleFile(NamedTuple):
+    """
+    A file to download, with the metadata published for it in CMR.
+
+    Args:
+        url: The URL of the file.
+        size: The exact size of the file in bytes, if published.
+        approximate_size: The size of the file in bytes, possibly rounded
+            from a size published in larger units.
+        checksum: The checksum of the file, if published.
+        checksum_algorithm: The UMM name of the checksum algorithm,
+            e.g. `MD5` or `SHA-256`.
+        concept_id: The concept-id of the granule the file belongs to.
+        revision_id: The revision of the granule the file belongs to.
+        start_time: The start of the temporal extent of the granule,
+            as an ISO 8601 string.
+    """
+
+    url: str
+    size: Optional[int] = None
+    approximate_size: Optional[int] = None
+    checksum: Optional[str] = None
+    checksum_algorithm: Optional[str] = None
+    concept_id: Optional[str] = None
+    revision_id: Optional[int] = None
+    start_time: Optional[str] = None
+
+
+def local_filename(url: str) -> str:
+    """
+    Derives the name of the local file a URL is downloaded to.
+
+    Args:
+        url: The URL of the remote file.
+
+    Returns:
+        The last component of the URL path.
+    """
+    path = urlparse(url).path
+    # OPeNDAP links point to an HTML form, the data is served without the suffix
+    if "opendap" in url and path.endswith(".html"):
+        path = path[: -len(".html")]
+    return os.path.basename(path)
+
+
+def _archive_information(
+    granule: DataGranule, url: str, urls: List[str]
+) -> Dict[str, Any]:
+    """
+    Finds the `ArchiveAndDistributionInformation` entry describing `url`,
+    matching it by file name or, for single-file granules, by position.
+    """
+    entries = (
+        granule["umm"]
+        .get("DataGranule", {})
+        .get("ArchiveAndDistributionInformation", [])
+    )
+    name = local_filename(url)
+    for entry in entries:
+        if entry.get("Name") == name:
+            return entry
+    if len(entries) == 1 and len(urls) == 1:
+        return entries[0]
+    return {}
+
+
+def _start_time(granule: DataGranule) -> Optional[str]:
+    """
+    Returns the start of the temporal extent of a granule, if published.
+    """
+    extent = granule["umm"].get("TemporalExtent", {})
+    if "RangeDateTime" in extent:
+        return extent["RangeDateTime"].get("BeginningDateTime")
+    return extent.get("SingleDateTime")
+
+
+def _granule_file(
+    granule: DataGranule, url: str, information: Dict[str, Any]
+) -> GranuleFile:
+    """
+    Builds a `GranuleFile` from an `ArchiveAndDistributionInformation` entry.
+    """
+    size = approximate_size = None
+    if "SizeInBytes" in information:
+        size = approximate_size = int(information["SizeInBytes"])
+    elif "Size" in information:
+        unit = SIZE_UNITS.get(information.get("SizeUnit", "NA"), SIZE_UNITS["NA"])
+        approximate_size = int(float(information["Size"]) * unit)
+
+    checksum = information.get("Checksum", {})
+    return GranuleFile(
+        url=url,
+        size=size,
+        approximate_size=approximate_size,
+        checksum=checksum.get("Value"),
+        checksum_algorithm=checksum.get("Algorithm"),
+        concept_id=granule["meta"].get("concept-id"),
+        revision_id=granule["meta"].get("revision-id"),
+        start_time=_start_time(granule),
+    )
+
+
+def granule_files(
+    granules: Union[DataGranule, List[DataGranule], List[str]],
+) -> List[GranuleFile]:
+    """
+    Collects the files to download from a list of granules,
+    together with their size and checksum when published in CMR.
+
+    Args:
+        granules: A granule, a list of granules or a list of URLs.
+
+    Returns:
+        The files to download, in the same order as the granules.
+    """
+    if isinstance(granules, (DataGranule, str)):
+        granules = [granules]
+
+    files = []
+    for granule in granules:
+        if isinstance(granule, DataGranule):
+            urls = granule.data_links(access="external")
+            files.extend(
+                _granule_file(granule, url, _archive_information(granule, url, urls))
+                for url in urls
+            )
+        else:
+            files.append(GranuleFile(url=granule))
+
+    for file in files:
+        if urlparse(file.url).scheme not in ("http", "https"):
+            raise ValueError(
+                f"Only HTTP(S) URLs can be downloaded, got {file.url}, "
+                "S3 links can be downloaded in region with earthaccess.download()"
+            )
+    return files
+
+
+def _cmr_params(query: DataGranules) -> List[Tuple[str, Any]]:
+    """
+    Encodes the parameters and options of a granule query as the query
+    string parameters of a CMR search.
+    """
+    params = []
+    for key, value in query.params.items():
+        name = f"{key}[]" if isinstance(value, list) else key
+        for item in value if isinstance(value, list) else [value]:
+            params.append((name, str(item).lower() if isinstance(item, bool) else item))
+    for key, options in query.options.items():
+        for option, value in options.items():
+            params.append((f"options[{key}][{option}]", str(value).lower()))
+    return params
+
+
+def _is_cloud_hosted(item: Dict[str, Any]) -> bool:
+    """Tells whether a CMR granule record advertises direct access."""
+    return any(
+        "protected" in link["URL"] or link.get("Type") == DIRECT_ACCESS_TYPE
+        for link in item["umm"].get("RelatedUrls", [])
+    )
+
+
+def search_granule_pages(
+    auth: Auth, count: int = -1, page_size: int = 2000, **kwargs
+) -> Iterator[List[DataGranule]]:
+    """
+    Searches granules in CMR page by page, with the same parameters as
+    `earthaccess.search_data()`, so that results can be processed before
+    the whole search is done, holding a single page in memory.
+
+    Args:
+        auth: An authenticated `earthaccess.Auth` object.
+        count: The maximum number of granules, all matching granules if negative.
+        page_size: The number of granules requested per page, at most 2000.
+        kwargs: The search parameters, e.g. `short_name` or `bounding_box`.
+
+    Yields:
+        The granules of each page, in the order of the search results.
+    """
+    params = _cmr_params(DataGranules(auth).parameters(**kwargs))
+    if auth.authenticated:
+        session = auth.get_session(bearer_token=True)
+    else:
+        session = requests.Session()
+    headers: Dict[str, str] = {}
+    found = 0
+    while count < 0 or found < count:
+        size = min(page_size, 2000) if count < 0 else min(page_size, count - found)
+        response = session.get(
+            CMR_GRANULES_URL, params=[*params, ("page_size", size)], headers=headers
+        )
+        response.raise_for_status()
+        items = response.json()["items"]
+        if not items:
+            return
+        found += len(items)
+        yield [DataGranule(item, cloud_hosted=_is_cloud_hosted(item)) for item in items]
+        # CMR resumes deep paging after the last result of the previous page
+        if "CMR-Search-After" not in response.headers:
+            return
+        headers["CMR-Search-After"] = response.headers["CMR-Search-After"]
+
+
+def _granule_size(granule: Union[DataGranule, str]) -> Optional[int]:
+    """
+    Returns the approximate total size in bytes of the files of a granule,
+    or `None` if unknown.
+    """
+    if not isinstance(granule, DataGranule):
+        return None
+    sizes = [file.approximate_size for file in granule_files(granule)]
+    if not sizes or None in sizes:
+        return None
+    return sum(sizes)
+
+
+def partition_granules(
+    granules: Union[List[DataGranule], List[str]],
+    batches: Optional[int] = None,
+    batch_bytes: Optional[int] = None,
+) -> List[Union[List[DataGranule], List[str]]]:
+    """
+    Splits granules into batches of about the same total size in bytes,
+    e.g. to download them in parallel task runs. Granules of unknown size
+    are accounted for with the average size of the others.
+
+    Args:
+        granules: A list of granules or granule URLs.
+        batches: The number of batches.
+        batch_bytes: The approximate total size in bytes of each batch,
+            taking precedence over `batches`.
+
+    Returns:
+        The non-empty batches, each keeping the granules in their original
+        order, from the largest to the smallest.
+
+    Raises:
+        ValueError: If neither `batches` nor `batch_bytes` is given,
+            or if the one used is not positive.
+    """
+    if batch_bytes is not None:
+        if batch_bytes <= 0:
+            raise ValueError(f"batch_bytes must be positive, got {batch_bytes}")
+    elif batches is None:
+        raise ValueError("Either batches or batch_bytes must be given")
+    elif batches <= 0:
+        raise ValueError(f"batches must be positive, got {batches}")
+
+    granules = list(granules)
+    if not granules:
+        return []
+    sizes = [_granule_size(granule) for granule in granules]
+    known = [size for size in sizes if size is not None]
+    average = sum(known) / len(known) if known else 1
+    weights = [average if size is None else size for size in sizes]
+
+    if batch_bytes is not None:
+        batches = math.ceil(sum(weights) / batch_bytes)
+    batches = max(1, min(batches, len(granules)))
+
+    # Largest granules first, each to the lightest batch so far
+    heap = [(0.0, batch) for batch in range(batches)]
+    members: List[List[int]] = [[] for _ in range(batches)]
+    for index in sorted(range(len(granules)), key=lambda i: -weights[i]):
+        load, batch = heapq.heappop(heap)
+        members[batch].append(index)
+        heapq.heappush(heap, (load + weights[index], batch))
+
+    return [[granules[index] for index in sorted(batch)] for batch in members if batch]
+
+
+class _Adler32:
+    """
+    Incremental Adler-32 checksum, with the interface of `hashlib` objects.
+    """
+
+    def __init__(self):
+        self.value = 1
+
+    def update(self, data: bytes) -> None:
+        """Adds `data` to the checksum."""
+        self.value = zlib.adler32(data, self.value)
+
+    def hexdigest(self) -> str:
+        """Returns the checksum as an hexadecimal string."""
+        return f"{self.value:08x}"
+
+
+def checksum_hasher(algorithm: Optional[str], checksum: Optional[str] = None) -> Any:
+    """
+    Creates an incremental hasher for a UMM checksum algorithm.
+
+    Args:
+        algorithm: The UMM name of the algorithm, e.g. `MD5` or `SHA-256`.
+        checksum: The expected checksum, used to tell the digest size
+            of the generic `SHA-2` algorithm.
+
+    Returns:
+        An object with `update()` and `hexdigest()` methods, or `None`
+        if the algorithm is not supported.
+    """
+    if algorithm is None:
+        return None
+    algorithm = algorithm.upper()
+    if algorithm == "SHA-2" and checksum:
+        algorithm = f"SHA-{len(checksum) * 4}"
+    if algorithm == "ADLER-32":
+        return _Adler32()
+    if algorithm in HASHLIB_ALGORITHMS:
+        return hashlib.new(HASHLIB_ALGORITHMS[algorithm])
+    return None
@@ -0,0 +1,181 @@
+"""Module implementing a durable journal of downloaded files"""
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from typing import Dict, Iterator, NamedTuple, Optional
+
+from prefect_earthdata.granules import GranuleFile
+
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class JournalEntry(NamedTuple):
+    """
+    The state of a file of a download, as recorded in a `DownloadJournal`.
+
+    Args:
+        url: The URL of the file.
+        destination: The directory or fsspec URL the file is downloaded to.
+        state: `completed` or `failed`.
+        path: The path of the downloaded file, if completed.
+        size: The size in bytes of the downloaded file, if completed.
+        checksum: The published checksum the file matches, if any.
+        checksum_algorithm: The UMM name of the checksum algorithm.
+        timestamp: The time of the record, in seconds since the epoch.
+        reason: Why the download failed, if failed.
+    """
+
+    url: str
+    destination: str
+    state: str
+    path: Optional[str] = None
+    size: Optional[int] = None
+    checksum: Optional[str] = None
+    checksum_algorithm: Optional[str] = None
+    timestamp: float = 0.0
+    reason: Optional[str] = None
+
+    def matches(self, file: GranuleFile) -> bool:
+        """
+        Tells whether the entry records a completed download of `file`,
+        consistent with its published size and checksum.
+
+        Args:
+            file: The file to download.
+
+        Returns:
+            Whether the file can be considered downloaded.
+        """
+        if self.state != COMPLETED:
+            return False
+        if file.size is not None and self.size != file.size:
+            return False
+        if file.checksum and self.checksum:
+            return self.checksum.lower() == file.checksum.lower()
+        return True
+
+
+class DownloadJournal:
+    """
+    Durable record of the state of each file of bulk downloads, so that
+    restarted runs only fetch unfinished files, without checking the files
+    already in the destination.
+
+    Journals with a `.jsonl` extension are append-only JSON lines files,
+    easy to inspect and ship around; any other path is an SQLite database,
+    faster to query for very large downloads. Both can be shared by the
+    processes of a node.
+
+    Args:
+        path: The path of the journal file, created if it does not exist.
+
+    Example:
+        Resumes a backfill from its journal after a crash.
+
+        ```python
+        import asyncio
+
+        from prefect_earthdata.downloads import DownloadEngine
+        from prefect_earthdata.journal import DownloadJournal
+
+        journal = DownloadJournal("/scratch/backfill.sqlite")
+        engine = DownloadEngine(journal=journal)
+        files = asyncio.run(engine.download(urls, "/scratch/granules"))
+        ```
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.format = "jsonl" if path.endswith(".jsonl") else "sqlite"
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        if self.format == "sqlite":
+            with self._connection() as connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS entries ("
+                    "url TEXT NOT NULL, destination TEXT NOT NULL, "
+                    "state TEXT NOT NULL, path TEXT, size INTEGER, checksum TEXT, "
+                    "checksum_algorithm TEXT, timestamp REAL NOT NULL, reason TEXT, "
+                    "PRIMARY KEY (destination, url))"
+                )
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens the SQLite journal, committing on exit. Commits survive
+        crashes of the process, though not necessarily power losses.
+        """
+        with closing(sqlite3.connect(self.path, timeout=60.0)) as connection:
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                yield connection
+
+    def load(self, destination: str) -> Dict[str, JournalEntry]:
+        """
+        Reads the latest entry of each file downloaded to `destination`.
+
+        Args:
+            destination: The directory or fsspec URL of the download.
+
+        Returns:
+            The entries, by URL.
+        """
+        if self.format == "sqlite":
+            with self._connection() as connection:
+                rows = connection.execute(
+                    f"SELECT {', '.join(JournalEntry._fields)} FROM entries "
+                    "WHERE destination = ?",
+                    (destination,),
+                ).fetchall()
+            return {row[0]: JournalEntry(*row) for row in rows}
+
+        entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = JournalEntry(**json.loads(line))
+                    except (ValueError, TypeError):
+                        # Torn last line of a crashed writer
+                        continue
+                    if entry.destination == destination:
+                        entries[entry.url] = entry
+        return entries
+
+    def record(self, entry: JournalEntry) -> None:
+        """
+        Durably records the state of a file, replacing any previous one.
+
+        Args:
+            entry: The entry to record. Its timestamp is set to the current
+                time if missing.
+        """
+        if not entry.timestamp:
+            entry = entry._replace(timestamp=time.time())
+
+        if self.format == "sqlite":
+            with self._connection() as connection:
+                connection.execute(
+                    f"INSERT OR REPLACE INTO entries VALUES "
+                    f"({', '.join('?' * len(entry))})",
+                    entry,
+                )
+            return
+
+        # A single write in append mode, not interleaved with other writers
+        line = (json.dumps(entry._asdict()) + "\n").encode()
+        with open(self.path, "ab+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    # Ends the torn line of a crashed writer rather than this one
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,363 @@
+"""Module implementing limits on the resources used by downloads"""
+
+import asyncio
+import logging
+import threading
+import weakref
+from time import monotonic
+from typing import ClassVar, Dict, List, Optional, Tuple, Union
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit adjusted to the observed download throughput,
+    in the manner of TCP congestion control (additive increase,
+    multiplicative decrease).
+
+    Every `interval` seconds, the limit grows by `increase` if it was reached
+    and the aggregate throughput rose since the previous interval, and an
+    increase which made the throughput drop is reverted. Throttling responses,
+    e.g. `429 Too Many Requests`, and latency spikes cut the limit
+    by `decrease`, at most once per interval.
+
+    Used as an asynchronous context manager, it holds one of the slots
+    of the current limit, the same way as an `asyncio.Semaphore`.
+
+    Args:
+        maximum: The highest limit.
+        initial: The starting limit, `min(4, maximum)` by default.
+        minimum: The lowest limit.
+        increase: The amount the limit grows by.
+        decrease: The factor the limit is multiplied by on throttling.
+        interval: The duration in seconds of a throughput measurement.
+        tolerance: The relative change in throughput regarded as noise.
+        latency_factor: How many times slower than usual a response
+            must be to count as a latency spike.
+        logger: The logger reporting changes of the limit.
+
+    Example:
+        Lets a download find its own concurrency, up to 64 files at a time.
+
+        ```python
+        import asyncio
+
+        from prefect_earthdata.downloads import DownloadEngine
+
+        engine = DownloadEngine(max_concurrency=64, adaptive_concurrency=True)
+        files = asyncio.run(engine.download(urls, "/tmp/granules"))
+        ```
+    """
+
+    def __init__(
+        self,
+        maximum: int,
+        initial: Optional[int] = None,
+        minimum: int = 1,
+        increase: int = 1,
+        decrease: float = 0.5,
+        interval: float = 1.0,
+        tolerance: float = 0.05,
+        latency_factor: float = 3.0,
+        logger: Optional[Union[logging.Logger, logging.LoggerAdapter]] = None,
+    ):
+        if not 1 <= minimum <= maximum:
+            raise ValueError("minimum must be between 1 and maximum")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        if initial is None:
+            initial = min(4, maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval
+        self.tolerance = tolerance
+        self.latency_factor = latency_factor
+        self.logger = logger or logging.getLogger(__name__)
+        self.history: List[Tuple[float, int, float]] = []
+
+        self._limit = max(minimum, min(maximum, initial))
+        self._active = 0
+        self._waiters: List[asyncio.Future] = []
+        self._start = monotonic()
+        self._window_start = self._start
+        self._window_bytes = 0
+        self._saturated = False
+        self._throughput: Optional[float] = None
+        self._increased = False
+        self._last_decrease = float("-inf")
+        self._latency: Optional[float] = None
+        self._latency_samples = 0
+
+    @property
+    def limit(self) -> int:
+        """The current concurrency limit."""
+        return self._limit
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """The throughput in bytes per second over the last interval."""
+        return self._throughput
+
+    async def __aenter__(self) -> None:
+        """Waits for a slot within the current limit and takes it."""
+        while self._active >= self._limit:
+            self._saturated = True
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._waiters.remove(waiter)
+        self._active += 1
+        if self._active >= self._limit:
+            self._saturated = True
+
+    async def __aexit__(self, *args) -> None:
+        """Gives the slot back."""
+        self._active -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """Lets the waiting tasks check again for a free slot."""
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _set_limit(self, limit: int, reason: str) -> None:
+        """Changes the limit, within the bounds."""
+        limit = max(self.minimum, min(self.maximum, limit))
+        if limit != self._limit:
+            self.logger.info(f"Download concurrency {self._limit} -> {limit}, {reason}")
+            self._limit = limit
+            self._wake()
+
+    def record(self, nbytes: int) -> None:
+        """
+        Accounts for bytes received, adjusting the limit
+        at the end of each measurement interval.
+
+        Args:
+            nbytes: The number of bytes received.
+        """
+        self._window_bytes += nbytes
+        now = monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.interval:
+            return
+
+        throughput = self._window_bytes / elapsed
+        previous = self._throughput
+        self._throughput = throughput
+        self.history.append((now - self._start, self._limit, throughput))
+        rate = f"{throughput / 2**20:.1f} MiB/s"
+
+        increased = False
+        if (
+            previous is not None
+            and self._increased
+            and throughput < previous * (1 - self.tolerance)
+        ):
+            self._set_limit(self._limit - self.increase, f"throughput fell to {rate}")
+        elif self._saturated and (
+            previous is None or throughput > previous * (1 + self.tolerance)
+        ):
+            increased = self._limit < self.maximum
+            self._set_limit(self._limit + self.increase, f"throughput rose to {rate}")
+        self._increased = increased
+
+        self._window_start = now
+        self._window_bytes = 0
+        self._saturated = self._active >= self._limit
+
+    def throttled(self, reason: str = "throttled by the server") -> None:
+        """
+        Cuts the limit after a throttling response or a latency spike.
+
+        Args:
+            reason: The description of the event, for the logs.
+        """
+        now = monotonic()
+        if now - self._last_decrease < self.interval:
+            return
+        self._last_decrease = now
+        self._increased = False
+        self._set_limit(int(self._limit * self.decrease), reason)
+
+    def latency(self, seconds: float) -> None:
+        """
+        Accounts for the time a server took to respond, cutting the limit
+        when much slower than its moving average.
+
+        Args:
+            seconds: The time between sending a request and receiving
+                the response headers.
+        """
+        if (
+            self._latency is not None
+            and self._latency_samples >= 5
+            and seconds > self.latency_factor * self._latency
+        ):
+            self.throttled(f"latency spiked to {seconds:.2f} s")
+        if self._latency is None:
+            self._latency = seconds
+        else:
+            self._latency += 0.1 * (seconds - self._latency)
+        self._latency_samples += 1
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, refilled at `rate` tokens per second
+    up to `burst` tokens.
+
+    Consumers take tokens up front and may drive the bucket into debt,
+    then wait for the returned delay, which keeps the cost of each call
+    to a lock and a few arithmetic operations.
+
+    Args:
+        rate: The number of tokens added per second.
+        burst: The capacity of the bucket, one second worth of tokens
+            by default.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self._tokens = self.burst
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float) -> float:
+        """
+        Takes tokens from the bucket.
+
+        Args:
+            tokens: The number of tokens to take.
+
+        Returns:
+            The number of seconds to wait before using the tokens.
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+
+class BandwidthLimiter:
+    """
+    Caps the bandwidth of downloads, in bytes per second, in total and
+    optionally for each host. A limiter can be shared by downloads running
+    in different threads and event loops, e.g. concurrent task runs.
+
+    Args:
+        rate: The maximum total bandwidth, unlimited if `None`.
+        per_host: The maximum bandwidth for a single host,
+            unlimited if `None`.
+        burst: The number of bytes which can be received at once after
+            an idle period, one second worth of bandwidth by default.
+
+    Example:
+        Caps all the downloads of the process to 100 MiB/s, 25 MiB/s per host.
+
+        ```python
+        from prefect_earthdata.limits import BandwidthLimiter
+
+        limiter = BandwidthLimiter.shared(100 * 2**20, per_host=25 * 2**20)
+        engine = DownloadEngine(bandwidth=limiter)
+        ```
+    """
+
+    # Only the limiters in use are kept, so that the registry does not grow
+    # with every configuration a long-running process has seen
+    _shared: ClassVar["weakref.WeakValueDictionary[Tuple, BandwidthLimiter]"] = (
+        weakref.WeakValueDictionary()
+    )
+    _shared_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        per_host: Optional[float] = None,
+        burst: Optional[float] = None,
+    ):
+        self.rate = rate
+        self.per_host = per_host
+        self.burst = burst
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._host_buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(
+        cls,
+        rate: Optional[float] = None,
+        per_host: Optional[float] = None,
+        burst: Optional[float] = None,
+    ) -> "BandwidthLimiter":
+        """
+        Returns the limiter of the process for the given limits, so that
+        the concurrent downloads configured with the same limits share them.
+        Downloads configured with other limits use another limiter,
+        so that each download stays within its own limits. A limiter is
+        only kept while in use, later downloads starting with a new one.
+
+        Args:
+            rate: The maximum total bandwidth, unlimited if `None`.
+            per_host: The maximum bandwidth for a single host,
+                unlimited if `None`.
+            burst: The number of bytes which can be received at once.
+
+        Returns:
+            The shared limiter.
+        """
+        key = (rate, per_host, burst)
+        with cls._shared_lock:
+            limiter = cls._shared.get(key)
+            if limiter is None:
+                limiter = cls._shared[key] = cls(rate, per_host, burst)
+            return limiter
+
+    def _host_bucket(self, host: str) -> TokenBucket:
+        """Returns the bucket of `host`, created on first use."""
+        with self._lock:
+            if host not in self._host_buckets:
+                self._host_buckets[host] = TokenBucket(self.per_host, self.burst)
+            return self._host_buckets[host]
+
+    def delay(self, host: str, nbytes: int) -> float:
+        """
+        Accounts for bytes received from a host.
+
+        Args:
+            host: The host the bytes were received from.
+            nbytes: The number of bytes received.
+
+        Returns:
+            The number of seconds to wait before receiving more bytes.
+        """
+        delay = 0.0
+        if self._bucket is not None:
+            delay = self._bucket.reserve(nbytes)
+        if self.per_host:
+            delay = max(delay, self._host_bucket(host).reserve(nbytes))
+        return delay
+
+    async def consume(self, host: str, nbytes: int) -> None:
+        """
+        Accounts for bytes received from a host,
+        waiting as long as needed to stay within the limits.
+
+        Args:
+            host: The host the bytes were received from.
+            nbytes: The number of bytes received.
+        """
+        delay = self.delay(host, nbytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
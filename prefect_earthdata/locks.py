@@ -0,0 +1,266 @@
+"""Module implementing leases on files shared by the processes of a node"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Any, Dict, Optional, Tuple
+from uuid import uuid4
+
+DEFAULT_LEASE_TTL = 60.0
+LOCK_SUFFIX = ".lock"
+
+logger = logging.getLogger(__name__)
+
+
+def _process_exists(pid: int) -> bool:
+    """
+    Tells whether a process of this host is still running, assuming it is
+    where this cannot be checked safely.
+    """
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_owner(path: str) -> Optional[Dict[str, Any]]:
+    """Reads the owner of a lock file, or `None` if missing or not written yet."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _observe(path: str) -> Optional[Tuple[int, float, Optional[Dict[str, Any]]]]:
+    """
+    Reads the inode, modification time and owner of a lock file,
+    or `None` if missing.
+    """
+    try:
+        with open(path) as f:
+            stat = os.fstat(f.fileno())
+            try:
+                owner = json.load(f)
+            except ValueError:
+                owner = None
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime, owner
+
+
+class LeaseLostError(Exception):
+    """
+    Raised when a lease expires or is taken over by another process
+    while held, its holder having been cancelled.
+    """
+
+
+class FileLease:
+    """
+    Exclusive lease on a file, held by a single process at a time through
+    a lock file, e.g. by one of the worker processes of a node downloading
+    into a shared directory while the others wait for the result.
+
+    The lock file is created atomically and records its holder. The holder
+    refreshes its modification time every third of `ttl` seconds. Leases
+    not refreshed for `ttl` seconds, or held by a process of the same host
+    which no longer exists, are stale and reclaimed by the next process
+    asking for them, so that crashed processes do not block the others.
+
+    Used as an asynchronous context manager, it waits for the lease
+    and holds it until exit. If the lease is lost meanwhile, e.g. when the
+    event loop was blocked for longer than `ttl`, the task holding it is
+    cancelled and `LeaseLostError` raised, so that it stops writing what
+    another process now leases.
+
+    Args:
+        path: The path of the lock file, e.g. the leased file path
+            followed by `.lock`.
+        ttl: The number of seconds after which a lease not refreshed is stale.
+        poll_interval: The number of seconds between attempts to take a lease
+            held by another process.
+
+    Example:
+        Writes a file shared by several processes, one at a time.
+
+        ```python
+        from prefect_earthdata.locks import FileLease
+
+        async with FileLease("/shared/granule.h5.lock") as lease:
+            if not lease.waited:
+                write_granule("/shared/granule.h5")
+        ```
+    """
+
+    def __init__(
+        self, path: str, ttl: float = DEFAULT_LEASE_TTL, poll_interval: float = 0.5
+    ):
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        self.path = path
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.token = uuid4().hex
+        self.waited = False
+        self.lost = False
+        self._heartbeat: Optional[asyncio.Future] = None
+        self._holder: Optional[asyncio.Task] = None
+
+    def _is_stale(self, owner: Optional[Dict[str, Any]], mtime: float) -> bool:
+        """Tells whether a lease last refreshed at `mtime` is stale."""
+        if time.time() - mtime > self.ttl:
+            return True
+        return (
+            owner is not None
+            and owner.get("host") == socket.gethostname()
+            and not _process_exists(owner.get("pid", 0))
+        )
+
+    def _reclaim(self) -> bool:
+        """
+        Removes the lock file if stale, telling whether the lease may be free.
+        """
+        observed = _observe(self.path)
+        if observed is None:
+            return True
+        _, mtime, owner = observed
+        if not self._is_stale(owner, mtime):
+            return False
+
+        # Another process may have reclaimed it and taken a fresh lease since,
+        # only the lock file observed stale is renamed, then removed
+        current = _observe(self.path)
+        if current is None:
+            return True
+        if current != observed:
+            return False
+        stale_path = f"{self.path}.{uuid4().hex[:8]}.stale"
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return True
+        try:
+            if _observe(stale_path) != observed:
+                # A fresh lease taken in between, put it back
+                try:
+                    os.link(stale_path, self.path)
+                except OSError:
+                    pass
+                return False
+            return True
+        finally:
+            os.remove(stale_path)
+
+    def try_acquire(self) -> bool:
+        """
+        Takes the lease if it is free or stale, without waiting.
+
+        Returns:
+            Whether the lease was taken.
+        """
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._reclaim():
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {
+                        "token": self.token,
+                        "host": socket.gethostname(),
+                        "pid": os.getpid(),
+                        "acquired": time.time(),
+                    },
+                    f,
+                )
+            return True
+        return False
+
+    def refresh(self) -> bool:
+        """
+        Extends the lease.
+
+        Returns:
+            Whether the lease is still held.
+        """
+        owner = _read_owner(self.path)
+        if owner is None or owner.get("token") != self.token:
+            return False
+        os.utime(self.path)
+        return True
+
+    def release(self) -> None:
+        """Gives the lease up, if still held."""
+        owner = _read_owner(self.path)
+        if owner is not None and owner.get("token") == self.token:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    async def _run(self, func: Any) -> Any:
+        """Runs a blocking method off the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, func)
+
+    async def acquire(self) -> None:
+        """
+        Waits until the lease is taken, then keeps it alive in the background,
+        cancelling the current task if it is lost.
+        """
+        while not await self._run(self.try_acquire):
+            self.waited = True
+            await asyncio.sleep(self.poll_interval)
+        self.lost = False
+        self._holder = asyncio.current_task()
+        self._heartbeat = asyncio.ensure_future(self._keep_alive())
+
+    async def _keep_alive(self) -> None:
+        """Refreshes the lease until released or lost."""
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            if not await self._run(self.refresh):
+                logger.warning(f"Lost the lease {self.path}")
+                self.lost = True
+                if self._holder is not None:
+                    self._holder.cancel()
+                return
+
+    async def __aenter__(self) -> "FileLease":
+        """Waits for the lease."""
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        """
+        Releases the lease, raising `LeaseLostError` in place of the
+        cancellation of the holder if it was lost.
+        """
+        heartbeat, self._heartbeat = self._heartbeat, None
+        holder, self._holder = self._holder, None
+        if heartbeat is not None:
+            heartbeat.cancel()
+        try:
+            if heartbeat is not None:
+                await asyncio.gather(heartbeat, return_exceptions=True)
+            await self._run(self.release)
+        except asyncio.CancelledError as error:
+            if not self.lost:
+                raise
+            # Lost while the holder was not waiting, cancelled on exit instead
+            self.release()
+            exc_type, exc = asyncio.CancelledError, error
+        if self.lost and exc_type is asyncio.CancelledError:
+            if hasattr(holder, "uncancel"):
+                holder.uncancel()
+            raise LeaseLostError(f"Lost the lease {self.path}") from exc
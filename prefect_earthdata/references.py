@@ -0,0 +1,314 @@
+"""Module building virtual Zarr datasets from DMR++ metadata"""
+
+import asyncio
+import json
+import logging
+import math
+import posixpath
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterable, List, Optional
+
+from prefect_earthdata.clients import earthdata_client
+from prefect_earthdata.dmrpp import (
+    NON_VARIABLE_TAGS,
+    dap_tag,
+    dmrpp_data_url,
+    dmrpp_tag,
+    fetch_dmrpp,
+    local_tag,
+    select_variables,
+    subset_dmrpp,
+)
+from prefect_earthdata.granules import local_filename
+
+# Zarr data types of the DAP4 atomic types, without their byte order
+DTYPES = {
+    "Byte": "u1",
+    "Char": "u1",
+    "Int8": "i1",
+    "UInt8": "u1",
+    "Int16": "i2",
+    "UInt16": "u2",
+    "Int32": "i4",
+    "UInt32": "u4",
+    "Int64": "i8",
+    "UInt64": "u8",
+    "Float32": "f4",
+    "Float64": "f8",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _filters(compression: Optional[str], itemsize: int) -> Optional[List[dict]]:
+    """
+    Translates the HDF5 filter pipeline of a variable into numcodecs filters,
+    in the order they were applied when writing.
+    """
+    filters = []
+    for name in (compression or "").split():
+        if name == "deflate":
+            filters.append({"id": "zlib", "level": 1})
+        elif name == "shuffle":
+            filters.append({"id": "shuffle", "elementsize": itemsize})
+        elif name == "fletcher32":
+            filters.append({"id": "fletcher32"})
+        else:
+            raise ValueError(f"Unsupported compression {name}")
+    return filters or None
+
+
+def _parse_value(value: str, kind: str) -> Any:
+    """Parses a value of an attribute or fill value of a DAP4 type."""
+    if kind.startswith("Float"):
+        number = float(value)
+        return "NaN" if math.isnan(number) else number
+    if kind in DTYPES:
+        return int(float(value))
+    return value
+
+
+def _attributes(element: ET.Element) -> Dict[str, Any]:
+    """Reads the attributes of a variable or group, skipping containers."""
+    attributes = {}
+    for attribute in element.findall(dap_tag("Attribute")):
+        kind = attribute.get("type", "String")
+        if kind == "Container":
+            continue
+        values = [
+            value.get("value", value.text or "")
+            for value in attribute.findall(dap_tag("Value"))
+        ]
+        try:
+            values = [_parse_value(value, kind) for value in values]
+        except ValueError:
+            pass
+        attributes[attribute.get("name")] = values[0] if len(values) == 1 else values
+    return attributes
+
+
+def _chunk_key(position: Optional[str], chunks: List[int]) -> str:
+    """
+    Builds the Zarr key of a chunk from its position in the array,
+    e.g. `[0,200]`.
+    """
+    if not chunks:
+        return "0"
+    if position:
+        indices = [int(index) for index in position.strip("[]").split(",")]
+    else:
+        indices = [0] * len(chunks)
+    return ".".join(str(index // size) for index, size in zip(indices, chunks))
+
+
+def _variable_references(
+    element: ET.Element,
+    key: str,
+    href: str,
+    dimensions: Dict[str, int],
+    refs: Dict[str, Any],
+) -> None:
+    """
+    Adds the Zarr metadata and chunk references of a variable to `refs`.
+    """
+    kind = local_tag(element)
+    if kind not in DTYPES:
+        logger.debug(f"Skipping variable {key} of unsupported type {kind}")
+        return
+
+    shape = []
+    names = []
+    for index, dim in enumerate(element.findall(dap_tag("Dim"))):
+        name = dim.get("name")
+        if dim.get("size") is not None:
+            shape.append(int(dim.get("size")))
+        elif name in dimensions:
+            shape.append(dimensions[name])
+        else:
+            logger.debug(f"Skipping variable {key} of unknown dimension {name}")
+            return
+        names.append(posixpath.basename(name) if name else f"phony_dim_{index}")
+
+    storage = element.find(dmrpp_tag("chunks"))
+    compact = element.find(dmrpp_tag("compact"))
+    attributes = _attributes(element)
+    fill_value = attributes.pop("_FillValue", None)
+    chunks = list(shape)
+    filters = None
+    byte_order = "LE"
+    if storage is not None:
+        byte_order = storage.get("byteOrder", byte_order)
+        sizes = storage.find(dmrpp_tag("chunkDimensionSizes"))
+        if sizes is not None and sizes.text:
+            chunks = [int(size) for size in sizes.text.split()]
+        try:
+            filters = _filters(storage.get("compressionType"), int(DTYPES[kind][1:]))
+        except ValueError as error:
+            logger.debug(f"Skipping variable {key}: {error}")
+            return
+        if storage.get("fillValue") is not None:
+            fill_value = storage.get("fillValue")
+    if isinstance(fill_value, str):
+        try:
+            fill_value = _parse_value(fill_value, kind)
+        except ValueError:
+            fill_value = None
+
+    dtype = DTYPES[kind]
+    prefix = "|" if dtype[1:] == "1" else "<" if byte_order == "LE" else ">"
+    refs[f"{key}/.zarray"] = json.dumps(
+        {
+            "chunks": [max(size, 1) for size in chunks],
+            "compressor": None,
+            "dtype": prefix + dtype,
+            "fill_value": fill_value,
+            "filters": filters,
+            "order": "C",
+            "shape": shape,
+            "zarr_format": 2,
+        }
+    )
+    refs[f"{key}/.zattrs"] = json.dumps({**attributes, "_ARRAY_DIMENSIONS": names})
+
+    if compact is not None and compact.text:
+        refs[f"{key}/{_chunk_key(None, chunks)}"] = "base64:" + compact.text.strip()
+    if storage is not None:
+        for chunk in storage.iter(dmrpp_tag("chunk")):
+            size = int(chunk.get("nBytes"))
+            if size == 0:
+                continue
+            refs[f"{key}/{_chunk_key(chunk.get('chunkPositionInArray'), chunks)}"] = [
+                chunk.get("href", href),
+                int(chunk.get("offset")),
+                size,
+            ]
+
+
+def dmrpp_references(
+    tree: ET.ElementTree, href: str, variables: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """
+    Translates a DMR++ document into the references of a virtual Zarr dataset,
+    in the kerchunk format, where the chunks of each variable point to their
+    bytes in the remote file. Variables of types Zarr cannot describe,
+    such as strings, are left out.
+
+    Args:
+        tree: The parsed DMR++ document.
+        href: The URL of the data file, for chunks not naming their own
+            unless the document names its HTTP(S) URL.
+        variables: The paths of the variables to keep, with the variables
+            of their dimensions, all by default.
+
+    Returns:
+        The references, by Zarr key.
+    """
+    if variables is not None:
+        subset_dmrpp(tree, select_variables(tree, variables), href)
+    root = tree.getroot()
+    href = dmrpp_data_url(root, href)
+    dimensions = {}
+    refs: Dict[str, Any] = {}
+
+    def visit(group: ET.Element, path: str) -> None:
+        """Adds the references of a group and of its subgroups."""
+        key = path.strip("/")
+        refs[posixpath.join(key, ".zgroup")] = json.dumps({"zarr_format": 2})
+        refs[posixpath.join(key, ".zattrs")] = json.dumps(_attributes(group))
+        for dimension in group.findall(dap_tag("Dimension")):
+            dimensions[f"{path}{dimension.get('name')}"] = int(dimension.get("size"))
+        for child in group:
+            if not child.tag.startswith(dap_tag("")) or child.get("name") is None:
+                continue
+            tag = local_tag(child)
+            if tag == "Group":
+                visit(child, f"{path}{child.get('name')}/")
+            elif tag not in NON_VARIABLE_TAGS:
+                _variable_references(
+                    child,
+                    f"{key}/{child.get('name')}".lstrip("/"),
+                    href,
+                    dimensions,
+                    refs,
+                )
+
+    visit(root, "/")
+    return refs
+
+
+def combine_references(references: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combines the references of several files into a single virtual Zarr
+    dataset, with one group per file.
+
+    Args:
+        references: The references of each file, by group name.
+
+    Returns:
+        The combined references, in version 1 of the kerchunk format.
+    """
+    refs = {".zgroup": json.dumps({"zarr_format": 2})}
+    for name, file_refs in references.items():
+        for key, value in file_refs.items():
+            refs[f"{name}/{key}"] = value
+    return {"version": 1, "refs": refs}
+
+
+async def granule_references(
+    urls: List[str],
+    variables: Optional[Iterable[str]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    max_concurrency: int = 8,
+    timeout: float = 60.0,
+) -> Dict[str, Any]:
+    """
+    Builds a virtual Zarr dataset over several remote files from their
+    DMR++ sidecars, published at their URL followed by `.dmrpp`, without
+    reading the files themselves. Each file is a group named after it.
+
+    Args:
+        urls: The URLs of the data files.
+        variables: The paths of the variables to keep, all by default.
+        headers: HTTP headers sent with every request,
+            e.g. the Earthdata Login bearer token.
+        max_concurrency: The maximum number of sidecars fetched at the same time.
+        timeout: Timeout in seconds for connecting and reading from the server.
+
+    Returns:
+        The references, in version 1 of the kerchunk format.
+
+    Example:
+        Opens ATL08 granules lazily as a single dataset tree.
+
+        ```python
+        import asyncio
+
+        import fsspec
+        import xarray as xr
+
+        from prefect_earthdata.references import granule_references
+
+        headers = {"Authorization": f"Bearer {token}"}
+        refs = asyncio.run(granule_references(urls, headers=headers))
+        mapper = fsspec.get_mapper(
+            "reference://", fo=refs, remote_protocol="https",
+            remote_options={"headers": headers},
+        )
+        tree = xr.open_datatree(mapper, engine="zarr", consolidated=False)
+        ```
+    """
+    if variables is not None:
+        variables = list(variables)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with earthdata_client(headers, timeout=timeout) as client:
+
+        async def references(url: str) -> Dict[str, Any]:
+            """Builds the references of a file from its DMR++ sidecar."""
+            async with semaphore:
+                tree = await fetch_dmrpp(client, url)
+            return dmrpp_references(tree, url, variables)
+
+        results = await asyncio.gather(*(references(url) for url in urls))
+    return combine_references(
+        {local_filename(url): refs for url, refs in zip(urls, results)}
+    )
@@ -0,0 +1,398 @@
+"""Module opening remote granules as file-like objects"""
+
+import asyncio
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import fsspec
+from fsspec.caching import BaseCache, register_cache
+from fsspec.implementations.http import HTTPFileSystem
+from fsspec.spec import AbstractBufferedFile
+
+from prefect_earthdata.cache import BlockCache
+from prefect_earthdata.dmrpp import ByteRange, coalesce_ranges
+from prefect_earthdata.downloads import run_in_thread
+from prefect_earthdata.granules import GranuleFile
+
+DEFAULT_BLOCK_SIZE = 4 * 2**20
+DEFAULT_MAX_GAP = 2**20
+DEFAULT_MAX_REQUEST_SIZE = 64 * 2**20
+
+# Caches of fsspec keeping several blocks, bounded by `maxblocks`
+BLOCK_CACHES = frozenset({"blockcache", "background"})
+
+
+class _BlockCache(BaseCache):
+    """
+    fsspec cache of a remote file keeping the last `maxblocks` blocks read
+    in memory, optionally reading through a `BlockCache` on disk, which
+    serves the batched reads of `read_ranges()` from its blocks.
+    """
+
+    name = "prefect_earthdata_blocks"
+
+    def __init__(
+        self,
+        blocksize: int,
+        fetcher: Any,
+        size: int,
+        store: Optional[BlockCache] = None,
+        url: Optional[str] = None,
+        revision: Optional[str] = None,
+        maxblocks: int = 4,
+    ):
+        # Blocks are aligned on the blocks of the store, shared by all files
+        super().__init__(store.block_size if store else blocksize, fetcher, size)
+        self.store = store
+        self.url = url
+        self.revision = revision
+        self.maxblocks = maxblocks
+        self._blocks: "OrderedDict[int, bytes]" = OrderedDict()
+
+    def _key(self, index: int) -> str:
+        """Returns the key of a block in the store."""
+        return self.store.key(self.url, self.revision, index * self.blocksize)
+
+    def _cached_block(self, index: int) -> Optional[bytes]:
+        """Returns a block from memory or the store, `None` if missing."""
+        if index in self._blocks:
+            self._blocks.move_to_end(index)
+            return self._blocks[index]
+        data = self.store.get(self._key(index)) if self.store else None
+        if data is not None:
+            self._keep(index, data)
+        return data
+
+    def _keep(self, index: int, data: bytes) -> None:
+        """Keeps a block in memory, dropping the least recently read."""
+        self._blocks[index] = data
+        if len(self._blocks) > self.maxblocks:
+            self._blocks.popitem(last=False)
+
+    def _fetched(self, index: int, data: bytes) -> None:
+        """Keeps a block fetched from the remote file."""
+        if self.store:
+            self.store.put(self._key(index), data)
+        self._keep(index, data)
+
+    def _fetch_block(self, index: int) -> bytes:
+        """Returns a block from memory, the store or the remote file."""
+        data = self._cached_block(index)
+        if data is None:
+            start = index * self.blocksize
+            data = self.fetcher(start, min(start + self.blocksize, self.size))
+            self._fetched(index, data)
+        return data
+
+    def _fetch(self, start: Optional[int], stop: Optional[int]) -> bytes:
+        """Returns the bytes from `start` to `stop`, from their blocks."""
+        if start is None:
+            start = 0
+        if stop is None:
+            stop = self.size
+        stop = min(stop, self.size)
+        if start >= stop:
+            return b""
+        first, last = start // self.blocksize, (stop - 1) // self.blocksize
+        data = b"".join(self._fetch_block(index) for index in range(first, last + 1))
+        offset = start - first * self.blocksize
+        return data[offset : offset + stop - start]
+
+    def fetch_ranges(
+        self,
+        ranges: Sequence[Tuple[int, int]],
+        fetch: Callable[[List[ByteRange]], List[bytes]],
+        max_gap: int,
+        max_request_size: int,
+    ) -> List[bytes]:
+        """
+        Reads a batch of byte ranges, fetching the blocks missing from
+        memory and the store with `fetch`, merging the blocks less than
+        `max_gap` bytes apart into a request.
+
+        Args:
+            ranges: The ranges to read, as pairs of offset and size.
+            fetch: Fetches merged ranges of the remote file.
+            max_gap: The maximum number of unrequested bytes between two
+                blocks fetched by the same request.
+            max_request_size: The maximum number of bytes fetched by a request
+                merging several blocks.
+
+        Returns:
+            The bytes of each range, in the order of `ranges`.
+        """
+        spans = [(offset, min(offset + size, self.size)) for offset, size in ranges]
+        needed = sorted(
+            {
+                index
+                for start, stop in spans
+                if start < stop
+                for index in range(
+                    start // self.blocksize, (stop - 1) // self.blocksize + 1
+                )
+            }
+        )
+        # All blocks of the batch, which may outnumber `maxblocks`
+        blocks: Dict[int, bytes] = {}
+        missing = []
+        for index in needed:
+            data = self._cached_block(index)
+            if data is None:
+                missing.append(index)
+            else:
+                blocks[index] = data
+
+        merged = coalesce_ranges(
+            (
+                ByteRange(
+                    self.url or "",
+                    index * self.blocksize,
+                    min(self.blocksize, self.size - index * self.blocksize),
+                )
+                for index in missing
+            ),
+            max_gap,
+            max_request_size,
+        )
+        for byte_range, data in zip(merged, fetch(merged)):
+            view = memoryview(data)
+            first = byte_range.offset // self.blocksize
+            for index in range(first, (byte_range.end - 1) // self.blocksize + 1):
+                start = index * self.blocksize - byte_range.offset
+                if index not in blocks:
+                    blocks[index] = bytes(view[start : start + self.blocksize])
+                    self._fetched(index, blocks[index])
+
+        results = []
+        for start, stop in spans:
+            if start >= stop:
+                results.append(b"")
+                continue
+            first, last = start // self.blocksize, (stop - 1) // self.blocksize
+            data = b"".join(blocks[index] for index in range(first, last + 1))
+            offset = start - first * self.blocksize
+            results.append(data[offset : offset + stop - start])
+        return results
+
+
+register_cache(_BlockCache)
+
+
+def https_filesystem(headers: Optional[Dict[str, str]] = None) -> HTTPFileSystem:
+    """
+    Builds an fsspec HTTPS filesystem sending `headers` with every request,
+    e.g. the Earthdata Login bearer token.
+
+    Args:
+        headers: HTTP headers sent with every request.
+
+    Returns:
+        The filesystem.
+    """
+    return fsspec.filesystem(
+        "https", client_kwargs={"headers": headers or {}, "trust_env": False}
+    )
+
+
+def open_file(
+    fs: HTTPFileSystem,
+    file: GranuleFile,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    cache_type: str = "background",
+    max_blocks: int = 32,
+    cache_options: Optional[Dict[str, Any]] = None,
+    block_cache: Optional[BlockCache] = None,
+) -> AbstractBufferedFile:
+    """
+    Opens a remote file for random access reads, blocking until its size is known.
+
+    Args:
+        fs: The HTTPS filesystem, e.g. from `https_filesystem()`.
+        file: The file to open.
+        block_size: The number of bytes fetched by each request.
+        cache_type: The fsspec cache of the file, see `open_files()`.
+        max_blocks: The maximum number of blocks kept by the `blockcache`
+            and `background` caches.
+        cache_options: Additional options of the cache.
+        block_cache: A cache of blocks on local disk to read through,
+            replacing `cache_type`.
+
+    Returns:
+        The file object.
+    """
+    options = dict(cache_options or {})
+    if cache_type in BLOCK_CACHES or block_cache is not None:
+        options.setdefault("maxblocks", max_blocks)
+    size = file.size
+    if block_cache is not None:
+        if size is None:
+            size = fs.info(file.url)["size"]
+        cache_type = _BlockCache.name
+        # Blocks of replaced files must not be served
+        revision = f"r{file.revision_id}" if file.revision_id is not None else "r"
+        options.update(store=block_cache, url=file.url, revision=f"{revision}-s{size}")
+    elif cache_type == "blockcache":
+        # The same blocks kept, which also serve the batches of `read_ranges()`
+        cache_type = _BlockCache.name
+        options.update(url=file.url)
+    # The exact size published in CMR saves a request per file
+    return fs.open(
+        file.url,
+        "rb",
+        block_size=block_size,
+        cache_type=cache_type,
+        cache_options=options,
+        size=size,
+    )
+
+
+async def open_files(
+    files: List[GranuleFile],
+    headers: Optional[Dict[str, str]] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    cache_type: str = "background",
+    max_blocks: int = 32,
+    cache_options: Optional[Dict[str, Any]] = None,
+    block_cache: Optional[BlockCache] = None,
+) -> List[AbstractBufferedFile]:
+    """
+    Opens remote files for random access reads over HTTPS, as fsspec
+    file objects which HDF5 and NetCDF readers such as `h5py` or `xarray`
+    accept in place of local paths.
+
+    Reads are served from a cache of blocks of `block_size` bytes, so that
+    the many small reads of these readers turn into a few large requests.
+    The `cache_type` decides how blocks are fetched and kept:
+
+    - `background`: Keeps the last `max_blocks` blocks read and fetches
+        the block following the last one read in the background, suited to
+        sequential scans.
+    - `blockcache`: Keeps the last `max_blocks` blocks read, suited to
+        random access, and serves the batches of `read_ranges()` from them.
+    - `readahead`: Keeps a single range, fetching `block_size` bytes past
+        each read missing it.
+    - `first`: Keeps the first block, which holds the metadata of many files.
+    - `none`: Fetches every read.
+
+    With a `block_cache`, blocks are read through a persistent cache on
+    local disk shared by the processes of the node instead, keeping the last
+    `max_blocks` blocks read in memory, so that repeated reads of the same
+    granules are served at the speed of the local disk.
+
+    Args:
+        files: The files to open.
+        headers: HTTP headers sent with every request,
+            e.g. the Earthdata Login bearer token.
+        block_size: The number of bytes fetched by each request.
+        cache_type: The fsspec cache of each file.
+        max_blocks: The maximum number of blocks kept by the `blockcache`
+            and `background` caches of each file.
+        cache_options: Additional options of the caches.
+        block_cache: A cache of blocks on local disk to read through,
+            replacing `cache_type`. Its block size replaces `block_size`.
+
+    Returns:
+        The file objects, in the order of `files`.
+    """
+    fs = https_filesystem(headers)
+    return list(
+        await asyncio.gather(
+            *(
+                run_in_thread(
+                    open_file,
+                    fs,
+                    file,
+                    block_size,
+                    cache_type,
+                    max_blocks,
+                    cache_options,
+                    block_cache,
+                )
+                for file in files
+            )
+        )
+    )
+
+
+def read_ranges(
+    f: AbstractBufferedFile,
+    ranges: Sequence[Tuple[int, int]],
+    max_gap: int = DEFAULT_MAX_GAP,
+    max_request_size: int = DEFAULT_MAX_REQUEST_SIZE,
+    max_requests: Optional[int] = None,
+) -> List[bytes]:
+    """
+    Reads a batch of byte ranges of a remote file, e.g. the chunks of
+    the variables an HDF5 reader is about to decode. Ranges less than
+    `max_gap` bytes apart are fetched by a single request, as a request
+    costs a round trip while the bytes of the gap cost little bandwidth.
+    The merged ranges are fetched concurrently and the requested ranges
+    served from them in memory.
+
+    Files opened with the `blockcache` cache or a `block_cache` serve the
+    batch from their blocks instead, fetching only the blocks missing from
+    memory and the disk, which are then kept for the following reads.
+    The other caches are bypassed.
+
+    Args:
+        f: A remote file, e.g. from `open_files()`.
+        ranges: The ranges to read, as pairs of offset and size.
+        max_gap: The maximum number of unrequested bytes between two ranges
+            fetched by the same request.
+        max_request_size: The maximum number of bytes fetched by a request
+            merging several ranges.
+        max_requests: The maximum number of concurrent requests,
+            the default of the filesystem of `f` if `None`.
+
+    Returns:
+        The bytes of each range, in the order of `ranges`. Ranges past
+            the end of the file are cut short.
+
+    Example:
+        Reads several chunks of a granule in a few requests.
+
+        ```python
+        import asyncio
+
+        from prefect_earthdata.remote import open_files, read_ranges
+
+        (f,) = asyncio.run(open_files(files, headers=headers))
+        chunks = read_ranges(f, [(4096, 512), (4608, 512), (90112, 1024)])
+        ```
+    """
+
+    def fetch(merged: List[ByteRange]) -> List[bytes]:
+        """Fetches merged ranges of `f` concurrently."""
+        blocks = f.fs.cat_ranges(
+            [f.path] * len(merged),
+            [byte_range.offset for byte_range in merged],
+            [byte_range.end for byte_range in merged],
+            batch_size=max_requests,
+        )
+        for block in blocks:
+            if isinstance(block, Exception):
+                raise block
+        return blocks
+
+    if isinstance(f.cache, _BlockCache):
+        return f.cache.fetch_ranges(ranges, fetch, max_gap, max_request_size)
+
+    # Requests for ranges past the end of the file would be rejected
+    ranges = [(offset, max(0, min(size, f.size - offset))) for offset, size in ranges]
+    merged = coalesce_ranges(
+        (ByteRange(f.path, offset, size) for offset, size in ranges),
+        max_gap,
+        max_request_size,
+    )
+    blocks = fetch(merged)
+    starts = [byte_range.offset for byte_range in merged]
+    results = []
+    for offset, size in ranges:
+        if size <= 0:
+            results.append(b"")
+            continue
+        index = bisect_right(starts, offset) - 1
+        start = offset - starts[index]
+        results.append(bytes(memoryview(blocks[index])[start : start + size]))
+    return results
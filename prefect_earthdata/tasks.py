@@ -1,11 +1,112 @@
 """Module handling Prefect tasks interacting with NASA Earthdata"""
 
-from typing import List
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Union
 
 import earthaccess
+import fsspec
+from earthaccess.results import DataGranule
+from fsspec.spec import AbstractBufferedFile
 from prefect import get_run_logger, task
 
+from prefect_earthdata.buffers import (
+    DEFAULT_MEMORY_BUDGET,
+    GranuleBuffer,
+    MemoryBudget,
+)
+from prefect_earthdata.cache import BlockCache, GranuleCache
 from prefect_earthdata.credentials import EarthdataCredentials
+from prefect_earthdata.dmrpp import subset_files
+from prefect_earthdata.downloads import (
+    DEFAULT_CHUNK_SIZE,
+    DownloadEngine,
+    DownloadResult,
+    default_local_path,
+    run_in_thread,
+)
+from prefect_earthdata.granules import (
+    GranuleFile,
+    granule_files,
+    search_granule_pages,
+)
+from prefect_earthdata.journal import DownloadJournal
+from prefect_earthdata.limits import BandwidthLimiter
+from prefect_earthdata.references import granule_references
+from prefect_earthdata.remote import DEFAULT_BLOCK_SIZE, open_files
+
+
+def _download_engine(
+    auth: earthaccess.Auth,
+    logger: Union[logging.Logger, logging.LoggerAdapter],
+    threads: int = 8,
+    adaptive_concurrency: bool = False,
+    max_per_host: Optional[int] = None,
+    max_bandwidth: Optional[float] = None,
+    max_bandwidth_per_host: Optional[float] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_chunks_per_file: int = 4,
+    resume: bool = True,
+    skip_existing: bool = True,
+    cache: Optional[GranuleCache] = None,
+    storage_options: Optional[Dict[str, Any]] = None,
+    order: Union[str, Callable[[GranuleFile], Any]] = "input",
+    journal: Optional[str] = None,
+    file_retries: int = 3,
+    min_free_space: Optional[int] = 0,
+    evict_cache: bool = False,
+    allow_failures: bool = False,
+) -> DownloadEngine:
+    """
+    Builds the engine of a download from the options of the `download` task.
+    """
+    bandwidth = None
+    if max_bandwidth or max_bandwidth_per_host:
+        bandwidth = BandwidthLimiter.shared(max_bandwidth, max_bandwidth_per_host)
+
+    return DownloadEngine(
+        headers={"Authorization": f"Bearer {auth.token['access_token']}"},
+        max_concurrency=threads,
+        adaptive_concurrency=adaptive_concurrency,
+        max_per_host=max_per_host,
+        bandwidth=bandwidth,
+        chunk_size=chunk_size,
+        max_chunks_per_file=max_chunks_per_file,
+        resume=resume,
+        skip_existing=skip_existing,
+        cache=cache,
+        storage_options=storage_options,
+        order=order,
+        journal=journal and DownloadJournal(journal),
+        retries=file_retries,
+        min_free_space=min_free_space,
+        evict_cache=evict_cache,
+        allow_failures=allow_failures,
+        logger=logger,
+    )
+
+
+def _log_result(
+    logger: Union[logging.Logger, logging.LoggerAdapter], result: DownloadResult
+) -> None:
+    """
+    Logs the summary of a download and the files that failed.
+    """
+    logger.info(
+        f"Downloaded {result.downloaded} files, {result.corrupted} of which "
+        f"replaced corrupted local copies, served {result.cached} from the cache, "
+        f"{result.shared} from concurrent downloads, "
+        f"skipped {result.skipped} already present"
+    )
+    if result.concurrency:
+        _, concurrency, throughput = result.concurrency[-1]
+        logger.info(
+            f"Final download concurrency {concurrency}, "
+            f"throughput {throughput / 2**20:.1f} MiB/s"
+        )
+    for url, reason in result.failed.items():
+        logger.error(f"Failed to download {url}: {reason}")
 
 
 @task
@@ -66,21 +167,130 @@ async def search_data(
 
 
 @task
-async def download(credentials: EarthdataCredentials, *args, **kwargs) -> List[str]:
+async def download(
+    credentials: EarthdataCredentials,
+    granules: Union[DataGranule, List[DataGranule], List[str]],
+    local_path: Optional[str] = None,
+    provider: Optional[str] = None,
+    threads: int = 8,
+    adaptive_concurrency: bool = False,
+    max_per_host: Optional[int] = None,
+    max_bandwidth: Optional[float] = None,
+    max_bandwidth_per_host: Optional[float] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_chunks_per_file: int = 4,
+    resume: bool = True,
+    skip_existing: bool = True,
+    cache: Optional[GranuleCache] = None,
+    storage_options: Optional[Dict[str, Any]] = None,
+    order: Union[str, Callable[[GranuleFile], Any]] = "input",
+    journal: Optional[str] = None,
+    file_retries: int = 3,
+    min_free_space: Optional[int] = 0,
+    evict_cache: bool = False,
+    in_memory: bool = False,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    shared_memory: bool = False,
+    allow_failures: bool = False,
+) -> Union[List[str], List[GranuleBuffer]]:
     """
-    Downloads data from NASA Earthdata using the
-    [`earthaccess.download()`](https://nsidc.github.io/earthaccess/user-reference/api/api/#earthaccess.api.download) function
+    Downloads data from NASA Earthdata, with the same semantics as the
+    [`earthaccess.download()`](
+    https://nsidc.github.io/earthaccess/user-reference/api/api/#earthaccess.api.download
+    ) function.
+
+    Files are transferred over HTTPS by a `DownloadEngine`, which runs on the
+    event loop instead of blocking it, so that concurrent `download` task runs
+    in the same flow overlap. Files larger than `chunk_size` are fetched as
+    several byte ranges in parallel.
+
+    Files are written to `.part` files first and renamed once complete, so that
+    retries and re-runs of an interrupted download resume where it stopped.
+    Files already in `local_path` are not downloaded again if they match the
+    size and checksum published in the granule metadata, and downloaded files
+    are checked against the published checksum as they stream, being fetched
+    again on mismatch. Concurrent downloads of the same URL within a process,
+    e.g. from overlapping task runs, share a single transfer. With a
+    `GranuleCache`, granules already downloaded on the same node are linked
+    into `local_path` instead of being transferred again. Files downloaded
+    to an fsspec URL, e.g. on S3, are streamed straight into it as multipart
+    uploads, without going through local disk. For bulk downloads,
+    a `journal` records the state of every file, for restarts to only fetch
+    unfinished files without checking the whole destination.
+
+    With `in_memory`, files are returned as `GranuleBuffer` objects held in
+    memory instead, for processing without a round trip through the disk,
+    up to `memory_budget` bytes in total. Files beyond the budget are spilled
+    to temporary files in `local_path` if it is a local directory, and in
+    the system temporary directory otherwise. Buffers should be released once
+    processed. With `shared_memory`, files are held in shared memory segments
+    as `SharedGranuleBuffer` objects, which pickle into small handles that the
+    workers of a process pool attach to without copying the files.
+    The segments are removed when the buffers are released in the flow process.
+
+    Each file is retried on its own after transient failures, with a jittered
+    exponential backoff. If some files still fail, the task fails once all the
+    others are done, so that task retries, e.g. through
+    `download.with_options(retries=2)`, only fetch the missing files.
 
     Args:
         credentials: An `EarthdataCredentials` object used
             to authenticate with NASA Earthdata.
-        args: Additional positional arguments to be passed
-            to `earthaccess.download()`.
-        kwargs: Additional keyword arguments to be passed
-            to `earthaccess.download()`.
+        granules: A granule, a list of granules or a list of granule URLs.
+        local_path: Local directory to store the downloaded files into,
+            or an fsspec URL such as `s3://bucket/prefix` to stream them to.
+            Defaults to a new directory under `./data`.
+        provider: Not supported, as files are transferred over HTTPS,
+            raising a `ValueError` if set. In-region S3 access is available
+            through `earthaccess.download()`.
+        threads: Maximum number of files downloaded concurrently.
+        adaptive_concurrency: Whether to tune the number of files downloaded
+            concurrently, up to `threads`, growing it while the throughput
+            rises and cutting it back when the servers throttle or slow down.
+        max_per_host: Maximum number of concurrent requests to a single host.
+        max_bandwidth: Maximum bandwidth in bytes per second, shared by the
+            concurrent downloads of the process configured with the same limits.
+        max_bandwidth_per_host: Maximum bandwidth in bytes per second
+            for a single host, shared the same way.
+        chunk_size: Size in bytes of the ranges large files are split into.
+        max_chunks_per_file: Maximum number of ranges of a single file
+            downloaded in parallel, 1 to download each file in one request.
+        resume: Whether to resume interrupted downloads from their `.part` files.
+        skip_existing: Whether to skip files already present in `local_path`
+            and matching the size and checksum in the granule metadata.
+        cache: A node-local `GranuleCache` to serve granule files from
+            and add downloaded ones to.
+        storage_options: Options of the fsspec filesystem of a remote
+            `local_path`, e.g. credentials.
+        order: The order downloads are started in: `input`, `smallest` first
+            for the first files to be available sooner, `largest` first for the
+            whole download to end sooner, `time` for the temporal order of the
+            granules, or a function returning the sort key of a `GranuleFile`.
+        journal: Path of a journal recording the state of each file, a JSON
+            lines file if ending in `.jsonl` and an SQLite database otherwise.
+            Files it records as completed are skipped without being checked.
+        file_retries: Number of times each failed file is retried
+            within the task run.
+        min_free_space: Number of bytes to keep free on the filesystem of
+            a local `local_path`. The task fails before any transfer if the
+            files cannot fit, and transfers pause while the free space is
+            too low. Free space is not checked if `None`.
+        evict_cache: Whether to evict the least recently used files
+            of `cache` when short of space.
+        in_memory: Whether to return the files as in-memory buffers
+            instead of writing them into `local_path`.
+        memory_budget: The maximum number of bytes of the files held
+            in memory, with `in_memory`.
+        shared_memory: Whether to return the files as buffers in shared
+            memory for other processes to read, implying `in_memory`.
+        allow_failures: Whether to return the files that could be downloaded
+            when some fail, instead of failing the task.
 
     Returns:
-        List of downloaded files.
+        List of downloaded files, or of `GranuleBuffer` objects with
+            `in_memory` or `shared_memory`, as a `DownloadResult` also reporting
+            how many files were downloaded, served from the cache,
+            skipped or found corrupted, which failed and how long each took.
 
     Example:
         Searches and downloads granules through NASA Earthdata.
@@ -117,6 +327,425 @@ async def download(credentials: EarthdataCredentials, *args, **kwargs) -> List[s
 
         example_earthdata_download_flow()
         ```
+    """
+    if provider is not None:
+        raise ValueError(
+            "The download task transfers files over HTTPS and does not support "
+            "in-region S3 access through a provider, use earthaccess.download()"
+        )
+
+    logger = get_run_logger()
+
+    logger.debug("Authenticating to NASA Earthdata")
+    auth = credentials.login()
+    if not auth.authenticated:
+        raise ValueError("Could not authenticate to NASA Earthdata")
+
+    files = granule_files(granules)
+    in_memory = in_memory or shared_memory
+    if local_path is None and not in_memory:
+        local_path = default_local_path()
+
+    engine = _download_engine(
+        auth,
+        logger,
+        threads=threads,
+        adaptive_concurrency=adaptive_concurrency,
+        max_per_host=max_per_host,
+        max_bandwidth=max_bandwidth,
+        max_bandwidth_per_host=max_bandwidth_per_host,
+        chunk_size=chunk_size,
+        max_chunks_per_file=max_chunks_per_file,
+        resume=resume,
+        skip_existing=skip_existing,
+        cache=cache,
+        storage_options=storage_options,
+        order=order,
+        journal=journal,
+        file_retries=file_retries,
+        min_free_space=min_free_space,
+        evict_cache=evict_cache,
+        allow_failures=allow_failures,
+    )
+    if in_memory:
+        logger.info(
+            f"Downloading {len(files)} files into "
+            f"{'shared ' if shared_memory else ''}memory, "
+            f"up to {memory_budget} bytes"
+        )
+        result = await engine.download_buffers(
+            files, MemoryBudget(memory_budget), local_path, shared_memory
+        )
+        spilled = sum(not buffer.in_memory for buffer in result)
+        if spilled:
+            logger.info(f"Spilled {spilled} files over the memory budget to disk")
+    else:
+        logger.info(f"Downloading {len(files)} files to {local_path}")
+        result = await engine.download(files, local_path)
+    _log_result(logger, result)
+    return result
+
+
+@task
+async def search_and_download(
+    credentials: EarthdataCredentials,
+    local_path: Optional[str] = None,
+    count: int = -1,
+    page_size: int = 2000,
+    queue_size: int = 2000,
+    download_options: Optional[Dict[str, Any]] = None,
+    **kwargs,
+) -> List[str]:
+    """
+    Searches for data on NASA Earthdata and downloads it in a single pipeline:
+    the pages of search results feed a bounded queue of files, consumed by
+    concurrent downloads. Transfers start with the first page instead of
+    after the whole search, and the memory held by a large search is bounded
+    by `queue_size`, as the search waits while the queue is full.
+
+    Args:
+        credentials: An `EarthdataCredentials` object used
+            to authenticate with NASA Earthdata.
+        local_path: Local directory to store the downloaded files into,
+            or an fsspec URL such as `s3://bucket/prefix` to stream them to.
+            Defaults to a new directory under `./data`.
+        count: The maximum number of granules, all matching granules if negative.
+        page_size: The number of granules requested per page of results.
+        queue_size: The maximum number of files found and waiting for download.
+        download_options: Additional keyword arguments of the `download` task,
+            e.g. `threads` or `journal`. The `order` of the downloads is
+            always the order of the search results.
+        kwargs: Search parameters, as passed to `earthaccess.search_data()`.
+
+    Returns:
+        List of downloaded files, in the order of the search results,
+            as a `DownloadResult`.
+
+    Example:
+        Downloads all the granules of a collection within a bounding box.
+
+        ```python
+        from prefect import flow
+        from prefect_earthdata.credentials import EarthdataCredentials
+        from prefect_earthdata.tasks import search_and_download
+
+        @flow
+        def example_earthdata_pipeline_flow():
+
+            earthdata_credentials = EarthdataCredentials(
+                earthdata_userame = "username",
+                earthdata_password = "password"
+            )
+
+            return search_and_download(
+                earthdata_credentials,
+                "/tmp/granules",
+                short_name="ATL08",
+                bounding_box=(-92.86, 16.26, -91.58, 16.97),
+                download_options={"threads": 16},
+            )
+
+        example_earthdata_pipeline_flow()
+        ```
+    """
+    logger = get_run_logger()
+
+    logger.debug("Authenticating to NASA Earthdata")
+    auth = credentials.login()
+    if not auth.authenticated:
+        raise ValueError("Could not authenticate to NASA Earthdata")
+
+    if local_path is None:
+        local_path = default_local_path()
+    engine = _download_engine(auth, logger, **(download_options or {}))
+
+    done = object()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    async def search() -> None:
+        """Queues the files of each page of results, then the end marker."""
+        pages = search_granule_pages(auth, count, page_size, **kwargs)
+        try:
+            while True:
+                # CMR is queried with a blocking session, off the event loop
+                page = await run_in_thread(next, pages, None)
+                if page is None:
+                    break
+                logger.debug(f"Found {len(page)} granules")
+                for file in granule_files(page):
+                    await queue.put(file)
+        except Exception:
+            # Lets the downloads of the files already found end
+            await queue.put(done)
+            raise
+        await queue.put(done)
+
+    async def found() -> AsyncIterator[GranuleFile]:
+        """Yields the queued files until the end of the search."""
+        while True:
+            file = await queue.get()
+            if file is done:
+                return
+            yield file
+
+    logger.info(f"Searching and downloading granules to {local_path}")
+    searching = asyncio.ensure_future(search())
+    try:
+        result = await engine.download_stream(found(), local_path)
+    finally:
+        if not searching.done():
+            searching.cancel()
+    # Raises the search error, if any, over a partial result
+    await searching
+    _log_result(logger, result)
+    return result
+
+
+@task
+async def download_variables(
+    credentials: EarthdataCredentials,
+    granules: Union[DataGranule, List[DataGranule], List[str]],
+    variables: List[str],
+    local_path: Optional[str] = None,
+    threads: int = 4,
+    max_requests_per_file: int = 8,
+) -> List[str]:
+    """
+    Downloads only some variables of HDF5 or NetCDF-4 granules from NASA Earthdata,
+    fetching the byte ranges of their chunks listed in the DMR++ sidecar
+    published next to each file, at its URL followed by `.dmrpp`, instead of
+    the whole files. Each subset is stored as a data file holding the fetched
+    chunks and a DMR++ document pointing to them, which DMR++-aware readers
+    can open like the original granule.
+
+    Args:
+        credentials: An `EarthdataCredentials` object used
+            to authenticate with NASA Earthdata.
+        granules: A granule, a list of granules or a list of granule URLs.
+        variables: The paths of the variables to download,
+            e.g. `/gt1l/land_segments/latitude`. The variables of their
+            dimensions are downloaded too.
+        local_path: Local directory to store the subsets into.
+            Defaults to a new directory under `./data`.
+        threads: The maximum number of granules subset at the same time.
+        max_requests_per_file: The maximum number of concurrent range requests
+            for a single granule.
+
+    Returns:
+        List of the local DMR++ documents, in the order of the granules.
+
+    Example:
+        Downloads the canopy height and location of ATL08 land segments.
+
+        ```python
+        from prefect import flow
+        from prefect_earthdata.credentials import EarthdataCredentials
+        from prefect_earthdata.tasks import download_variables, search_data
+
+        @flow
+        def example_earthdata_subset_flow():
+
+            earthdata_credentials = EarthdataCredentials(
+                earthdata_userame = "username",
+                earthdata_password = "password"
+            )
+
+            granules = search_data(
+                earthdata_credentials,
+                short_name="ATL08",
+                bounding_box=(-92.86, 16.26, -91.58, 16.97),
+            )
+
+            return download_variables(
+                earthdata_credentials,
+                granules,
+                [
+                    "/gt1l/land_segments/latitude",
+                    "/gt1l/land_segments/longitude",
+                    "/gt1l/land_segments/canopy/h_canopy",
+                ],
+                "/tmp/subsets",
+            )
+
+        example_earthdata_subset_flow()
+        ```
+    """
+    logger = get_run_logger()
+
+    logger.debug("Authenticating to NASA Earthdata")
+    auth = credentials.login()
+    if not auth.authenticated:
+        raise ValueError("Could not authenticate to NASA Earthdata")
+
+    urls = [file.url for file in granule_files(granules)]
+    if local_path is None:
+        local_path = default_local_path()
+
+    logger.info(
+        f"Downloading {len(variables)} variables of {len(urls)} files to {local_path}"
+    )
+    paths = await subset_files(
+        urls,
+        variables,
+        local_path,
+        headers={"Authorization": f"Bearer {auth.token['access_token']}"},
+        max_concurrency=threads,
+        max_requests_per_file=max_requests_per_file,
+    )
+    return paths
+
+
+@task
+async def build_references(
+    credentials: EarthdataCredentials,
+    granules: Union[DataGranule, List[DataGranule], List[str]],
+    output_path: str,
+    variables: Optional[List[str]] = None,
+    threads: int = 8,
+    storage_options: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Builds a virtual Zarr dataset over granules of NASA Earthdata, as a
+    kerchunk reference file derived from the DMR++ sidecar published next to
+    each file, at its URL followed by `.dmrpp`. The chunks of the variables
+    point to their byte ranges in the granules, so that the whole set can be
+    opened lazily with a single metadata read, each granule as a group named
+    after its file.
+
+    Args:
+        credentials: An `EarthdataCredentials` object used
+            to authenticate with NASA Earthdata.
+        granules: A granule, a list of granules or a list of granule URLs.
+        output_path: Local path or fsspec URL of the JSON reference file.
+        variables: The paths of the variables to reference,
+            e.g. `/gt1l/land_segments/latitude`, all by default.
+        threads: The maximum number of sidecars fetched at the same time.
+        storage_options: Options of the fsspec filesystem of `output_path`.
+
+    Returns:
+        The path of the reference file.
+
+    Example:
+        Builds a virtual dataset over ATL08 granules.
+
+        ```python
+        from prefect import flow
+        from prefect_earthdata.credentials import EarthdataCredentials
+        from prefect_earthdata.tasks import build_references, search_data
+
+        @flow
+        def example_earthdata_references_flow():
+
+            earthdata_credentials = EarthdataCredentials(
+                earthdata_userame = "username",
+                earthdata_password = "password"
+            )
+
+            granules = search_data(
+                earthdata_credentials,
+                short_name="ATL08",
+                bounding_box=(-92.86, 16.26, -91.58, 16.97),
+            )
+
+            return build_references(
+                earthdata_credentials,
+                granules,
+                "s3://bucket/atl08.json",
+            )
+
+        example_earthdata_references_flow()
+        ```
+    """
+    logger = get_run_logger()
+
+    logger.debug("Authenticating to NASA Earthdata")
+    auth = credentials.login()
+    if not auth.authenticated:
+        raise ValueError("Could not authenticate to NASA Earthdata")
+
+    urls = [file.url for file in granule_files(granules)]
+    logger.info(f"Building references to {len(urls)} files into {output_path}")
+    references = await granule_references(
+        urls,
+        variables,
+        headers={"Authorization": f"Bearer {auth.token['access_token']}"},
+        max_concurrency=threads,
+    )
+
+    def write() -> None:
+        """Writes the reference file."""
+        with fsspec.open(output_path, "w", **(storage_options or {})) as f:
+            json.dump(references, f)
+
+    await run_in_thread(write)
+    return output_path
+
+
+@task
+async def open_data(
+    credentials: EarthdataCredentials,
+    granules: Union[DataGranule, List[DataGranule], List[str]],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    cache_type: str = "background",
+    max_blocks: int = 32,
+    cache_options: Optional[Dict[str, Any]] = None,
+    block_cache: Optional[BlockCache] = None,
+) -> List[AbstractBufferedFile]:
+    """
+    Opens data on NASA Earthdata as remote file-like objects, as
+    [`earthaccess.open()`](https://nsidc.github.io/earthaccess/user-reference/api/api/#earthaccess.api.open)
+    does over HTTPS, with control over how their reads are cached.
+    Small reads of HDF5 and NetCDF readers are served from blocks
+    of `block_size` bytes, each fetched by a single request.
+
+    Args:
+        credentials: An `EarthdataCredentials` object used
+            to authenticate with NASA Earthdata.
+        granules: A granule, a list of granules or a list of granule URLs.
+        block_size: The number of bytes fetched by each request.
+        cache_type: The fsspec cache of each file: `background` keeps
+            the last `max_blocks` blocks and reads the next block ahead,
+            `blockcache` keeps the last `max_blocks` blocks, `readahead`
+            reads `block_size` bytes past each read, `first` keeps
+            the first block and `none` fetches every read.
+        max_blocks: The maximum number of blocks kept in memory for each file
+            by the `background` and `blockcache` caches.
+        cache_options: Additional options of the fsspec caches.
+        block_cache: A `BlockCache` on local disk to read the blocks through,
+            shared by the processes of the node and replacing `cache_type`,
+            so that repeated reads of the same granules are served locally.
+
+    Returns:
+        List of file objects, in the order of the granules.
+
+    Example:
+        Opens granules as an xarray dataset without downloading them.
+
+        ```python
+        import xarray as xr
+        from prefect import flow
+        from prefect_earthdata.credentials import EarthdataCredentials
+        from prefect_earthdata.tasks import open_data, search_data
+
+        @flow
+        def example_earthdata_open_flow():
+
+            earthdata_credentials = EarthdataCredentials(
+                earthdata_userame = "username",
+                earthdata_password = "password"
+            )
+
+            granules = search_data(
+                earthdata_credentials,
+                short_name="ATL08",
+                bounding_box=(-92.86, 16.26, -91.58, 16.97),
+            )
+
+            files = open_data(earthdata_credentials, granules, block_size=8 * 2**20)
+            return xr.open_dataset(files[0], group="/gt1l/land_segments")
+
+        example_earthdata_open_flow()
+        ```
     """  # noqa: E501
 
     logger = get_run_logger()
@@ -126,4 +755,20 @@ async def download(credentials: EarthdataCredentials, *args, **kwargs) -> List[s
     if not auth.authenticated:
         raise ValueError("Could not authenticate to NASA Earthdata")
 
-    return earthaccess.download(*args, **kwargs)
+    files = granule_files(granules)
+    if block_cache is not None:
+        logger.info(
+            f"Opening {len(files)} files through the block cache "
+            f"in {block_cache.directory}"
+        )
+    else:
+        logger.info(f"Opening {len(files)} files with {cache_type} cache")
+    return await open_files(
+        files,
+        headers={"Authorization": f"Bearer {auth.token['access_token']}"},
+        block_size=block_size,
+        cache_type=cache_type,
+        max_blocks=max_blocks,
+        cache_options=cache_options,
+        block_cache=block_cache,
+    )
@@ -1,8 +1,16 @@
+import hashlib
 import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
+import requests
 import requests_mock
+import respx
 from importlib_resources import files
+from moto.server import ThreadedMotoServer
 from prefect.testing.utilities import prefect_test_harness
 
 from prefect_earthdata.credentials import EarthdataCredentials
@@ -71,12 +79,12 @@ def mock_earthdata_responses():
             "rb"
         ) as download_response_file:
             download_response = download_response_file.read()
-        m.get(
-            "https://data.nsidc.earthdatacloud.nasa.gov/nsidc-cumulus-prod-protected/ATLAS/ATL08/005/2018/11/05/ATL08_20181105083647_05760107_005_01.h5",  # noqa E501
-            body=download_response,
-            status_code=200,
-        )
-        yield m
+        with respx.mock(assert_all_called=False) as httpx_mock:
+            httpx_mock.get(
+                "https://data.nsidc.earthdatacloud.nasa.gov/nsidc-cumulus-prod-protected/ATLAS/ATL08/005/2018/11/05/ATL08_20181105083647_05760107_005_01.h5",  # noqa E501
+            ).respond(200, content=download_response)
+            httpx_mock.route().pass_through()
+            yield m
 
 
 @pytest.fixture
@@ -84,3 +92,143 @@ def earthdata_credentials_mock(mock_earthdata_responses):
     return EarthdataCredentials(
         earthdata_username="user", earthdata_password="password"
     )
+
+
+class GranuleRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the files of a `GranuleServer`, honoring single byte-range requests.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        name = self.path.lstrip("/")
+        if name not in self.server.files:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.files[name])))
+        if self.server.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        name = self.path.lstrip("/")
+        with server.lock:
+            server.requests.append((name, dict(self.headers)))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if server.delay:
+                time.sleep(server.delay)
+            if name in server.redirects:
+                self.send_response(302)
+                self.send_header("Location", server.redirects[name])
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if server.failures.get(name):
+                self.send_response(server.failures[name].pop(0))
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if name not in server.files:
+                self.send_error(404)
+                return
+
+            content = server.files[name]
+            if server.corrupt.get(name):
+                # Same size, different bytes
+                server.corrupt[name] -= 1
+                content = bytes(byte ^ 0xFF for byte in content)
+            etag = f'"{hashlib.md5(content).hexdigest()}"'
+            start, end = 0, len(content) - 1
+            match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if_range = self.headers.get("If-Range")
+            if match and server.accept_ranges and if_range in (None, etag):
+                start = int(match.group(1))
+                if start >= len(content):
+                    self.send_error(416)
+                    return
+                if match.group(2):
+                    end = min(int(match.group(2)), end)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            if name in server.truncate:
+                # Break the connection halfway, as a preempted transfer would
+                self.wfile.write(content[start : start + server.truncate.pop(name)])
+                self.close_connection = True
+                return
+            self.wfile.write(content[start : end + 1])
+        finally:
+            with server.lock:
+                server.active -= 1
+
+
+class GranuleServer(ThreadingHTTPServer):
+    """
+    Local HTTP server standing in for a DAAC, recording the requests it serves.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), GranuleRequestHandler)
+        self.files = {}
+        self.accept_ranges = True
+        self.delay = 0.0
+        self.truncate = {}
+        self.failures = {}
+        self.redirects = {}
+        self.corrupt = {}
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.server_port}/{name}"
+
+
+@pytest.fixture
+def granule_server():
+    server = GranuleServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def s3_storage_options(monkeypatch):
+    """
+    Runs a local S3 stand-in with a `bucket` bucket,
+    returning the fsspec storage options to reach it.
+    """
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    endpoint_url = f"http://127.0.0.1:{server._server.server_port}"
+    # The state of moto is global to the process
+    requests.post(f"{endpoint_url}/moto-api/reset")
+    storage_options = {
+        "client_kwargs": {"endpoint_url": endpoint_url},
+        "skip_instance_cache": True,
+    }
+    s3fs = pytest.importorskip("s3fs")
+    s3fs.S3FileSystem(**storage_options).mkdir("bucket")
+    yield storage_options
+    server.stop()
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import pickle
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import pytest
+
+from prefect_earthdata.buffers import (
+    GranuleBuffer,
+    MemoryBudget,
+    SharedGranuleBuffer,
+    _SpooledTarget,
+)
+
+
+def digest(buffer):
+    with buffer:
+        return hashlib.sha256(buffer.getbuffer()).hexdigest()
+
+
+def test_memory_budget():
+    budget = MemoryBudget(10)
+
+    assert budget.try_reserve(6)
+    assert not budget.try_reserve(5)
+    budget.release(6)
+    assert budget.try_reserve(10)
+    assert budget.available == 0
+
+
+def test_spooled_target_in_memory():
+    budget = MemoryBudget(100)
+    target = _SpooledTarget("https://example.com/a.h5", budget, size=10)
+    target.write(b"abc")
+    target.write(memoryview(b"def"))
+    target.close()
+
+    # The memory reserved beyond the received bytes is given back
+    assert budget.used == 6
+    with target.buffer() as buffer:
+        assert buffer.in_memory
+        assert len(buffer) == 6
+        assert bytes(buffer.getbuffer()) == b"abcdef"
+        with buffer.open() as f:
+            f.seek(2)
+            assert f.read(2) == b"cd"
+            assert f.read() == b"ef"
+    assert budget.used == 0
+
+
+def test_spooled_target_spills(tmp_path):
+    budget = MemoryBudget(4)
+    target = _SpooledTarget("https://example.com/a.h5", budget, str(tmp_path))
+    target.write(b"abc")
+    assert budget.used == 3
+    target.write(b"def")
+    target.close()
+
+    assert budget.used == 0
+    buffer = target.buffer()
+    assert not buffer.in_memory
+    assert os.path.dirname(buffer.path) == str(tmp_path)
+    assert bytes(buffer.getbuffer()) == b"abcdef"
+    with buffer.open() as f:
+        assert f.read() == b"abcdef"
+    buffer.release()
+    assert os.listdir(tmp_path) == []
+
+    # Files known to exceed the budget go straight to disk
+    target = _SpooledTarget("https://example.com/b.h5", budget, str(tmp_path), 5)
+    target.write(b"12345")
+    target.close()
+    assert budget.used == 0
+    assert not target.buffer().in_memory
+
+
+def test_spooled_target_discard(tmp_path):
+    budget = MemoryBudget(4)
+    for size in (None, 10):
+        target = _SpooledTarget("https://example.com/a.h5", budget, str(tmp_path))
+        target.write(b"abcdef"[: size or 3])
+        target.discard()
+    assert budget.used == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_granule_buffer_spilled_empty(tmp_path):
+    path = tmp_path / "empty"
+    path.write_bytes(b"")
+
+    buffer = GranuleBuffer("https://example.com/empty", path=str(path))
+
+    assert bytes(buffer.getbuffer()) == b""
+    buffer.release()
+    assert not path.exists()
+
+
+def test_shared_granule_buffer(tmp_path):
+    budget = MemoryBudget(100)
+    target = _SpooledTarget("https://example.com/a.h5", budget, size=6, shared=True)
+    target.write(b"abc")
+    target.write(b"def")
+    target.close()
+    buffer = target.buffer()
+
+    assert isinstance(buffer, SharedGranuleBuffer) and buffer.in_memory
+    assert bytes(buffer.getbuffer()) == b"abcdef"
+    # Handles name the segment instead of carrying the contents
+    assert len(pickle.dumps(buffer)) < 200
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        assert (
+            list(executor.map(digest, [buffer, buffer]))
+            == [hashlib.sha256(b"abcdef").hexdigest()] * 2
+        )
+    # Workers releasing their handles leave the segment to its owner
+    with pickle.loads(pickle.dumps(buffer)) as handle:
+        assert bytes(handle.getbuffer()) == b"abcdef"
+    assert bytes(buffer.getbuffer()) == b"abcdef"
+
+    name = buffer.name
+    buffer.release()
+    assert budget.used == 0
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name)
+
+
+def test_shared_granule_buffer_attached_by_other_process():
+    target = _SpooledTarget(
+        "https://example.com/a.h5", MemoryBudget(100), size=6, shared=True
+    )
+    target.write(b"abcdef")
+    target.close()
+    buffer = target.buffer()
+
+    # A process of its own, with a resource tracker of its own
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import pickle, sys\n"
+            "with pickle.load(sys.stdin.buffer) as handle:\n"
+            "    sys.stdout.write(bytes(handle.getbuffer()).decode())",
+        ],
+        input=pickle.dumps(buffer),
+        capture_output=True,
+        check=True,
+    )
+
+    assert process.stdout == b"abcdef"
+    assert b"leaked" not in process.stderr
+    # Not removed when that process exited
+    assert bytes(buffer.getbuffer()) == b"abcdef"
+    segment = shared_memory.SharedMemory(buffer.name)
+    segment.close()
+    buffer.release()
+
+
+def test_shared_granule_buffer_unknown_size(tmp_path):
+    budget = MemoryBudget(4)
+    target = _SpooledTarget("https://example.com/a.h5", budget, shared=True)
+    target.write(b"abc")
+    target.close()
+    with target.buffer() as buffer:
+        assert buffer.in_memory and buffer.name is not None
+        with pickle.loads(pickle.dumps(buffer)) as handle:
+            assert bytes(handle.getbuffer()) == b"abc"
+    assert budget.used == 0
+
+    # Files over the budget are spilled and handed over by path
+    target = _SpooledTarget(
+        "https://example.com/b.h5", budget, str(tmp_path), size=3, shared=True
+    )
+    target.write(b"abcdef")
+    target.close()
+    buffer = target.buffer()
+    assert not buffer.in_memory and budget.used == 0
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(digest, buffer).result() == (
+            hashlib.sha256(b"abcdef").hexdigest()
+        )
+    assert os.path.exists(buffer.path)
+    buffer.release()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,140 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from prefect_earthdata import cache as cache_module
+from prefect_earthdata.cache import BlockCache, GranuleCache, link_file
+from prefect_earthdata.downloads import DownloadEngine
+from prefect_earthdata.granules import GranuleFile
+
+
+def write(path, content):
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_granule_cache_key():
+    file = GranuleFile(
+        "https://host/path/file.h5", concept_id="G1-NSIDC", revision_id=2
+    )
+    assert GranuleCache.key(file) == "G1-NSIDC/2/file.h5"
+    assert GranuleCache.key(GranuleFile("https://host/path/file.h5")) is None
+
+
+def test_link_file(tmp_path):
+    source = write(tmp_path / "source", b"data")
+    link_file(source, str(tmp_path / "destination"))
+
+    assert (tmp_path / "destination").read_bytes() == b"data"
+    assert sorted(os.listdir(tmp_path)) == ["destination", "source"]
+
+
+def test_granule_cache_materialize(tmp_path):
+    cache = GranuleCache(str(tmp_path / "cache"), max_bytes=100)
+    assert not cache.materialize("G1/1/a.h5", str(tmp_path / "a.h5"))
+
+    assert not cache.contains("G1/1/a.h5")
+    cache.add("G1/1/a.h5", write(tmp_path / "source.h5", b"a" * 10))
+
+    assert cache.contains("G1/1/a.h5")
+    assert cache.materialize("G1/1/a.h5", str(tmp_path / "a.h5"))
+    assert (tmp_path / "a.h5").read_bytes() == b"a" * 10
+    assert cache.size == 10
+
+
+def test_granule_cache_lru_eviction(tmp_path):
+    cache = GranuleCache(str(tmp_path / "cache"), max_bytes=25)
+    source = write(tmp_path / "source.h5", b"x" * 10)
+
+    cache.add("G1/1/a.h5", source)
+    cache.add("G2/1/b.h5", source)
+    assert cache.materialize("G1/1/a.h5", str(tmp_path / "a.h5"))
+    cache.add("G3/1/c.h5", source)
+
+    assert cache.size == 20
+    assert not cache.materialize("G2/1/b.h5", str(tmp_path / "b.h5"))
+    assert cache.materialize("G1/1/a.h5", str(tmp_path / "a.h5"))
+
+    cache.add("G4/1/d.h5", write(tmp_path / "large.h5", b"x" * 30))
+    assert not cache.materialize("G4/1/d.h5", str(tmp_path / "d.h5"))
+
+    assert cache.evict(1) == 10
+    assert cache.size == 10
+
+
+def test_granule_cache_concurrent_access(tmp_path):
+    cache = GranuleCache(str(tmp_path / "cache"), max_bytes=1_000)
+    source = write(tmp_path / "source.h5", b"x" * 10)
+
+    def add_and_materialize(i):
+        cache.add(f"G{i}/1/file.h5", source)
+        return cache.materialize(f"G{i}/1/file.h5", str(tmp_path / f"{i}.h5"))
+
+    with ThreadPoolExecutor(8) as executor:
+        assert all(executor.map(add_and_materialize, range(32)))
+    assert cache.size == 320
+
+
+def test_block_cache(tmp_path):
+    cache = BlockCache(str(tmp_path / "cache"), max_bytes=25, block_size=10)
+    key = cache.key("https://example.com/a.h5", "r1", 0)
+
+    assert key != cache.key("https://example.com/a.h5", "r2", 0)
+    assert key != cache.key("https://example.com/a.h5", "r1", 10)
+    assert cache.get(key) is None
+    cache.put(key, b"x" * 10)
+    assert cache.get(key) == b"x" * 10
+
+    # Shared with other instances, e.g. of other processes
+    other = BlockCache(str(tmp_path / "cache"), max_bytes=25, block_size=10)
+    assert other.get(key) == b"x" * 10
+    other.put(cache.key("https://example.com/b.h5", "r1", 0), b"y" * 10)
+    other.put(cache.key("https://example.com/c.h5", "r1", 0), b"z" * 10)
+
+    assert cache.size == 20
+    assert cache.get(key) is None
+    assert cache.stats == {
+        "hits": 1,
+        "misses": 1,
+        "hit_bytes": 10,
+        "miss_bytes": 10,
+    }
+    assert other.stats["hits"] == 1
+    assert other.stats["misses"] == 2
+
+
+def test_block_cache_index(tmp_path, monkeypatch):
+    cache = BlockCache(str(tmp_path), max_bytes=100, block_size=10)
+    key = cache.key("https://example.com/a.h5", "r1", 0)
+    cache.put(key, b"x" * 10)
+    cache.put(key, b"y" * 5)
+    assert cache.size == 5
+
+    index = sqlite3.connect(str(tmp_path / "index.sqlite"))
+    assert index.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def last_access():
+        return index.execute("SELECT last_access FROM entries").fetchone()[0]
+
+    # Hits are written to the index in batches rather than one by one
+    written = last_access()
+    assert cache.get(key) == b"y" * 5
+    assert last_access() == written
+    monkeypatch.setattr(cache_module, "ACCESS_FLUSH_INTERVAL", 0)
+    cache.get(key)
+    assert last_access() > written
+
+
+async def test_download_engine_cache(granule_server, tmp_path):
+    granule_server.files = {"file.h5": b"data"}
+    file = GranuleFile(
+        granule_server.url("file.h5"), concept_id="G1-NSIDC", revision_id=1
+    )
+    cache = GranuleCache(str(tmp_path / "cache"), max_bytes=1_000)
+
+    first = await DownloadEngine(cache=cache).download([file], str(tmp_path / "a"))
+    second = await DownloadEngine(cache=cache).download([file], str(tmp_path / "b"))
+
+    assert len(granule_server.requests) == 1
+    assert (first.downloaded, second.cached) == (1, 1)
+    assert open(second[0], "rb").read() == b"data"
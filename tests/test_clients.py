@@ -0,0 +1,66 @@
+import socket
+
+import httpx
+import pytest
+
+from prefect_earthdata import clients
+from prefect_earthdata.clients import earthdata_client
+
+HEADERS = {"Authorization": "Bearer token"}
+
+
+def _redirect(granule_server, host):
+    port = granule_server.server_port
+    granule_server.files = {"b.h5": b"data"}
+    granule_server.redirects = {"a.h5": f"http://{host}:{port}/b.h5"}
+
+
+@pytest.mark.parametrize("read_size", [None, 1024 * 1024])
+async def test_earthdata_client_keeps_authorization_to_urs(
+    granule_server, monkeypatch, read_size
+):
+    # Stands in for Earthdata Login, on another host than the DAAC
+    monkeypatch.setattr(clients, "URS_HOST", "localhost")
+    _redirect(granule_server, "localhost")
+
+    async with earthdata_client(HEADERS, read_size=read_size) as client:
+        response = await client.get(granule_server.url("a.h5"))
+
+    assert response.content == b"data"
+    assert [headers.get("Authorization") for _, headers in granule_server.requests] == [
+        "Bearer token",
+        "Bearer token",
+    ]
+
+
+async def test_earthdata_client_drops_authorization_to_other_hosts(granule_server):
+    _redirect(granule_server, "localhost")
+
+    async with earthdata_client(HEADERS) as client:
+        response = await client.get(granule_server.url("a.h5"))
+
+    assert response.content == b"data"
+    assert [headers.get("Authorization") for _, headers in granule_server.requests] == [
+        "Bearer token",
+        None,
+    ]
+
+
+async def test_earthdata_client_honors_proxies(monkeypatch):
+    monkeypatch.setenv("HTTPS_PROXY", "http://proxy.example.com:3128")
+
+    async with earthdata_client(read_size=1024 * 1024) as client:
+        transport = client._transport_for_url(httpx.URL("https://example.com"))
+
+    assert not isinstance(transport, clients._LargeReadTransport)
+    assert transport is not client._transport
+
+
+async def test_earthdata_client_raises_httpx_errors():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    async with earthdata_client(read_size=1024 * 1024) as client:
+        with pytest.raises(httpx.ConnectError):
+            await client.get(f"http://127.0.0.1:{port}/a.h5")
@@ -0,0 +1,202 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from prefect_earthdata.dmrpp import (
+    ByteRange,
+    coalesce_ranges,
+    dmrpp_variables,
+    parse_dmrpp,
+    select_variables,
+    subset_dmrpp,
+    subset_files,
+)
+from prefect_earthdata.downloads import DownloadError
+
+DMRPP = """<?xml version="1.0" encoding="UTF-8"?>
+<Dataset xmlns="http://xml.opendap.org/ns/DAP/4.0#"
+    xmlns:dmrpp="http://xml.opendap.org/dap/dmrpp/1.0.0#"
+    dapVersion="4.0" dmrVersion="1.0" name="granule.h5"
+    dmrpp:href="{href}">
+    <Dimension name="n" size="4"/>
+    <Float64 name="lat">
+        <Dim name="/n"/>
+        <Attribute name="units" type="String"><Value>degrees_north</Value></Attribute>
+        <dmrpp:chunks byteOrder="LE">
+            <dmrpp:chunk offset="100" nBytes="32"/>
+        </dmrpp:chunks>
+    </Float64>
+    <Group name="gt1l">
+        <Dimension name="delta_time" size="4"/>
+        <Float64 name="delta_time">
+            <Dim name="/gt1l/delta_time"/>
+            <dmrpp:chunks byteOrder="LE">
+                <dmrpp:chunk offset="5000" nBytes="32"/>
+            </dmrpp:chunks>
+        </Float64>
+        <Float32 name="height">
+            <Dim name="/gt1l/delta_time"/>
+            <dmrpp:chunks compressionType="deflate" byteOrder="LE">
+                <dmrpp:chunkDimensionSizes>2</dmrpp:chunkDimensionSizes>
+                <dmrpp:chunk offset="132" nBytes="8" chunkPositionInArray="[0]"/>
+                <dmrpp:chunk offset="140" nBytes="6" chunkPositionInArray="[2]"/>
+            </dmrpp:chunks>
+        </Float32>
+        <Float32 name="big">
+            <Dim name="/gt1l/delta_time"/>
+            <dmrpp:chunks byteOrder="LE">
+                <dmrpp:chunk offset="1000" nBytes="4000"/>
+            </dmrpp:chunks>
+        </Float32>
+    </Group>
+</Dataset>
+"""
+
+
+@pytest.fixture
+def dmrpp_granule(granule_server):
+    data = bytes(i % 251 for i in range(10000))
+    granule_server.files["granule.h5"] = data
+    granule_server.files["granule.h5.dmrpp"] = DMRPP.format(
+        href=granule_server.url("granule.h5")
+    ).encode()
+    return data
+
+
+def test_dmrpp_variables():
+    tree = parse_dmrpp(DMRPP.format(href="https://example.com/granule.h5"))
+
+    assert sorted(dmrpp_variables(tree)) == [
+        "/gt1l/big",
+        "/gt1l/delta_time",
+        "/gt1l/height",
+        "/lat",
+    ]
+    assert select_variables(tree, ["gt1l/height"]) == {
+        "/gt1l/height",
+        "/gt1l/delta_time",
+    }
+    with pytest.raises(KeyError, match="/gt1l/missing"):
+        select_variables(tree, ["/gt1l/missing"])
+
+
+def test_coalesce_ranges():
+    ranges = [
+        ByteRange("a", 10, 5),
+        ByteRange("a", 0, 10),
+        ByteRange("b", 15, 5),
+        ByteRange("a", 12, 8),
+        ByteRange("a", 30, 0),
+        ByteRange("a", 40, 5),
+    ]
+
+    assert coalesce_ranges(ranges) == [
+        ByteRange("a", 0, 20),
+        ByteRange("a", 40, 5),
+        ByteRange("b", 15, 5),
+    ]
+    assert coalesce_ranges(ranges, max_gap=20) == [
+        ByteRange("a", 0, 45),
+        ByteRange("b", 15, 5),
+    ]
+    assert coalesce_ranges(ranges, max_gap=20, max_size=30) == [
+        ByteRange("a", 0, 20),
+        ByteRange("a", 40, 5),
+        ByteRange("b", 15, 5),
+    ]
+
+
+def test_subset_files(granule_server, dmrpp_granule, tmp_path):
+    url = granule_server.url("granule.h5")
+
+    paths = asyncio.run(
+        subset_files([url], ["/lat", "/gt1l/height"], str(tmp_path / "subsets"))
+    )
+
+    assert paths == [str(tmp_path / "subsets" / "granule.h5.subset.dmrpp")]
+    tree = parse_dmrpp(Path(paths[0]).read_bytes())
+    variables = dmrpp_variables(tree)
+    assert sorted(variables) == ["/gt1l/delta_time", "/gt1l/height", "/lat"]
+    data_path = tmp_path / "subsets" / "granule.h5.subset"
+    assert (
+        tree.getroot().get("{http://xml.opendap.org/dap/dmrpp/1.0.0#}href")
+        == data_path.as_uri()
+    )
+    assert (
+        variables["/lat"].find("{http://xml.opendap.org/ns/DAP/4.0#}Attribute")
+        is not None
+    )
+
+    # The chunks point to the same bytes in the compact local file
+    subset = data_path.read_bytes()
+    assert len(subset) == 32 + 8 + 6 + 32
+    original = parse_dmrpp(DMRPP.format(href=url))
+    original_variables = dmrpp_variables(original)
+    for name, variable in variables.items():
+        chunks = variable.iter("{http://xml.opendap.org/dap/dmrpp/1.0.0#}chunk")
+        original_chunks = original_variables[name].iter(
+            "{http://xml.opendap.org/dap/dmrpp/1.0.0#}chunk"
+        )
+        for chunk, original_chunk in zip(chunks, original_chunks):
+            offset, size = int(chunk.get("offset")), int(chunk.get("nBytes"))
+            original_offset = int(original_chunk.get("offset"))
+            assert (
+                subset[offset : offset + size]
+                == dmrpp_granule[original_offset : original_offset + size]
+            )
+
+    # Only the chunks of the variables are fetched, contiguous ones together
+    ranges = sorted(
+        headers["Range"]
+        for name, headers in granule_server.requests
+        if name == "granule.h5"
+    )
+    assert ranges == ["bytes=100-145", "bytes=5000-5031"]
+
+
+@pytest.mark.parametrize(
+    "href, expected",
+    [
+        ("OPeNDAP_DMRpp_DATA_ACCESS_URL", "https://example.com/granule.h5"),
+        ("granule.h5", "https://example.com/granule.h5"),
+        ("s3://bucket/granule.h5", "https://example.com/granule.h5"),
+        ("https://data.example.com/granule.h5", "https://data.example.com/granule.h5"),
+    ],
+)
+def test_subset_dmrpp_data_href(href, expected):
+    tree = parse_dmrpp(DMRPP.format(href=href))
+
+    ranges = subset_dmrpp(tree, ["/lat"], "https://example.com/granule.h5")
+
+    # Placeholders and relative names left by the DMR++ builders are not URLs
+    assert ranges == [ByteRange(expected, 100, 32)]
+
+
+def test_subset_files_placeholder_href(granule_server, dmrpp_granule, tmp_path):
+    granule_server.files["granule.h5.dmrpp"] = DMRPP.format(
+        href="OPeNDAP_DMRpp_DATA_ACCESS_URL"
+    ).encode()
+
+    (path,) = asyncio.run(
+        subset_files([granule_server.url("granule.h5")], ["/lat"], str(tmp_path))
+    )
+
+    assert (tmp_path / "granule.h5.subset").read_bytes() == dmrpp_granule[100:132]
+    tree = parse_dmrpp(Path(path).read_bytes())
+    assert (
+        tree.getroot().get("{http://xml.opendap.org/dap/dmrpp/1.0.0#}href")
+        == (tmp_path / "granule.h5.subset").as_uri()
+    )
+
+
+def test_subset_files_range_not_honored(granule_server, dmrpp_granule, tmp_path):
+    granule_server.accept_ranges = False
+
+    with pytest.raises(DownloadError, match="did not honor range"):
+        asyncio.run(
+            subset_files([granule_server.url("granule.h5")], ["/lat"], str(tmp_path))
+        )
+
+    assert not (tmp_path / "granule.h5.subset").exists()
+    assert not (tmp_path / "granule.h5.subset.dmrpp").exists()
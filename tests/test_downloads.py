@@ -0,0 +1,943 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import httpx
+import pytest
+
+from prefect_earthdata import clients, downloads
+from prefect_earthdata.buffers import MemoryBudget
+from prefect_earthdata.cache import GranuleCache
+from prefect_earthdata.downloads import (
+    DownloadEngine,
+    DownloadError,
+    InsufficientSpaceError,
+    _BufferedWriter,
+    _BufferPool,
+    _InlineChecksum,
+    is_retryable,
+    parse_content_range,
+    schedule,
+    split_ranges,
+)
+from prefect_earthdata.granules import GranuleFile
+from prefect_earthdata.journal import DownloadJournal
+from prefect_earthdata.limits import BandwidthLimiter
+from prefect_earthdata.locks import FileLease
+
+
+async def test_download_engine(granule_server, tmp_path):
+    granule_server.files = {f"file{i}.h5": os.urandom(100_000) for i in range(5)}
+    urls = [granule_server.url(name) for name in granule_server.files]
+
+    engine = DownloadEngine(max_concurrency=2, buffer_size=4096)
+    files = await engine.download(urls, str(tmp_path / "out"))
+
+    assert files == [str(tmp_path / "out" / name) for name in granule_server.files]
+    for name, content in granule_server.files.items():
+        assert (tmp_path / "out" / name).read_bytes() == content
+    assert granule_server.max_active <= 2
+
+
+async def test_download_engine_per_host_limit(granule_server, tmp_path):
+    granule_server.files = {f"file{i}.h5": b"data" for i in range(4)}
+    granule_server.delay = 0.05
+    urls = [granule_server.url(name) for name in granule_server.files]
+
+    engine = DownloadEngine(max_concurrency=4, max_per_host=1)
+    await engine.download(urls, str(tmp_path))
+
+    assert granule_server.max_active == 1
+
+
+async def test_download_engine_concurrent_downloads_overlap(granule_server, tmp_path):
+    granule_server.files = {"a.h5": b"a", "b.h5": b"b"}
+    granule_server.delay = 0.5
+
+    start = time.monotonic()
+    await asyncio.gather(
+        DownloadEngine().download([granule_server.url("a.h5")], str(tmp_path)),
+        DownloadEngine().download([granule_server.url("b.h5")], str(tmp_path)),
+    )
+
+    assert time.monotonic() - start < 0.9
+    assert granule_server.max_active == 2
+
+
+async def test_download_engine_removes_partial_files(granule_server, tmp_path):
+    granule_server.files = {"a.h5": b"a"}
+
+    engine = DownloadEngine()
+    with pytest.raises(Exception):
+        await engine.download(
+            [granule_server.url("a.h5"), granule_server.url("missing.h5")],
+            str(tmp_path),
+        )
+
+    assert not (tmp_path / "missing.h5").exists()
+
+
+async def test_download_engine_reads_large_chunks(
+    granule_server, tmp_path, monkeypatch
+):
+    content = os.urandom(4_000_000)
+    granule_server.files = {"a.h5": content}
+    sizes = []
+    read = clients._LargeReadStream.read
+
+    async def record_read(self, max_bytes, timeout=None):
+        data = await read(self, max_bytes, timeout)
+        sizes.append(len(data))
+        return data
+
+    monkeypatch.setattr(clients._LargeReadStream, "read", record_read)
+
+    engine = DownloadEngine(max_chunks_per_file=1)
+    (path,) = await engine.download([granule_server.url("a.h5")], str(tmp_path))
+
+    assert open(path, "rb").read() == content
+    assert max(sizes) > 64 * 1024
+
+
+def test_split_ranges():
+    assert split_ranges(0, 10, 4) == [(0, 3), (4, 7), (8, 9)]
+    assert split_ranges(4, 8, 4) == [(4, 7)]
+    assert split_ranges(0, 0, 4) == []
+
+
+async def test_buffered_writer_reuses_buffers():
+    pool = _BufferPool(4)
+    writes = []
+
+    async def sink(offset, data):
+        writes.append((offset, bytes(data)))
+
+    writer = _BufferedWriter(sink, 10, pool)
+    for data in (b"ab", b"cde", b"fghijk", b"l", b"mnopqr", b"s"):
+        await writer.write(data)
+    await writer.close()
+
+    assert writes == [
+        (10, b"abcd"),
+        (14, b"e"),
+        # Written as received, without copy
+        (15, b"fghijk"),
+        (21, b"l"),
+        (22, b"mnopqr"),
+        (28, b"s"),
+    ]
+    assert writer.written == 19
+    # One buffer filling while the other one is written
+    assert len(pool._free) == 2
+
+
+def test_parse_content_range():
+    assert parse_content_range("bytes 0-99/1000") == (0, 99, 1000)
+    assert parse_content_range("bytes 0-99/*") == (0, 99, None)
+    with pytest.raises(DownloadError):
+        parse_content_range(None)
+
+
+async def test_download_engine_byte_ranges(granule_server, tmp_path):
+    content = os.urandom(1_000_000)
+    granule_server.files = {"large.h5": content}
+
+    engine = DownloadEngine(chunk_size=100_000, max_chunks_per_file=4)
+    (path,) = await engine.download([granule_server.url("large.h5")], str(tmp_path))
+
+    assert open(path, "rb").read() == content
+    ranges = [headers.get("Range") for _, headers in granule_server.requests]
+    assert len(ranges) == 10
+    assert "bytes=900000-999999" in ranges
+    assert granule_server.max_active <= 4
+
+
+async def test_download_engine_byte_ranges_not_supported(granule_server, tmp_path):
+    content = os.urandom(1_000_000)
+    granule_server.files = {"large.h5": content}
+    granule_server.accept_ranges = False
+
+    engine = DownloadEngine(chunk_size=100_000)
+    (path,) = await engine.download([granule_server.url("large.h5")], str(tmp_path))
+
+    assert open(path, "rb").read() == content
+    assert len(granule_server.requests) == 1
+
+
+async def test_download_engine_empty_file(granule_server, tmp_path):
+    granule_server.files = {"empty.h5": b""}
+
+    (path,) = await DownloadEngine().download(
+        [granule_server.url("empty.h5")], str(tmp_path)
+    )
+
+    assert open(path, "rb").read() == b""
+
+
+async def test_download_engine_resumes_interrupted_download(granule_server, tmp_path):
+    content = os.urandom(1_000_000)
+    granule_server.files = {"large.h5": content}
+    granule_server.truncate = {"large.h5": 550_000}
+    url = granule_server.url("large.h5")
+
+    engine = DownloadEngine(chunk_size=100_000, max_chunks_per_file=1, retries=0)
+    with pytest.raises(Exception):
+        await engine.download([url], str(tmp_path))
+
+    assert not (tmp_path / "large.h5").exists()
+    checkpoint = json.loads((tmp_path / "large.h5.part.json").read_text())
+    assert checkpoint["ranges"] == [[0, 549_999]]
+
+    (path,) = await engine.download([url], str(tmp_path))
+
+    assert open(path, "rb").read() == content
+    assert granule_server.requests[-1][1]["Range"] == "bytes=550000-"
+    assert sorted(os.listdir(tmp_path)) == ["large.h5"]
+
+
+async def test_download_engine_resumes_missing_byte_ranges(granule_server, tmp_path):
+    content = os.urandom(1_000_000)
+    granule_server.files = {"large.h5": content}
+    url = granule_server.url("large.h5")
+    etag = f'"{hashlib.md5(content).hexdigest()}"'
+
+    part = bytearray(len(content))
+    part[:300_000] = content[:300_000]
+    part[500_000:600_000] = content[500_000:600_000]
+    (tmp_path / "large.h5.part").write_bytes(part)
+    (tmp_path / "large.h5.part.json").write_text(
+        json.dumps(
+            {
+                "url": url,
+                "size": len(content),
+                "validator": etag,
+                "ranges": [[0, 299_999], [500_000, 599_999]],
+            }
+        )
+    )
+
+    engine = DownloadEngine(chunk_size=100_000, max_chunks_per_file=4)
+    (path,) = await engine.download([url], str(tmp_path))
+
+    assert open(path, "rb").read() == content
+    ranges = sorted(headers["Range"] for _, headers in granule_server.requests)
+    assert ranges == [
+        "bytes=300000-399999",
+        "bytes=400000-499999",
+        "bytes=600000-699999",
+        "bytes=700000-799999",
+        "bytes=800000-899999",
+        "bytes=900000-999999",
+    ]
+
+
+async def test_download_engine_resumes_complete_part_file(granule_server, tmp_path):
+    content = os.urandom(1_000)
+    granule_server.files = {"file.h5": content}
+    url = granule_server.url("file.h5")
+
+    (tmp_path / "file.h5.part").write_bytes(content)
+    (tmp_path / "file.h5.part.json").write_text(
+        json.dumps({"url": url, "size": 1_000, "validator": None, "ranges": [[0, 999]]})
+    )
+
+    engine = DownloadEngine(chunk_size=100, retries=0)
+    file = GranuleFile(
+        url,
+        size=1_000,
+        checksum=hashlib.md5(content).hexdigest(),
+        checksum_algorithm="MD5",
+    )
+    (path,) = await engine.download([file], str(tmp_path))
+
+    assert open(path, "rb").read() == content
+    assert granule_server.requests == []
+    assert sorted(os.listdir(tmp_path)) == ["file.h5"]
+
+
+async def test_download_engine_restarts_when_file_changed(granule_server, tmp_path):
+    content = os.urandom(1_000)
+    granule_server.files = {"file.h5": content}
+    url = granule_server.url("file.h5")
+
+    (tmp_path / "file.h5.part").write_bytes(b"x" * 500)
+    (tmp_path / "file.h5.part.json").write_text(
+        json.dumps(
+            {"url": url, "size": 1_000, "validator": '"old"', "ranges": [[0, 499]]}
+        )
+    )
+
+    (path,) = await DownloadEngine(chunk_size=100).download([url], str(tmp_path))
+
+    assert open(path, "rb").read() == content
+
+
+async def test_download_engine_without_resume(granule_server, tmp_path):
+    granule_server.files = {"large.h5": os.urandom(1_000)}
+    granule_server.truncate = {"large.h5": 500}
+
+    engine = DownloadEngine(
+        chunk_size=100, max_chunks_per_file=1, resume=False, retries=0
+    )
+    with pytest.raises(Exception):
+        await engine.download([granule_server.url("large.h5")], str(tmp_path))
+
+    assert os.listdir(tmp_path) == []
+
+
+async def test_download_engine_skips_files_matching_metadata(granule_server, tmp_path):
+    content = os.urandom(1_000)
+    granule_server.files = {"good.h5": content, "bad.h5": content, "new.h5": content}
+    (tmp_path / "good.h5").write_bytes(content)
+    (tmp_path / "bad.h5").write_bytes(content[:-1] + b"x")
+    files = [
+        GranuleFile(
+            granule_server.url(name),
+            size=len(content),
+            checksum=hashlib.sha256(content).hexdigest(),
+            checksum_algorithm="SHA-256",
+        )
+        for name in granule_server.files
+    ]
+
+    result = await DownloadEngine().download(files, str(tmp_path))
+
+    assert result == [str(tmp_path / name) for name in granule_server.files]
+    assert (result.downloaded, result.skipped, result.corrupted) == (2, 1, 1)
+    assert sorted(name for name, _ in granule_server.requests) == ["bad.h5", "new.h5"]
+    assert (tmp_path / "bad.h5").read_bytes() == content
+
+
+async def test_download_engine_checks_downloaded_size(granule_server, tmp_path):
+    granule_server.files = {"file.h5": b"data"}
+    file = GranuleFile(granule_server.url("file.h5"), size=5)
+
+    with pytest.raises(DownloadError, match="expected 5"):
+        await DownloadEngine(retries=0).download([file], str(tmp_path))
+
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("max_chunks_per_file", [1, 4])
+async def test_download_engine_refetches_on_checksum_mismatch(
+    granule_server, tmp_path, max_chunks_per_file
+):
+    content = os.urandom(10_000)
+    granule_server.files = {"file.h5": content}
+    granule_server.corrupt = {"file.h5": 1 if max_chunks_per_file == 1 else 3}
+    file = GranuleFile(
+        granule_server.url("file.h5"),
+        checksum=hashlib.md5(content).hexdigest(),
+        checksum_algorithm="MD5",
+    )
+
+    engine = DownloadEngine(
+        chunk_size=4_000, max_chunks_per_file=max_chunks_per_file, retry_delay=0
+    )
+    result = await engine.download([file], str(tmp_path))
+
+    assert (tmp_path / "file.h5").read_bytes() == content
+    assert result.downloaded == 1
+
+
+async def test_download_engine_checksum_mismatch(granule_server, tmp_path):
+    granule_server.files = {"file.h5": b"data"}
+    file = GranuleFile(
+        granule_server.url("file.h5"),
+        checksum=hashlib.sha256(b"other").hexdigest(),
+        checksum_algorithm="SHA-256",
+    )
+
+    with pytest.raises(DownloadError, match="does not match its published SHA-256"):
+        await DownloadEngine(retries=0).download([file], str(tmp_path))
+
+    assert os.listdir(tmp_path) == []
+
+
+async def test_download_engine_buffers(granule_server, tmp_path):
+    granule_server.files = {
+        "small.h5": b"s" * 100,
+        "large.h5": b"l" * 1000,
+        "corrupt.h5": b"c" * 10,
+    }
+    granule_server.corrupt = {"corrupt.h5": 1}
+    files = [
+        GranuleFile(granule_server.url("small.h5")),
+        GranuleFile(granule_server.url("large.h5")),
+        GranuleFile(
+            granule_server.url("corrupt.h5"),
+            checksum=hashlib.md5(b"c" * 10).hexdigest(),
+            checksum_algorithm="MD5",
+        ),
+    ]
+    budget = MemoryBudget(500)
+
+    result = await DownloadEngine(retry_delay=0).download_buffers(
+        files, budget, str(tmp_path)
+    )
+
+    small, large, corrupt = result
+    assert result.downloaded == 3
+    assert small.in_memory and bytes(small.getbuffer()) == b"s" * 100
+    assert not large.in_memory and bytes(large.getbuffer()) == b"l" * 1000
+    assert corrupt.in_memory and bytes(corrupt.getbuffer()) == b"c" * 10
+    assert budget.used == 110
+    assert len(os.listdir(tmp_path)) == 1
+
+    for buffer in result:
+        buffer.release()
+    assert budget.used == 0
+    assert os.listdir(tmp_path) == []
+
+
+async def test_download_engine_buffers_spill_locally(granule_server, tmp_path):
+    granule_server.files = {"large.h5": b"l" * 1000}
+
+    result = await DownloadEngine().download_buffers(
+        [granule_server.url("large.h5")], MemoryBudget(10), "memory://spill"
+    )
+
+    # Not to the remote destination, which temporary files cannot live in
+    (buffer,) = result
+    assert not buffer.in_memory
+    assert os.path.dirname(buffer.path) == tempfile.gettempdir()
+    buffer.release()
+
+
+def test_inline_checksum_reads_back_bytes_out_of_order(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"abcdef")
+    checksum = _InlineChecksum(hashlib.md5())
+    checksum.update(0, b"ab")
+    checksum.update(4, b"ef")
+    checksum.update(2, b"cd")
+
+    assert checksum.position == 4
+    assert checksum.hexdigest(str(path)) == hashlib.md5(b"abcdef").hexdigest()
+
+
+def test_inline_checksum_hashes_ranges_as_the_prefix_fills_in(tmp_path):
+    content = os.urandom(1_000)
+    reads = []
+
+    def read_at(offset, size):
+        reads.append((offset, size))
+        return content[offset : offset + size]
+
+    checksum = _InlineChecksum(hashlib.md5())
+    checksum.stored(900, 1_000)
+    checksum.update(500, content[500:700], read_at)
+    checksum.update(700, content[700:900], read_at)
+    assert checksum.position == 0
+    checksum.update(0, content[:500], read_at)
+
+    # The ranges written ahead are hashed once the first one is done
+    assert checksum.position == 1_000
+    assert reads == [(500, 500)]
+    assert checksum.hexdigest(os.devnull) == hashlib.md5(content).hexdigest()
+
+
+async def test_download_engine_checksums_byte_ranges_inline(
+    granule_server, tmp_path, monkeypatch
+):
+    content = os.urandom(1_000_000)
+    granule_server.files = {"large.h5": content}
+    file = GranuleFile(
+        granule_server.url("large.h5"),
+        size=len(content),
+        checksum=hashlib.md5(content).hexdigest(),
+        checksum_algorithm="MD5",
+    )
+    positions = []
+    hexdigest = _InlineChecksum.hexdigest
+
+    def record_position(self, path, buffer_size=downloads.DEFAULT_BUFFER_SIZE):
+        positions.append(self.position)
+        return hexdigest(self, path, buffer_size)
+
+    monkeypatch.setattr(_InlineChecksum, "hexdigest", record_position)
+
+    engine = DownloadEngine(chunk_size=100_000, max_chunks_per_file=4)
+    result = await engine.download([file], str(tmp_path))
+
+    assert result.downloaded == 1
+    # Nothing is left to read back once the file is complete
+    assert positions == [len(content)]
+
+
+def test_is_retryable():
+    request = httpx.Request("GET", "https://example.com")
+
+    def status_error(status_code):
+        response = httpx.Response(status_code, request=request)
+        return httpx.HTTPStatusError("error", request=request, response=response)
+
+    assert is_retryable(status_error(503))
+    assert is_retryable(status_error(429))
+    assert not is_retryable(status_error(404))
+    assert is_retryable(httpx.ReadTimeout("timeout"))
+    assert is_retryable(DownloadError("truncated"))
+    assert not is_retryable(PermissionError())
+
+
+async def test_download_engine_retries_transient_errors(granule_server, tmp_path):
+    granule_server.files = {"file.h5": b"data"}
+    granule_server.failures = {"file.h5": [503, 429]}
+
+    engine = DownloadEngine(retry_delay=0.01)
+    result = await engine.download([granule_server.url("file.h5")], str(tmp_path))
+
+    assert (tmp_path / "file.h5").read_bytes() == b"data"
+    assert result.failed == {}
+    assert len(granule_server.requests) == 3
+
+
+async def test_download_engine_retry_resumes_transfer(granule_server, tmp_path):
+    content = os.urandom(1_000_000)
+    granule_server.files = {"large.h5": content}
+    granule_server.truncate = {"large.h5": 550_000}
+
+    engine = DownloadEngine(chunk_size=100_000, max_chunks_per_file=1, retry_delay=0)
+    (path,) = await engine.download([granule_server.url("large.h5")], str(tmp_path))
+
+    assert open(path, "rb").read() == content
+    assert granule_server.requests[-1][1]["Range"] == "bytes=550000-"
+
+
+async def test_download_engine_partial_result(granule_server, tmp_path):
+    granule_server.files = {"a.h5": b"a", "b.h5": b"b"}
+    granule_server.failures = {"b.h5": [500] * 3}
+    urls = [granule_server.url(name) for name in ("a.h5", "missing.h5", "b.h5")]
+
+    engine = DownloadEngine(retries=2, retry_delay=0, allow_failures=True)
+    result = await engine.download(urls, str(tmp_path))
+
+    assert result == [str(tmp_path / "a.h5")]
+    assert result.paths == {urls[0]: str(tmp_path / "a.h5")}
+    assert sorted(result.failed) == sorted(urls[1:])
+    assert "404" in result.failed[urls[1]]
+    assert "500" in result.failed[urls[2]]
+    assert set(result.timings) == set(urls)
+    # Not found is not retried
+    assert [name for name, _ in granule_server.requests].count("missing.h5") == 1
+
+
+async def test_download_engine_raises_with_partial_result(granule_server, tmp_path):
+    granule_server.files = {"a.h5": b"a"}
+    urls = [granule_server.url("a.h5"), granule_server.url("missing.h5")]
+
+    with pytest.raises(DownloadError, match="Failed to download 1 of 2") as error:
+        await DownloadEngine().download(urls, str(tmp_path))
+
+    assert error.value.result == [str(tmp_path / "a.h5")]
+    assert list(error.value.result.failed) == [urls[1]]
+
+
+async def test_download_engine_adaptive_concurrency(granule_server, tmp_path, caplog):
+    granule_server.files = {f"file{i}.h5": b"data" for i in range(8)}
+    granule_server.failures = {"file0.h5": [429]}
+    urls = [granule_server.url(name) for name in granule_server.files]
+
+    caplog.set_level("INFO", logger="prefect_earthdata.downloads")
+
+    engine = DownloadEngine(max_concurrency=8, adaptive_concurrency=True, retry_delay=0)
+    result = await engine.download(urls, str(tmp_path))
+
+    assert len(result) == 8
+    assert "Download concurrency 4 -> 2, throttled by 127.0.0.1" in caplog.text
+    assert granule_server.max_active <= 4
+
+
+async def test_download_engine_bandwidth_limit(granule_server, tmp_path):
+    granule_server.files = {"a.h5": os.urandom(250_000), "b.h5": os.urandom(250_000)}
+    urls = [granule_server.url(name) for name in granule_server.files]
+
+    bandwidth = BandwidthLimiter(rate=1_000_000, burst=100_000)
+    start = time.monotonic()
+    await DownloadEngine(bandwidth=bandwidth).download(urls, str(tmp_path))
+
+    assert time.monotonic() - start > 0.35
+
+
+async def test_download_engine_streams_to_s3(granule_server, s3_storage_options):
+    import s3fs
+
+    large = os.urandom(6 * 1024 * 1024)
+    granule_server.files = {"small.h5": b"data", "large.h5": large}
+    urls = [granule_server.url(name) for name in granule_server.files]
+
+    engine = DownloadEngine(
+        part_size=5 * 1024 * 1024, storage_options=s3_storage_options
+    )
+    result = await engine.download(urls, "s3://bucket/granules")
+
+    assert result == ["s3://bucket/granules/small.h5", "s3://bucket/granules/large.h5"]
+    fs = s3fs.S3FileSystem(**s3_storage_options)
+    assert fs.cat("bucket/granules/small.h5") == b"data"
+    assert fs.cat("bucket/granules/large.h5") == large
+    # Uploaded in two parts
+    assert fs.info("bucket/granules/large.h5")["ETag"].endswith('-2"')
+
+    granule_server.files["large.h5"] = b"data"
+    files = [GranuleFile(url, size=4) for url in urls]
+    result = await engine.download(files, "s3://bucket/granules")
+
+    assert (result.skipped, result.corrupted) == (1, 1)
+    assert fs.cat("bucket/granules/large.h5") == b"data"
+
+
+async def test_download_engine_streaming_failure(granule_server, s3_storage_options):
+    import s3fs
+
+    granule_server.files = {"file.h5": os.urandom(1_000)}
+    file = GranuleFile(granule_server.url("file.h5"), size=2_000)
+
+    engine = DownloadEngine(storage_options=s3_storage_options, retries=0)
+    with pytest.raises(DownloadError, match="expected 2000"):
+        await engine.download([file], "s3://bucket/granules")
+
+    fs = s3fs.S3FileSystem(**s3_storage_options)
+    assert not fs.exists("bucket/granules/file.h5")
+    assert "Uploads" not in fs.call_s3("list_multipart_uploads", Bucket="bucket")
+
+
+async def test_download_engine_streaming_checksum(granule_server, s3_storage_options):
+    import s3fs
+
+    content = os.urandom(1_000)
+    granule_server.files = {"file.h5": content}
+    granule_server.corrupt = {"file.h5": 1}
+    file = GranuleFile(
+        granule_server.url("file.h5"),
+        checksum=hashlib.md5(content).hexdigest(),
+        checksum_algorithm="MD5",
+    )
+
+    engine = DownloadEngine(storage_options=s3_storage_options, retry_delay=0)
+    await engine.download([file], "s3://bucket/granules")
+
+    fs = s3fs.S3FileSystem(**s3_storage_options)
+    assert fs.cat("bucket/granules/file.h5") == content
+    assert len(granule_server.requests) == 2
+
+
+async def test_download_engine_journal(granule_server, tmp_path):
+    granule_server.files = {"a.h5": b"a", "b.h5": b"b"}
+    urls = [granule_server.url(name) for name in ("a.h5", "b.h5", "missing.h5")]
+    journal = DownloadJournal(str(tmp_path / "journal.sqlite"))
+    engine = DownloadEngine(journal=journal, allow_failures=True)
+
+    await engine.download(urls, str(tmp_path / "out"))
+
+    entries = journal.load(str(tmp_path / "out"))
+    assert entries[urls[0]].state == "completed"
+    assert entries[urls[0]].size == 1
+    assert entries[urls[2]].state == "failed"
+
+    # Completed files are not even looked for
+    os.remove(tmp_path / "out" / "a.h5")
+    granule_server.files["missing.h5"] = b"c"
+    granule_server.requests.clear()
+    result = await engine.download(urls, str(tmp_path / "out"))
+
+    assert result == [str(tmp_path / "out" / name) for name in granule_server.files]
+    assert result.skipped == 2
+    assert [name for name, _ in granule_server.requests] == ["missing.h5"]
+
+
+def test_schedule():
+    files = [
+        GranuleFile("a", approximate_size=20, start_time="2020-01-02T00:00:00Z"),
+        GranuleFile("b", start_time="2020-01-01T00:00:00.5Z"),
+        GranuleFile("c", approximate_size=10, start_time="2020-01-01T00:00:00Z"),
+        GranuleFile("d", approximate_size=30),
+    ]
+
+    assert schedule(files) == [0, 1, 2, 3]
+    assert schedule(files, "smallest") == [2, 0, 3, 1]
+    assert schedule(files, "largest") == [3, 0, 2, 1]
+    assert schedule(files, "time") == [2, 1, 0, 3]
+    assert schedule(files, lambda file: file.url != "b") == [1, 0, 2, 3]
+    with pytest.raises(ValueError):
+        schedule(files, "random")
+
+
+async def test_download_engine_order(granule_server, tmp_path):
+    granule_server.files = {f"{size}.h5": os.urandom(size) for size in (30, 10, 20)}
+    files = [
+        GranuleFile(granule_server.url(name), approximate_size=len(content))
+        for name, content in granule_server.files.items()
+    ]
+
+    engine = DownloadEngine(max_concurrency=1, order="smallest")
+    result = await engine.download(files, str(tmp_path))
+
+    assert result == [str(tmp_path / name) for name in granule_server.files]
+    assert [name for name, _ in granule_server.requests] == ["10.h5", "20.h5", "30.h5"]
+
+
+async def test_download_engine_stream(granule_server, tmp_path):
+    granule_server.files = {f"file{i}.h5": b"data" for i in range(6)}
+    produced = []
+
+    async def files():
+        for name in granule_server.files:
+            produced.append(name)
+            yield granule_server.url(name)
+
+    engine = DownloadEngine(max_concurrency=2)
+    result = await engine.download_stream(files(), str(tmp_path))
+
+    assert result == [str(tmp_path / name) for name in granule_server.files]
+    assert result.downloaded == 6
+    assert produced == list(granule_server.files)
+    assert granule_server.max_active <= 2
+
+
+async def test_download_engine_stream_backpressure(granule_server, tmp_path):
+    granule_server.files = {f"file{i}.h5": b"data" for i in range(4)}
+    granule_server.delay = 0.2
+    produced = []
+
+    async def files():
+        for name in granule_server.files:
+            produced.append(name)
+            yield granule_server.url(name)
+
+    engine = DownloadEngine(max_concurrency=2)
+    task = asyncio.ensure_future(engine.download_stream(files(), str(tmp_path)))
+    await asyncio.sleep(0.1)
+    # Only the files being downloaded were taken from the producer
+    assert len(produced) == 2
+    await task
+    assert len(produced) == 4
+
+
+async def test_download_engine_shares_concurrent_transfers(granule_server, tmp_path):
+    granule_server.files = {"a.h5": b"a" * 1_000}
+    granule_server.delay = 0.2
+    url = granule_server.url("a.h5")
+
+    first, second, duplicate = await asyncio.gather(
+        DownloadEngine().download([url], str(tmp_path / "first")),
+        DownloadEngine().download([url], str(tmp_path / "second")),
+        DownloadEngine().download([url, url], str(tmp_path / "first")),
+    )
+
+    assert len(granule_server.requests) == 1
+    assert (tmp_path / "second" / "a.h5").read_bytes() == b"a" * 1_000
+    assert first.downloaded + second.downloaded + duplicate.downloaded == 1
+    assert first.shared + second.shared + duplicate.shared == 3
+    assert duplicate == [str(tmp_path / "first" / "a.h5")] * 2
+
+
+def test_download_engine_shares_transfers_across_threads(granule_server, tmp_path):
+    granule_server.files = {"a.h5": b"a"}
+    granule_server.delay = 0.2
+    url = granule_server.url("a.h5")
+
+    def download(directory):
+        return asyncio.run(DownloadEngine().download([url], str(tmp_path / directory)))
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        results = list(executor.map(download, ["first", "second"]))
+
+    assert len(granule_server.requests) == 1
+    assert sorted(result.shared for result in results) == [0, 1]
+
+
+async def test_download_engine_shared_transfer_failure(granule_server, tmp_path):
+    granule_server.files = {"a.h5": b"a"}
+    granule_server.failures = {"a.h5": [404]}
+    granule_server.delay = 0.2
+    url = granule_server.url("a.h5")
+
+    engine = DownloadEngine(retries=0, allow_failures=True)
+    first, second = await asyncio.gather(
+        engine.download([url], str(tmp_path / "first")),
+        engine.download([url], str(tmp_path / "second")),
+    )
+
+    # The download waiting for the failed one tried on its own
+    assert len(granule_server.requests) == 2
+    assert sorted([len(first.failed), len(second.failed)]) == [0, 1]
+
+
+async def test_download_engine_waits_for_lease_of_other_process(
+    granule_server, tmp_path
+):
+    granule_server.files = {"a.h5": b"a"}
+    # Stands in for another process downloading the same file
+    lease = FileLease(str(tmp_path / "a.h5.lock"))
+    await lease.acquire()
+
+    async def download_elsewhere():
+        await asyncio.sleep(0.3)
+        (tmp_path / "a.h5").write_bytes(b"a")
+        await lease.__aexit__(None, None, None)
+
+    downloading = asyncio.ensure_future(download_elsewhere())
+    result = await DownloadEngine().download(
+        [granule_server.url("a.h5")], str(tmp_path)
+    )
+    await downloading
+
+    assert result == [str(tmp_path / "a.h5")]
+    assert result.shared == 1
+    assert granule_server.requests == []
+    assert os.listdir(tmp_path) == ["a.h5"]
+
+
+async def test_download_engine_checks_free_space(granule_server, tmp_path, monkeypatch):
+    granule_server.files = {"a.h5": b"a" * 1_000, "b.h5": b"b" * 1_000}
+    (tmp_path / "a.h5").write_bytes(b"a" * 1_000)
+    files = [
+        GranuleFile(granule_server.url(name), size=1_000)
+        for name in granule_server.files
+    ]
+    monkeypatch.setattr(downloads, "free_space", lambda path: 1_500)
+
+    # The file already present needs no space
+    result = await DownloadEngine().download(files, str(tmp_path))
+    assert result.skipped == 1
+
+    os.remove(tmp_path / "b.h5")
+    granule_server.requests.clear()
+    with pytest.raises(InsufficientSpaceError, match="600 bytes short"):
+        await DownloadEngine(min_free_space=1_100).download(files, str(tmp_path))
+    assert granule_server.requests == []
+
+
+async def test_download_engine_evicts_cache_for_space(
+    granule_server, tmp_path, monkeypatch
+):
+    cache = GranuleCache(str(tmp_path / "cache"), max_bytes=10_000)
+    (tmp_path / "cached.h5").write_bytes(b"c" * 2_000)
+    cache.add("G1/1/cached.h5", str(tmp_path / "cached.h5"))
+    os.remove(tmp_path / "cached.h5")
+    granule_server.files = {"a.h5": b"a" * 1_000}
+    file = GranuleFile(granule_server.url("a.h5"), size=1_000)
+    monkeypatch.setattr(
+        downloads, "free_space", lambda path: 500 + (0 if cache.size else 2_000)
+    )
+
+    with pytest.raises(InsufficientSpaceError):
+        await DownloadEngine(cache=cache).download([file], str(tmp_path / "out"))
+
+    engine = DownloadEngine(cache=cache, evict_cache=True)
+    result = await engine.download([file], str(tmp_path / "out"))
+
+    assert result.downloaded == 1
+    assert cache.size == 0
+
+
+async def test_download_engine_space_check_counts_cached_files(
+    granule_server, tmp_path, monkeypatch
+):
+    cache = GranuleCache(str(tmp_path / "cache"), max_bytes=10_000)
+    (tmp_path / "cached.h5").write_bytes(b"a" * 1_000)
+    cache.add("G1/1/a.h5", str(tmp_path / "cached.h5"))
+    granule_server.files = {"a.h5": b"a" * 1_000, "b.h5": b"b" * 1_000}
+    files = [
+        GranuleFile(
+            granule_server.url("a.h5"), size=1_000, concept_id="G1", revision_id=1
+        ),
+        GranuleFile(granule_server.url("b.h5"), size=1_000),
+    ]
+    monkeypatch.setattr(downloads, "free_space", lambda path: 1_500)
+
+    # The cached file is linked, so that only the other one needs space
+    engine = DownloadEngine(cache=cache, min_free_space=100)
+    result = await engine.download(files, str(tmp_path / "out"))
+
+    assert result.cached == 1 and result.downloaded == 1
+    assert engine._admitted == {}
+
+
+async def test_download_engine_pauses_when_short_of_space(
+    granule_server, tmp_path, monkeypatch, caplog
+):
+    caplog.set_level("INFO", logger="prefect_earthdata.downloads")
+    granule_server.files = {"a.h5": b"a" * 1_000}
+    file = GranuleFile(granule_server.url("a.h5"), size=1_000)
+    free = iter([10_000, 0, 0, 10_000])
+    monkeypatch.setattr(downloads, "free_space", lambda path: next(free))
+    monkeypatch.setattr(downloads, "SPACE_POLL_INTERVAL", 0.01)
+
+    result = await DownloadEngine().download([file], str(tmp_path))
+
+    assert result.downloaded == 1
+    assert "Pausing the download" in caplog.text
+
+    monkeypatch.setattr(downloads, "free_space", lambda path: 0)
+    os.remove(tmp_path / "a.h5")
+    engine = DownloadEngine(space_timeout=0.05, allow_failures=True)
+    result = await engine.download_stream(_aiter([file]), str(tmp_path))
+    assert "Not enough free space" in result.failed[file.url]
+    # Not retried
+    assert len(granule_server.requests) == 1
+
+
+async def test_download_engine_reserves_space_of_concurrent_transfers(
+    granule_server, tmp_path, monkeypatch
+):
+    granule_server.files = {"a.h5": b"a" * 1_000, "b.h5": b"b" * 1_000}
+    files = [
+        GranuleFile(granule_server.url(name), size=1_000)
+        for name in granule_server.files
+    ]
+    used = []
+
+    def free_space(path):
+        used.append(sum(entry.stat().st_size for entry in os.scandir(tmp_path)))
+        return 2_500 - used[-1]
+
+    monkeypatch.setattr(downloads, "free_space", free_space)
+    monkeypatch.setattr(downloads, "SPACE_POLL_INTERVAL", 0.01)
+
+    # Both would fit on their own, but not together above the watermark
+    engine = DownloadEngine(min_free_space=600, space_timeout=0.2, allow_failures=True)
+    result = await engine.download_stream(_aiter(files), str(tmp_path))
+
+    assert result.downloaded == 1
+    assert "Not enough free space" in list(result.failed.values())[0]
+    assert max(used) <= 1_000
+    assert engine._admitted == {}
+
+
+async def test_download_engine_space_check_skips_journaled_files(
+    granule_server, tmp_path, monkeypatch
+):
+    granule_server.files = {"a.h5": b"a" * 1_000, "b.h5": b"b" * 1_000}
+    files = [
+        GranuleFile(granule_server.url(name), size=1_000)
+        for name in granule_server.files
+    ]
+    journal = DownloadJournal(str(tmp_path / "journal.jsonl"))
+    await DownloadEngine(journal=journal).download(files[:1], str(tmp_path / "out"))
+    checked = []
+    missing_bytes = downloads._missing_bytes
+
+    def _missing_bytes(files, local_path):
+        checked.append([file.url for file in files])
+        return missing_bytes(files, local_path)
+
+    monkeypatch.setattr(downloads, "_missing_bytes", _missing_bytes)
+    monkeypatch.setattr(downloads, "free_space", lambda path: 1_500)
+
+    engine = DownloadEngine(journal=journal, min_free_space=100)
+    result = await engine.download(files, str(tmp_path / "out"))
+
+    assert result.skipped == 1 and result.downloaded == 1
+    # The file the journal records as completed is neither counted, so that the
+    # check before the transfers has no need to look for the files, nor admitted
+    assert checked == [[files[1].url]]
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
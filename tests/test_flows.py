@@ -0,0 +1,40 @@
+import pytest
+
+from prefect_earthdata.downloads import DownloadError
+from prefect_earthdata.flows import download_batches
+
+
+def test_download_batches(earthdata_credentials_mock, granule_server, tmp_path):
+    granule_server.files = {f"file{i}.h5": b"data" for i in range(6)}
+    urls = [granule_server.url(name) for name in granule_server.files]
+
+    files = download_batches(earthdata_credentials_mock, urls, str(tmp_path), batches=3)
+
+    assert files == [str(tmp_path / name) for name in granule_server.files]
+    assert files.downloaded == 6
+
+
+def test_download_batches_failures(
+    earthdata_credentials_mock, granule_server, tmp_path
+):
+    granule_server.files = {"a.h5": b"a"}
+    urls = [granule_server.url("missing.h5"), granule_server.url("a.h5")]
+
+    with pytest.raises(DownloadError, match="Failed to download 1 of 2 files"):
+        download_batches(earthdata_credentials_mock, urls, str(tmp_path))
+
+    files = download_batches(
+        earthdata_credentials_mock, urls, str(tmp_path), allow_failures=True
+    )
+    assert files == [str(tmp_path / "a.h5")]
+    assert list(files.failed) == [urls[0]]
+
+
+def test_download_batches_rejects_flow_arguments(earthdata_credentials_mock, tmp_path):
+    with pytest.raises(ValueError, match="allow_failures"):
+        download_batches(
+            earthdata_credentials_mock,
+            ["https://host/a.h5"],
+            str(tmp_path),
+            download_options={"allow_failures": True},
+        )
@@ -0,0 +1,190 @@
+import copy
+import hashlib
+import json
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+from earthaccess.results import DataGranule
+from importlib_resources import files
+
+from prefect_earthdata.granules import (
+    GranuleFile,
+    checksum_hasher,
+    granule_files,
+    local_filename,
+    partition_granules,
+    search_granule_pages,
+)
+
+URL = "https://data.nsidc.earthdatacloud.nasa.gov/nsidc-cumulus-prod-protected/ATLAS/ATL08/005/2018/11/05/ATL08_20181105083647_05760107_005_01.h5"  # noqa E501
+
+
+def load_granule():
+    with files("tests.data").joinpath("earthdata_search_response.json").open(
+        "r"
+    ) as search_data_response_file:
+        search_data_response = json.load(search_data_response_file)
+    return DataGranule(search_data_response["items"][0], cloud_hosted=True)
+
+
+def test_local_filename():
+    assert local_filename("https://host/path/file.h5?token=1") == "file.h5"
+    assert local_filename("https://opendap.host/path/file.nc.html") == "file.nc"
+
+
+def test_granule_files_approximate_size():
+    assert granule_files(load_granule()) == [
+        GranuleFile(
+            URL,
+            approximate_size=int(14.847737312316895 * 1024**2),
+            concept_id="G2166695839-NSIDC_CPRD",
+            revision_id=1,
+            start_time="2018-11-05T08:38:40.137Z",
+        )
+    ]
+
+
+def test_granule_files_size_and_checksum():
+    granule = load_granule()
+    granule["umm"]["DataGranule"]["ArchiveAndDistributionInformation"] = [
+        {
+            "Name": "ATL08_20181105083647_05760107_005_01.h5",
+            "SizeInBytes": 15568720,
+            "Checksum": {"Value": "abc", "Algorithm": "MD5"},
+        },
+        {"Name": "ATL08_20181105083647_05760107_005_01.iso.xml", "SizeInBytes": 1},
+    ]
+
+    assert granule_files([granule]) == [
+        GranuleFile(
+            URL,
+            15568720,
+            15568720,
+            "abc",
+            "MD5",
+            "G2166695839-NSIDC_CPRD",
+            1,
+            "2018-11-05T08:38:40.137Z",
+        )
+    ]
+
+
+def test_granule_files_urls():
+    assert granule_files(["https://host/file.h5"]) == [
+        GranuleFile("https://host/file.h5")
+    ]
+
+
+def test_granule_files_rejects_non_http_urls():
+    with pytest.raises(ValueError, match="Only HTTP"):
+        granule_files(["s3://bucket/file.h5"])
+
+
+def test_checksum_hasher():
+    sha256 = hashlib.sha256(b"data").hexdigest()
+    hasher = checksum_hasher("SHA-2", sha256)
+    hasher.update(b"data")
+    assert hasher.hexdigest() == sha256
+
+    hasher = checksum_hasher("Adler-32")
+    hasher.update(b"data")
+    assert hasher.hexdigest() == "0400019b"
+
+    assert checksum_hasher("VMAC") is None
+
+
+def granule_with_size(name, size):
+    granule = copy.deepcopy(load_granule())
+    information = granule["umm"]["DataGranule"]["ArchiveAndDistributionInformation"]
+    information[0].update(Name=name, SizeInBytes=size)
+    for related_url in granule["umm"]["RelatedUrls"]:
+        related_url["URL"] = related_url["URL"].replace(local_filename(URL), name)
+    return DataGranule(granule, cloud_hosted=True)
+
+
+def test_partition_granules():
+    granules = [
+        granule_with_size(f"{size}.h5", size) for size in (10, 50, 20, 30, 40, 50)
+    ]
+
+    batches = partition_granules(granules, batches=2)
+
+    sizes = [[granule_files(g)[0].size for g in batch] for batch in batches]
+    assert sizes == [[10, 50, 40], [20, 30, 50]]
+    assert len(partition_granules(granules, batch_bytes=100)) == 2
+    assert len(partition_granules(granules, batches=10)) == 6
+
+
+def test_partition_granules_unknown_sizes():
+    urls = [f"https://host/{i}.h5" for i in range(5)]
+
+    batches = partition_granules(urls, batches=2)
+
+    assert sorted(map(len, batches)) == [2, 3]
+    assert sorted(sum(batches, [])) == urls
+    with pytest.raises(ValueError):
+        partition_granules(urls)
+    with pytest.raises(ValueError, match="batch_bytes must be positive"):
+        partition_granules(urls, batch_bytes=0)
+    with pytest.raises(ValueError, match="batches must be positive"):
+        partition_granules(urls, batches=0)
+
+
+def test_search_granule_pages(earthdata_credentials_mock, mock_earthdata_responses):
+    item = load_granule()
+    url = "https://cmr.earthdata.nasa.gov/search/granules.umm_json?short_name=TEST"
+    mock_earthdata_responses.get(
+        url,
+        [
+            {"json": {"items": [item] * 3}, "headers": {"CMR-Search-After": "1"}},
+            {"json": {"items": [item]}, "headers": {"CMR-Search-After": "2"}},
+        ],
+    )
+    auth = earthdata_credentials_mock.login()
+
+    pages = list(search_granule_pages(auth, count=4, page_size=3, short_name="TEST"))
+
+    assert [len(page) for page in pages] == [3, 1]
+    assert all(isinstance(granule, DataGranule) for granule in pages[0])
+    requests = [
+        request
+        for request in mock_earthdata_responses.request_history
+        if request.path.endswith("granules.umm_json")
+    ]
+    assert [request.qs["page_size"] for request in requests] == [["3"], ["1"]]
+    assert requests[1].headers["CMR-Search-After"] == "1"
+
+
+def test_search_granule_pages_parameters(
+    earthdata_credentials_mock, mock_earthdata_responses
+):
+    item = load_granule()
+    on_premises = copy.deepcopy(dict(item))
+    del on_premises["umm"]["RelatedUrls"]
+    mock_earthdata_responses.get(
+        "https://cmr.earthdata.nasa.gov/search/granules.umm_json",
+        json={"items": [item, on_premises]},
+    )
+    auth = earthdata_credentials_mock.login()
+
+    (page,) = search_granule_pages(
+        auth,
+        short_name="ATL08",
+        temporal=("2019-01-01", "2019-02-01"),
+        granule_name="ATL08_2018*",
+    )
+
+    assert [granule.cloud_hosted for granule in page] == [True, False]
+    (request,) = [
+        request
+        for request in mock_earthdata_responses.request_history
+        if request.path.endswith("granules.umm_json")
+    ]
+    assert request.headers["Authorization"].startswith("Bearer ")
+    assert parse_qsl(urlsplit(request.url).query) == [
+        ("short_name", "ATL08"),
+        ("temporal[]", "2019-01-01T00:00:00Z,2019-02-01T00:00:00Z"),
+        ("readable_granule_name", "ATL08_2018*"),
+        ("options[readable_granule_name][pattern]", "true"),
+        ("page_size", "2000"),
+    ]
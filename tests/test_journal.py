@@ -0,0 +1,45 @@
+import pytest
+
+from prefect_earthdata.granules import GranuleFile
+from prefect_earthdata.journal import DownloadJournal, JournalEntry
+
+
+@pytest.mark.parametrize("name", ["journal.sqlite", "journal.jsonl"])
+def test_journal(tmp_path, name):
+    journal = DownloadJournal(str(tmp_path / name))
+    journal.record(JournalEntry("https://a/1.h5", "/data", "failed", reason="404"))
+    journal.record(
+        JournalEntry("https://a/1.h5", "/data", "completed", "/data/1.h5", 4)
+    )
+    journal.record(JournalEntry("https://a/2.h5", "/other", "completed"))
+
+    entries = DownloadJournal(str(tmp_path / name)).load("/data")
+
+    assert list(entries) == ["https://a/1.h5"]
+    entry = entries["https://a/1.h5"]
+    assert (entry.state, entry.path, entry.size) == ("completed", "/data/1.h5", 4)
+    assert entry.timestamp > 0
+
+
+def test_journal_ignores_torn_lines(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = DownloadJournal(str(path))
+    journal.record(JournalEntry("https://a/1.h5", "/data", "completed"))
+    with open(path, "a") as f:
+        f.write('{"url": "https://a/2.h5", "dest')
+
+    assert list(journal.load("/data")) == ["https://a/1.h5"]
+
+    # Records following the torn line are kept
+    journal.record(JournalEntry("https://a/3.h5", "/data", "completed"))
+    assert list(journal.load("/data")) == ["https://a/1.h5", "https://a/3.h5"]
+
+
+def test_journal_entry_matches():
+    entry = JournalEntry("u", "/data", "completed", size=4, checksum="ABCD")
+
+    assert entry.matches(GranuleFile("u"))
+    assert entry.matches(GranuleFile("u", size=4, checksum="abcd"))
+    assert not entry.matches(GranuleFile("u", size=5))
+    assert not entry.matches(GranuleFile("u", checksum="0000"))
+    assert not entry._replace(state="failed").matches(GranuleFile("u"))
@@ -0,0 +1,119 @@
+import asyncio
+import gc
+
+import pytest
+
+from prefect_earthdata import limits
+from prefect_earthdata.limits import AdaptiveConcurrency, BandwidthLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(limits, "monotonic", lambda: now[0])
+    return now
+
+
+async def test_adaptive_concurrency_grows_while_throughput_rises(clock):
+    concurrency = AdaptiveConcurrency(maximum=10, initial=2)
+    for _ in range(2):
+        await concurrency.__aenter__()
+
+    clock[0] = 1.0
+    concurrency.record(100)
+    assert concurrency.limit == 3
+
+    await concurrency.__aenter__()
+    clock[0] = 2.0
+    concurrency.record(200)
+    assert concurrency.limit == 4
+    assert concurrency.throughput == 200
+
+    # Not saturated, concurrency is not the bottleneck
+    clock[0] = 3.0
+    concurrency.record(300)
+    assert concurrency.limit == 4
+    assert [limit for _, limit, _ in concurrency.history] == [2, 3, 4]
+
+
+async def test_adaptive_concurrency_reverts_useless_increase(clock):
+    concurrency = AdaptiveConcurrency(maximum=10, initial=1)
+    await concurrency.__aenter__()
+
+    clock[0] = 1.0
+    concurrency.record(100)
+    assert concurrency.limit == 2
+
+    clock[0] = 2.0
+    concurrency.record(50)
+    assert concurrency.limit == 1
+
+
+def test_adaptive_concurrency_throttled(clock):
+    concurrency = AdaptiveConcurrency(maximum=16, initial=8, minimum=3)
+
+    concurrency.throttled()
+    assert concurrency.limit == 4
+    # At most once per interval
+    concurrency.throttled()
+    assert concurrency.limit == 4
+
+    clock[0] = 1.0
+    concurrency.throttled()
+    assert concurrency.limit == 3
+
+
+def test_adaptive_concurrency_latency_spike(clock):
+    concurrency = AdaptiveConcurrency(maximum=16, initial=8)
+
+    for _ in range(5):
+        concurrency.latency(0.1)
+    assert concurrency.limit == 8
+    concurrency.latency(1.0)
+    assert concurrency.limit == 4
+
+
+async def test_adaptive_concurrency_limits_slots():
+    concurrency = AdaptiveConcurrency(maximum=4, initial=1)
+    active = []
+
+    async def hold():
+        async with concurrency:
+            active.append(1)
+            await asyncio.sleep(0.01)
+            assert len(active) == 1
+            active.pop()
+
+    await asyncio.gather(*(hold() for _ in range(3)))
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(rate=100, burst=50)
+
+    assert bucket.reserve(50) == 0
+    assert bucket.reserve(25) == pytest.approx(0.25)
+    clock[0] = 0.5
+    # Refilled by 50 tokens, 25 of which paid the debt
+    assert bucket.reserve(25) == 0
+    clock[0] = 10.0
+    assert bucket.reserve(60) == pytest.approx(0.1)
+
+
+def test_bandwidth_limiter_per_host(clock):
+    limiter = BandwidthLimiter(rate=1000, per_host=100)
+
+    assert limiter.delay("a", 100) == 0
+    assert limiter.delay("a", 100) == pytest.approx(1.0)
+    assert limiter.delay("b", 100) == 0
+
+
+def test_bandwidth_limiter_shared():
+    limiter = BandwidthLimiter.shared(1000, per_host=100)
+
+    assert BandwidthLimiter.shared(1000, per_host=100) is limiter
+    assert BandwidthLimiter.shared(2000) is not limiter
+
+    # Limiters no longer in use are dropped
+    del limiter
+    gc.collect()
+    assert (1000, 100, None) not in BandwidthLimiter._shared
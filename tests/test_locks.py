@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from prefect_earthdata.locks import FileLease, LeaseLostError
+
+
+def test_file_lease(tmp_path):
+    path = str(tmp_path / "file.lock")
+    lease = FileLease(path)
+    other = FileLease(path)
+
+    assert lease.try_acquire()
+    assert not other.try_acquire()
+    assert lease.refresh()
+    assert not other.refresh()
+
+    other.release()
+    assert os.path.exists(path)
+    lease.release()
+    assert not os.path.exists(path)
+    assert other.try_acquire()
+
+
+def test_file_lease_reclaims_expired_lease(tmp_path):
+    path = str(tmp_path / "file.lock")
+    lease = FileLease(path, ttl=10)
+    assert lease.try_acquire()
+    os.utime(path, (time.time() - 20, time.time() - 20))
+
+    other = FileLease(path, ttl=10)
+    assert other.try_acquire()
+    # The lease was lost, releasing it leaves the new one alone
+    assert not lease.refresh()
+    lease.release()
+    assert other.refresh()
+    assert os.listdir(tmp_path) == ["file.lock"]
+
+
+@pytest.mark.skipif(os.name != "posix", reason="Processes are not checked")
+def test_file_lease_reclaims_lease_of_dead_process(tmp_path):
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    path = tmp_path / "file.lock"
+    path.write_text(
+        json.dumps({"token": "dead", "host": socket.gethostname(), "pid": process.pid})
+    )
+
+    assert FileLease(str(path)).try_acquire()
+
+
+async def test_file_lease_waits(tmp_path):
+    path = str(tmp_path / "file.lock")
+    holder = FileLease(path)
+    await holder.acquire()
+
+    async def release():
+        await asyncio.sleep(0.2)
+        await holder.__aexit__(None, None, None)
+
+    releasing = asyncio.ensure_future(release())
+    async with FileLease(path, poll_interval=0.05) as lease:
+        assert lease.waited
+        assert lease.refresh()
+    await releasing
+    assert not os.path.exists(path)
+
+
+async def test_file_lease_heartbeat(tmp_path):
+    path = str(tmp_path / "file.lock")
+    async with FileLease(path, ttl=0.3):
+        os.utime(path, (time.time() - 1, time.time() - 1))
+        await asyncio.sleep(0.2)
+        # Refreshed in the background
+        assert time.time() - os.stat(path).st_mtime < 0.3
+
+
+def test_file_lease_reclaim_keeps_fresh_lease(tmp_path, monkeypatch):
+    path = str(tmp_path / "file.lock")
+    stale = FileLease(path, ttl=10)
+    assert stale.try_acquire()
+    os.utime(path, (time.time() - 20, time.time() - 20))
+    fresh = FileLease(path, ttl=10)
+    is_stale = FileLease._is_stale
+
+    def reclaimed_meanwhile(self, owner, mtime):
+        # Another process reclaims the stale lease and takes a fresh one
+        os.remove(path)
+        assert fresh.try_acquire()
+        return is_stale(self, owner, mtime)
+
+    renamed = []
+    rename = os.rename
+    monkeypatch.setattr(FileLease, "_is_stale", reclaimed_meanwhile)
+    monkeypatch.setattr(
+        os, "rename", lambda *paths: renamed.append(paths) or rename(*paths)
+    )
+    assert not FileLease(path, ttl=10).try_acquire()
+    # The fresh lease is left in place, not moved away and back
+    assert renamed == []
+    assert fresh.refresh()
+    assert os.listdir(tmp_path) == ["file.lock"]
+
+
+async def test_file_lease_lost(tmp_path):
+    path = str(tmp_path / "file.lock")
+
+    with pytest.raises(LeaseLostError, match="Lost the lease"):
+        async with FileLease(path, ttl=0.3) as lease:
+            with open(path, "w") as f:
+                json.dump({"token": "other"}, f)
+            # The holder is cancelled instead of writing on
+            await asyncio.sleep(5)
+
+    assert lease.lost
+    with open(path) as f:
+        assert json.load(f) == {"token": "other"}
+    task = asyncio.current_task()
+    if hasattr(task, "cancelling"):
+        # The cancellation of the holder does not linger
+        assert not task.cancelling()
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import zlib
+
+import fsspec
+import pytest
+
+from prefect_earthdata.dmrpp import parse_dmrpp
+from prefect_earthdata.references import dmrpp_references, granule_references
+
+DMRPP = """<?xml version="1.0" encoding="UTF-8"?>
+<Dataset xmlns="http://xml.opendap.org/ns/DAP/4.0#"
+    xmlns:dmrpp="http://xml.opendap.org/dap/dmrpp/1.0.0#"
+    dapVersion="4.0" dmrVersion="1.0" name="granule.h5">
+    <Attribute name="title" type="String"><Value>Test granule</Value></Attribute>
+    <Group name="gt1l">
+        <Dimension name="delta_time" size="4"/>
+        <Float64 name="delta_time">
+            <Dim name="/gt1l/delta_time"/>
+            <Attribute name="units" type="String"><Value>seconds</Value></Attribute>
+            <dmrpp:chunks byteOrder="LE">
+                <dmrpp:chunk offset="0" nBytes="32"/>
+            </dmrpp:chunks>
+        </Float64>
+        <Float32 name="height">
+            <Dim name="/gt1l/delta_time"/>
+            <Dim size="3"/>
+            <Attribute name="_FillValue" type="Float32">
+                <Value>3.4e+38</Value>
+            </Attribute>
+            <Attribute name="valid_range" type="Float32">
+                <Value>0</Value><Value>100</Value>
+            </Attribute>
+            <dmrpp:chunks compressionType="shuffle deflate" byteOrder="BE">
+                <dmrpp:chunkDimensionSizes>2 3</dmrpp:chunkDimensionSizes>
+                <dmrpp:chunk
+                    offset="32" nBytes="{size}" chunkPositionInArray="[0,0]"/>
+                <dmrpp:chunk offset="0" nBytes="0" chunkPositionInArray="[2,0]"/>
+            </dmrpp:chunks>
+        </Float32>
+        <String name="name">
+            <dmrpp:chunks><dmrpp:chunk offset="0" nBytes="8"/></dmrpp:chunks>
+        </String>
+    </Group>
+</Dataset>
+"""
+
+
+def test_dmrpp_references():
+    tree = parse_dmrpp(DMRPP.format(size=10))
+
+    refs = dmrpp_references(tree, "https://example.com/granule.h5")
+
+    assert json.loads(refs[".zattrs"]) == {"title": "Test granule"}
+    assert json.loads(refs["gt1l/.zgroup"]) == {"zarr_format": 2}
+    assert json.loads(refs["gt1l/height/.zarray"]) == {
+        "chunks": [2, 3],
+        "compressor": None,
+        "dtype": ">f4",
+        "fill_value": pytest.approx(3.4e38),
+        "filters": [{"id": "shuffle", "elementsize": 4}, {"id": "zlib", "level": 1}],
+        "order": "C",
+        "shape": [4, 3],
+        "zarr_format": 2,
+    }
+    assert json.loads(refs["gt1l/height/.zattrs"]) == {
+        "valid_range": [0.0, 100.0],
+        "_ARRAY_DIMENSIONS": ["delta_time", "phony_dim_1"],
+    }
+    assert refs["gt1l/height/0.0"] == ["https://example.com/granule.h5", 32, 10]
+    assert "gt1l/height/1.0" not in refs
+    assert refs["gt1l/delta_time/0"] == ["https://example.com/granule.h5", 0, 32]
+    assert not any(key.startswith("gt1l/name") for key in refs)
+
+    tree = parse_dmrpp(DMRPP.format(size=10))
+    refs = dmrpp_references(tree, "https://example.com/granule.h5", ["gt1l/height"])
+    assert "gt1l/delta_time/.zarray" in refs
+
+
+@pytest.mark.parametrize(
+    "href, expected",
+    [
+        ("OPeNDAP_DMRpp_DATA_ACCESS_URL", "https://example.com/granule.h5"),
+        ("https://data.example.com/granule.h5", "https://data.example.com/granule.h5"),
+    ],
+)
+def test_dmrpp_references_data_href(href, expected):
+    tree = parse_dmrpp(DMRPP.format(size=10))
+    tree.getroot().set("{http://xml.opendap.org/dap/dmrpp/1.0.0#}href", href)
+
+    refs = dmrpp_references(tree, "https://example.com/granule.h5")
+
+    assert refs["gt1l/height/0.0"] == [expected, 32, 10]
+
+
+def test_granule_references(granule_server):
+    chunk = zlib.compress(b"\x01" * 24)
+    for name in ("a.h5", "b.h5"):
+        granule_server.files[name] = b"\x00" * 32 + chunk
+        granule_server.files[name + ".dmrpp"] = DMRPP.format(size=len(chunk)).encode()
+    urls = [granule_server.url(name) for name in ("a.h5", "b.h5")]
+
+    references = asyncio.run(granule_references(urls, ["/gt1l/height"]))
+
+    assert references["version"] == 1
+    assert "a.h5/gt1l/height/.zarray" in references["refs"]
+    assert "b.h5/gt1l/delta_time/.zarray" in references["refs"]
+    # The references resolve to the bytes of the chunks in the remote files
+    fs = fsspec.filesystem("reference", fo=references, remote_protocol="http")
+    assert fs.cat("b.h5/gt1l/height/0.0") == chunk
+    assert fs.cat("a.h5/gt1l/delta_time/0") == b"\x00" * 32
@@ -0,0 +1,193 @@
+import asyncio
+
+import pytest
+
+from prefect_earthdata.cache import BlockCache
+from prefect_earthdata.granules import GranuleFile
+from prefect_earthdata.remote import open_files, read_ranges
+
+CONTENT = bytes(i % 251 for i in range(2**20))
+
+
+@pytest.mark.parametrize("cache_type", ["blockcache", "background", "readahead"])
+def test_open_files_reads_blocks(granule_server, cache_type):
+    granule_server.files["granule.h5"] = CONTENT
+
+    (f,) = asyncio.run(
+        open_files(
+            [GranuleFile(granule_server.url("granule.h5"))],
+            block_size=2**18,
+            cache_type=cache_type,
+        )
+    )
+    with f:
+        data = b"".join(iter(lambda: f.read(1000), b""))
+
+    assert data == CONTENT
+    ranges = [
+        headers.get("Range")
+        for _, headers in granule_server.requests
+        if "Range" in headers
+    ]
+    # A thousand small reads turn into a few large requests
+    assert 4 <= len(ranges) <= 5
+
+
+def test_open_files_known_size(granule_server):
+    granule_server.files["granule.h5"] = CONTENT
+
+    (f,) = asyncio.run(
+        open_files(
+            [GranuleFile(granule_server.url("granule.h5"), size=len(CONTENT))],
+            headers={"Authorization": "Bearer token"},
+            block_size=2**16,
+            cache_type="blockcache",
+            max_blocks=2,
+        )
+    )
+    with f:
+        f.seek(2**19)
+        assert f.read(10) == CONTENT[2**19 : 2**19 + 10]
+        assert f.cache.maxblocks == 2
+
+    # The size published in CMR saves asking for it
+    assert [
+        (headers.get("Range"), headers.get("Authorization"))
+        for _, headers in granule_server.requests
+    ] == [("bytes=524288-589823", "Bearer token")]
+
+
+@pytest.mark.parametrize(
+    "max_gap, expected",
+    [
+        (0, ["bytes=0-149", "bytes=200-299", "bytes=500000-500009"]),
+        (1000, ["bytes=0-299", "bytes=500000-500009"]),
+    ],
+)
+def test_read_ranges(granule_server, max_gap, expected):
+    granule_server.files["granule.h5"] = CONTENT
+    (f,) = asyncio.run(
+        open_files(
+            [GranuleFile(granule_server.url("granule.h5"), size=len(CONTENT))],
+            cache_type="none",
+        )
+    )
+    ranges = [(500000, 10), (200, 100), (0, 100), (50, 100), (10, 0)]
+
+    with f:
+        data = read_ranges(f, ranges, max_gap=max_gap)
+
+    assert data == [
+        CONTENT[offset : offset + size] if size else b"" for offset, size in ranges
+    ]
+    assert sorted(headers["Range"] for _, headers in granule_server.requests) == (
+        expected
+    )
+
+
+def test_read_ranges_past_end_of_file(granule_server):
+    granule_server.files["granule.h5"] = CONTENT
+    (f,) = asyncio.run(
+        open_files(
+            [GranuleFile(granule_server.url("granule.h5"), size=len(CONTENT))],
+            cache_type="none",
+        )
+    )
+    ranges = [(len(CONTENT) - 10, 100), (len(CONTENT) + 1000, 10), (0, 10)]
+
+    with f:
+        data = read_ranges(f, ranges, max_gap=0)
+
+    assert data == [CONTENT[-10:], b"", CONTENT[:10]]
+
+
+def test_open_files_block_cache(granule_server, tmp_path):
+    granule_server.files["granule.h5"] = CONTENT
+    cache = BlockCache(str(tmp_path / "cache"), max_bytes=2**22, block_size=2**18)
+    files = [GranuleFile(granule_server.url("granule.h5"), revision_id=1)]
+
+    def read_all():
+        (f,) = asyncio.run(open_files(files, block_cache=cache, max_blocks=1))
+        with f:
+            return b"".join(iter(lambda: f.read(1000), b""))
+
+    assert read_all() == CONTENT
+    fetched = [headers for _, headers in granule_server.requests if "Range" in headers]
+    assert len(fetched) == 4
+    assert cache.stats["misses"] == 4
+
+    # Served from the local disk on the second pass
+    assert read_all() == CONTENT
+    assert [
+        headers for _, headers in granule_server.requests if "Range" in headers
+    ] == fetched
+    assert cache.stats == {
+        "hits": 4,
+        "misses": 4,
+        "hit_bytes": len(CONTENT),
+        "miss_bytes": len(CONTENT),
+    }
+
+    # A new revision of the granule is fetched again
+    files = [GranuleFile(granule_server.url("granule.h5"), revision_id=2)]
+    assert read_all() == CONTENT
+    assert cache.stats["misses"] == 8
+
+
+def test_read_ranges_through_block_cache(granule_server, tmp_path):
+    granule_server.files["granule.h5"] = CONTENT
+    cache = BlockCache(str(tmp_path / "cache"), max_bytes=2**22, block_size=2**16)
+    files = [GranuleFile(granule_server.url("granule.h5"), revision_id=1)]
+    ranges = [(2**16 + 10, 100), (0, 10), (5 * 2**16 - 5, 10), (2**20 - 1, 10)]
+
+    (f,) = asyncio.run(open_files(files, block_cache=cache, max_blocks=2))
+    with f:
+        data = read_ranges(f, ranges, max_gap=2**16)
+
+    assert data == [CONTENT[offset : offset + size] for offset, size in ranges]
+    # Missing blocks are merged into requests, then kept on the local disk
+    fetched = sorted(
+        headers["Range"] for _, headers in granule_server.requests if "Range" in headers
+    )
+    assert fetched == ["bytes=0-131071", "bytes=262144-393215", "bytes=983040-1048575"]
+    assert cache.stats["misses"] == 5
+
+    (f,) = asyncio.run(open_files(files, block_cache=cache))
+    with f:
+        assert read_ranges(f, ranges) == data
+        assert f.read(2**16) == CONTENT[: 2**16]
+    # Served from the local disk
+    assert (
+        sorted(
+            headers["Range"]
+            for _, headers in granule_server.requests
+            if "Range" in headers
+        )
+        == fetched
+    )
+
+
+def test_read_ranges_blockcache_skips_kept_blocks(granule_server):
+    granule_server.files["granule.h5"] = CONTENT
+    (f,) = asyncio.run(
+        open_files(
+            [GranuleFile(granule_server.url("granule.h5"), size=len(CONTENT))],
+            block_size=2**16,
+            cache_type="blockcache",
+        )
+    )
+
+    with f:
+        f.seek(2**16)
+        assert f.read(10) == CONTENT[2**16 : 2**16 + 10]
+        assert read_ranges(f, [(2**16 + 20, 2**16), (0, 10)], max_gap=0) == [
+            CONTENT[2**16 + 20 : 2**17 + 20],
+            CONTENT[:10],
+        ]
+
+    # The kept block is not fetched again
+    assert sorted(headers["Range"] for _, headers in granule_server.requests) == [
+        "bytes=0-65535",
+        "bytes=131072-196607",
+        "bytes=65536-131071",
+    ]
@@ -1,10 +1,38 @@
+import copy
+import json
+import pickle
+import time
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
+import pytest
+from importlib_resources import files
 from prefect import flow
 from prefect.testing.utilities import prefect_test_harness
 
-from prefect_earthdata.tasks import download, search_data
+from prefect_earthdata.tasks import (
+    build_references,
+    download,
+    download_variables,
+    open_data,
+    search_and_download,
+    search_data,
+)
+
+CMR_URL = "https://cmr.earthdata.nasa.gov/search/granules.umm_json?short_name=TEST"
+
+
+def cmr_page(urls):
+    with files("tests.data").joinpath("earthdata_search_response.json").open(
+        "r"
+    ) as search_data_response_file:
+        item = json.load(search_data_response_file)["items"][0]
+    items = []
+    for url in urls:
+        item = copy.deepcopy(item)
+        item["umm"]["RelatedUrls"] = [{"URL": url, "Type": "GET DATA"}]
+        items.append(item)
+    return {"items": items}
 
 
 def test_search_data_and_download(earthdata_credentials_mock):  # noqa
@@ -31,3 +59,159 @@ def test_search_data_and_download(earthdata_credentials_mock):  # noqa
             assert files == exp_files
             for file in files:
                 assert Path(file).exists()
+
+
+async def test_download_rejects_provider(earthdata_credentials_mock):
+    with pytest.raises(ValueError, match="earthaccess.download"):
+        await download.fn(
+            earthdata_credentials_mock,
+            ["s3://bucket/file.h5"],
+            provider="POCLOUD",
+        )
+
+
+def test_search_and_download(
+    earthdata_credentials_mock, mock_earthdata_responses, granule_server, tmp_path
+):
+    granule_server.files = {f"file{i}.h5": b"data" for i in range(5)}
+    urls = [granule_server.url(name) for name in granule_server.files]
+    requested_during_search = []
+
+    def second_page(request, context):
+        # Give the downloads of the first page time to start
+        time.sleep(0.5)
+        requested_during_search.append(len(granule_server.requests))
+        assert request.headers["CMR-Search-After"] == "page-1"
+        context.headers["CMR-Search-After"] = "page-2"
+        return cmr_page(urls[3:])
+
+    mock_earthdata_responses.get(
+        CMR_URL,
+        [
+            {"json": cmr_page(urls[:3]), "headers": {"CMR-Search-After": "page-1"}},
+            {"json": second_page},
+            {"json": {"items": []}},
+        ],
+    )
+
+    @flow
+    def test_flow():
+        return search_and_download(
+            earthdata_credentials_mock,
+            str(tmp_path),
+            page_size=3,
+            queue_size=2,
+            short_name="TEST",
+            download_options={"threads": 2},
+        )
+
+    result = test_flow()
+
+    assert result == [str(tmp_path / name) for name in granule_server.files]
+    assert result.downloaded == 5
+    assert requested_during_search[0] > 0
+
+
+def test_download_variables(earthdata_credentials_mock, granule_server, tmp_path):
+    granule_server.files["granule.h5"] = bytes(range(200))
+    granule_server.files["granule.h5.dmrpp"] = """<?xml version="1.0"?>
+<Dataset xmlns="http://xml.opendap.org/ns/DAP/4.0#"
+    xmlns:dmrpp="http://xml.opendap.org/dap/dmrpp/1.0.0#" name="granule.h5">
+    <Float32 name="height">
+        <dmrpp:chunks><dmrpp:chunk offset="10" nBytes="20"/></dmrpp:chunks>
+    </Float32>
+    <Float32 name="other">
+        <dmrpp:chunks><dmrpp:chunk offset="100" nBytes="100"/></dmrpp:chunks>
+    </Float32>
+</Dataset>""".encode()
+
+    @flow
+    def test_flow():
+        return download_variables(
+            earthdata_credentials_mock,
+            [granule_server.url("granule.h5")],
+            ["height"],
+            str(tmp_path),
+        )
+
+    result = test_flow()
+
+    assert result == [str(tmp_path / "granule.h5.subset.dmrpp")]
+    assert (tmp_path / "granule.h5.subset").read_bytes() == bytes(range(10, 30))
+
+
+def test_build_references(earthdata_credentials_mock, granule_server, tmp_path):
+    granule_server.files["granule.h5"] = bytes(range(200))
+    granule_server.files["granule.h5.dmrpp"] = b"""<?xml version="1.0"?>
+<Dataset xmlns="http://xml.opendap.org/ns/DAP/4.0#"
+    xmlns:dmrpp="http://xml.opendap.org/dap/dmrpp/1.0.0#" name="granule.h5">
+    <UInt8 name="height">
+        <Dim size="20"/>
+        <dmrpp:chunks><dmrpp:chunk offset="10" nBytes="20"/></dmrpp:chunks>
+    </UInt8>
+</Dataset>"""
+    url = granule_server.url("granule.h5")
+
+    @flow
+    def test_flow():
+        return build_references(
+            earthdata_credentials_mock, [url], str(tmp_path / "refs.json")
+        )
+
+    result = test_flow()
+
+    assert result == str(tmp_path / "refs.json")
+    references = json.loads((tmp_path / "refs.json").read_text())
+    assert references["refs"]["granule.h5/height/0"] == [url, 10, 20]
+
+
+def test_open_data(earthdata_credentials_mock, granule_server):
+    granule_server.files["granule.h5"] = b"data" * 1000
+
+    @flow
+    def test_flow():
+        files = open_data(
+            earthdata_credentials_mock,
+            [granule_server.url("granule.h5")],
+            block_size=1000,
+        )
+        with files[0] as f:
+            return f.read()
+
+    assert test_flow() == b"data" * 1000
+
+
+def test_download_in_memory(earthdata_credentials_mock, granule_server):
+    granule_server.files = {"a.h5": b"a" * 10, "b.h5": b"b" * 10}
+
+    @flow
+    def test_flow():
+        buffers = download(
+            earthdata_credentials_mock,
+            [granule_server.url(name) for name in granule_server.files],
+            threads=1,
+            in_memory=True,
+            memory_budget=15,
+        )
+        contents = [(buffer.in_memory, bytes(buffer.getbuffer())) for buffer in buffers]
+        for buffer in buffers:
+            buffer.release()
+        return contents
+
+    assert test_flow() == [(True, b"a" * 10), (False, b"b" * 10)]
+
+
+def test_download_shared_memory(earthdata_credentials_mock, granule_server):
+    granule_server.files = {"a.h5": b"a" * 10}
+
+    @flow
+    def test_flow():
+        (buffer,) = download(
+            earthdata_credentials_mock,
+            [granule_server.url("a.h5")],
+            shared_memory=True,
+        )
+        with buffer, pickle.loads(pickle.dumps(buffer)) as handle:
+            return type(buffer).__name__, bytes(handle.getbuffer())
+
+    assert test_flow() == ("SharedGranuleBuffer", b"a" * 10)